@@ -1,11 +1,13 @@
 import tkinter as tk
 from tkinter import scrolledtext, filedialog, ttk
 import threading
+import multiprocessing
 import ollama
-from PyPDF2 import PdfReader
 import textwrap
 import time
 
+from openrouter_utils import extract_pdf_pages
+
 def create_interface():
     root = tk.Tk()
     root.title("Ollama Chat Interface")
@@ -121,14 +123,11 @@ def remove_pdf():
 
 def extract_pdf_text(file_path, update_progress):
     try:
-        reader = PdfReader(file_path)
-        total_pages = len(reader.pages)
-        extracted_text = []
-        
-        for i, page in enumerate(reader.pages):
-            extracted_text.append(page.extract_text())
-            update_progress((i + 1) / total_pages * 100)
-            
+        # Pages come from the shared extraction cache when the file was seen before
+        extracted_text = extract_pdf_pages(
+            file_path,
+            lambda done, total: update_progress(done / total * 100),
+        )
         return " ".join(extracted_text)
     except Exception as e:
         return f"PDF Error: {str(e)}"
@@ -393,12 +392,16 @@ def initialize_app():
     finally:
         loading_window.destroy()
 
-# Application setup
-app_state = create_interface()
-app_state['chat_history'].tag_config('user', foreground='blue')
-app_state['chat_history'].tag_config('bot', foreground='green')
+# Application setup. Guarded so PDF extraction worker processes can import
+# this module without opening another window.
+if __name__ == "__main__":
+    # Required for the PDF extraction process pool in frozen builds (ollama_gui.spec)
+    multiprocessing.freeze_support()
+    app_state = create_interface()
+    app_state['chat_history'].tag_config('user', foreground='blue')
+    app_state['chat_history'].tag_config('bot', foreground='green')
 
-# Initialize app with loading screen in background thread
-threading.Thread(target=initialize_app).start()
+    # Initialize app with loading screen in background thread
+    threading.Thread(target=initialize_app).start()
 
-app_state['root'].mainloop()
+    app_state['root'].mainloop()
@@ -1,9 +1,170 @@
 import os
+import sys
 import glob
 import json
+import time
+import hashlib
+import tempfile
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import Open_router_basics
 from Open_router_basics import client
-from openrouter_utils import extract_pdf_text, collect_full_response
+from context_window import context_budget
+from openrouter_utils import (
+    extract_pdf_text, count_text_tokens, count_content_tokens, split_token_chunks,
+    file_digest, cached_prefix_content, PromptCacheStats, RateLimiter, CACHE_CONTROL_MODEL_PREFIXES,
+)
+from response_cache import ResponseCache, cached_completion
+
+NOTE_MODEL = "google/gemini-2.0-flash-001"
+MODEL_CONTEXT = getattr(Open_router_basics, "Model_context", {})
+# Context length of NOTE_MODEL, used unless Model_context lists it
+NOTE_MODEL_CONTEXT_LENGTH = 1_048_576
+# Papers longer than the prompt budget are split into parts of at most this
+# many tokens (fewer if the draft leaves less room), summarized separately and merged
+NOTE_CHUNK_TOKENS = 64_000
+# Tokens repeated at the start of each part from the end of the previous one
+NOTE_CHUNK_OVERLAP_TOKENS = 300
+# Below this much room for paper text next to the draft, chunking is pointless
+NOTE_MIN_CHUNK_TOKENS = 1_000
+# Passages per paper sent with --retrieve
+NOTE_RETRIEVAL_TOP_K = 12
+# Default number of papers summarized at the same time in Stage 1
+NOTE_CONCURRENCY = 4
+# Threads extracting PDFs ahead of the API calls (large PDFs also use the process pool)
+NOTE_EXTRACT_WORKERS = 2
+# Bump when the Stage 1 prompt changes so checkpointed summaries are redone
+NOTE_PROMPT_VERSION = 1
+
+
+class ProgressLine:
+    """Single-line progress display with throughput and ETA, safe to update from worker threads."""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.running = 0
+        self.tokens = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def started(self):
+        with self.lock:
+            self.running += 1
+            self.show()
+
+    def finished(self, tokens=0, failed=False):
+        with self.lock:
+            self.running = max(self.running - 1, 0)
+            self.done += 1
+            self.failed += failed
+            self.tokens += tokens
+            self.show()
+
+    def show(self):
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed * 60 if elapsed > 0 else 0
+        if self.done:
+            eta = (self.total - self.done) * elapsed / self.done
+            eta_text = f"{int(eta // 60)}m{int(eta % 60):02d}s"
+        else:
+            eta_text = "--"
+        line = (
+            f"\r[{self.done}/{self.total}] {self.running} in flight, {self.failed} failed | "
+            f"{rate:.1f} papers/min, {self.tokens / elapsed * 60 if elapsed > 0 else 0:,.0f} output tok/min | "
+            f"ETA {eta_text}"
+        )
+        sys.stdout.write(line.ljust(100))
+        sys.stdout.flush()
+
+    def close(self):
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
+class NoteManifest:
+    """
+    Append-only JSONL checkpoint of Stage 1 summaries, kept next to the output file.
+
+    Each line records one finished paper with the SHA-256 of the PDF and of the
+    draft, the model and the prompt version. A paper is skipped on the next run
+    only if all four still match, so new or modified PDFs (or a changed draft,
+    model or prompt) are summarized again. Lines are flushed as each summary
+    completes; a torn last line from a crash is ignored when loading.
+    """
+
+    def __init__(self, output_json):
+        self.path = output_json + ".manifest.jsonl"
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(entry):
+        return (entry["file"], entry["pdf_sha256"], entry["draft_sha256"], entry["model"], entry["prompt_version"])
+
+    def load(self):
+        """Read existing entries; later lines supersede earlier ones for the same key."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return self
+
+    def _add(self, entry):
+        # Re-insert so the dict stays in the order entries were written.
+        key = self.key(entry)
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        return entry["summary"] if entry else None
+
+    def append(self, entry):
+        """Persist one finished summary before returning."""
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self._add(entry)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def compact(self):
+        """Rewrite the file keeping only the newest entry per PDF filename (drops stale and torn lines)."""
+        with self.lock:
+            latest = {}
+            for entry in self.entries.values():
+                latest[entry["file"]] = entry
+            write_atomic(self.path, "".join(json.dumps(entry) + "\n" for entry in latest.values()))
+            self.entries = {self.key(entry): entry for entry in latest.values()}
+
+
+class NoteInterrupted(Exception):
+    """Raised in a Stage 1 worker that reaches a new API call after Ctrl-C."""
+
+
+def write_atomic(path, text):
+    """Write text to a temp file and rename it over path, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 
 def load_draft_text(draft_path):
     """
@@ -23,7 +184,132 @@ def load_draft_text(draft_path):
         with open(draft_path, "r", encoding="utf-8") as f:
             return f.read()
 
-def stage_note_taking(draft_path, pdf_folder, output_json):
+def prompt_tokens(messages):
+    """Token count of a request's messages (text parts only)."""
+    return sum(count_content_tokens(m["content"]) for m in messages)
+
+
+def note_prompt_prefix(paper_draft_text):
+    """Instructions and draft shared by every Stage 1 request."""
+    return (
+        f"Given the following main paper draft and a literature PDF content, "
+        f"generate a condensed technical summary of the literature. Parts that are most relevant "
+        f"to the paper draft should be reproduced in greatest detail, while other parts should be summarized "
+        f"at a higher level. Additionally, list any cited literature that appears highly relevant.\n\n"
+        f"Main Paper Draft:\n{paper_draft_text}\n\n"
+    )
+
+
+def note_messages(paper_draft_text, paper, model=NOTE_MODEL):
+    """
+    Build a Stage 1 prompt: the shared prefix followed by paper-specific text.
+
+    The instructions and draft come first and are identical for every paper,
+    so providers can serve them from their prompt cache; only the content
+    after them differs between requests.
+    """
+    return [
+        {"role": "system", "content": "You are an expert academic research assistant."},
+        {"role": "user", "content": cached_prefix_content(note_prompt_prefix(paper_draft_text), paper, model)}
+    ]
+
+
+def note_taking_messages(paper_draft_text, pdf_file, text, model=NOTE_MODEL):
+    """Build the Stage 1 prompt: the main paper draft combined with one literature PDF."""
+    paper = f"Literature PDF content from file '{os.path.basename(pdf_file)}':\n{text}"
+    return note_messages(paper_draft_text, paper, model)
+
+
+def note_excerpt_messages(paper_draft_text, pdf_file, excerpt, model=NOTE_MODEL):
+    """Build the Stage 1 prompt from the passages of a PDF selected by the retrieval index."""
+    paper = (
+        f"Literature PDF content from file '{os.path.basename(pdf_file)}' (the passages most relevant to "
+        f"the draft, followed by a digest of the rest; summarize the rest at a higher level):\n{excerpt}"
+    )
+    return note_messages(paper_draft_text, paper, model)
+
+
+def note_part_messages(paper_draft_text, pdf_file, text, part, parts, model=NOTE_MODEL):
+    """Prompt for one part of a paper too long for a single request (map step)."""
+    paper = (
+        f"The literature PDF '{os.path.basename(pdf_file)}' is too long to send at once. "
+        f"Below is part {part} of {parts}; summarize this part only, as described above.\n\n"
+        f"Literature PDF content (part {part} of {parts}):\n{text}"
+    )
+    return note_messages(paper_draft_text, paper, model)
+
+
+def note_merge_messages(paper_draft_text, pdf_file, partial_summaries, model=NOTE_MODEL):
+    """Prompt merging summaries of consecutive parts of one paper into a single note (reduce step)."""
+    parts = "\n\n".join(
+        f"Summary of part {number}:\n{summary}" for number, summary in enumerate(partial_summaries, 1)
+    )
+    paper = (
+        f"The literature PDF '{os.path.basename(pdf_file)}' was too long to send at once, so consecutive "
+        f"parts of it were summarized separately. Merge the part summaries below into the single summary "
+        f"described above. The parts overlap slightly: remove repetition, keep every detail relevant to the "
+        f"draft, and combine the lists of cited literature.\n\n{parts}"
+    )
+    return note_messages(paper_draft_text, paper, model)
+
+
+def chunked_note(paper_draft_text, pdf_file, text, complete, pool, budget, model=NOTE_MODEL):
+    """
+    Map-reduce summary of a paper whose prompt does not fit in budget tokens.
+
+    The text is split into overlapping parts that fit next to the draft, the
+    parts are summarized in parallel on pool (map) and the part summaries are
+    merged into one note (reduce), in several rounds if they do not all fit in
+    one merge prompt. complete(messages) makes one API call and returns its text.
+    """
+    room = budget - prompt_tokens(note_part_messages(paper_draft_text, pdf_file, "", 1, 1, model))
+    if room < NOTE_MIN_CHUNK_TOKENS:
+        raise ValueError(f"the draft leaves only {room} of {budget} prompt tokens for the paper")
+    chunks = split_token_chunks(text, min(NOTE_CHUNK_TOKENS, room), NOTE_CHUNK_OVERLAP_TOKENS)
+    partials = list(pool.map(
+        lambda numbered: complete(
+            note_part_messages(paper_draft_text, pdf_file, numbered[1], numbered[0], len(chunks), model)
+        ),
+        enumerate(chunks, 1),
+    ))
+
+    merge_room = budget - prompt_tokens(note_merge_messages(paper_draft_text, pdf_file, [], model))
+    while len(partials) > 1:
+        # Consecutive summaries are grouped while they fit; a group takes at
+        # least two, so every round at least halves the count.
+        groups = [[]]
+        used = 0
+        for summary in partials:
+            # Counted with its label and separator as laid out in the merge prompt
+            tokens = count_text_tokens(f"Summary of part {len(partials)}:\n{summary}\n\n")
+            if len(groups[-1]) >= 2 and used + tokens > merge_room:
+                groups.append([])
+                used = 0
+            groups[-1].append(summary)
+            used += tokens
+        partials = list(pool.map(
+            lambda group: group[0] if len(group) == 1
+            else complete(note_merge_messages(paper_draft_text, pdf_file, group, model)),
+            groups,
+        ))
+    return partials[0]
+
+
+def note_prompt_version(budget, retrieve_top_k=0):
+    """
+    Everything besides the PDF, draft and model that shapes a Stage 1 summary:
+    the prompt version, the prompt budget and part sizes deciding whether and
+    how a paper is split, and the retrieval setting.
+    """
+    version = f"{NOTE_PROMPT_VERSION}/budget{budget}/parts{NOTE_CHUNK_TOKENS}-{NOTE_CHUNK_OVERLAP_TOKENS}"
+    if retrieve_top_k:
+        version += f"/top{retrieve_top_k}"
+    return version
+
+
+def stage_note_taking(draft_path, pdf_folder, output_json, cache=None, refresh=False,
+                      concurrency=NOTE_CONCURRENCY, rpm=0, tpm=0, resume=True, max_prompt_tokens=0,
+                      retrieve_top_k=0):
     """
     Stage 1: Note Taking.
     
@@ -32,7 +318,28 @@ def stage_note_taking(draft_path, pdf_folder, output_json):
     to generate a condensed technical summary. The summary emphasizes those parts most relevant
     to the paper draft while noting influential cited literature.
     
+    PDFs are extracted on a small thread pool while up to `concurrency` API calls
+    are in flight, each waiting on the requests/minute (rpm) and tokens/minute
+    (tpm) limits first (0 = unlimited). With cache_control models the first call
+    goes out alone until its first token, so the shared draft prefix is cached
+    by the provider before the rest start; cached vs.
+    uncached input tokens from the usage reports are printed at the end.
+    
+    A paper whose prompt exceeds the model's context budget (or max_prompt_tokens)
+    is summarized in overlapping parts that are merged into one note (see chunked_note).
+    
+    With retrieve_top_k, a local BM25 index of all PDFs (retrieval_index.py) picks
+    the passages most relevant to the draft's sections, and only those plus a
+    short digest of the remainder are sent.
+    
+    Every summary is checkpointed to `<output_json>.manifest.jsonl` as soon as it
+    arrives. With resume, papers whose PDF, draft, model and prompt version match
+    a checkpointed entry are not sent again, so an interrupted run picks up where
+    it stopped and re-runs only process new or modified PDFs.
+    
     The resulting summaries are stored as a JSON mapping (pdf filename → summary).
+    With a response cache, papers whose prompt is unchanged reuse the stored summary
+    unless refresh is set.
     """
     # Load the main paper draft (handles both PDF and text formats).
     paper_draft_text = load_draft_text(draft_path)
@@ -43,54 +350,162 @@ def stage_note_taking(draft_path, pdf_folder, output_json):
         print(f"No PDF files found in folder: {pdf_folder}")
         return
 
-    results = {}
-
-    # Process each PDF file sequentially.
+    manifest = NoteManifest(output_json)
+    if resume:
+        manifest.load()
+    budget = context_budget(NOTE_MODEL, {NOTE_MODEL: NOTE_MODEL_CONTEXT_LENGTH, **MODEL_CONTEXT}, max_prompt_tokens)
+    prompt_version = note_prompt_version(budget, retrieve_top_k)
+    draft_sha256 = hashlib.sha256(paper_draft_text.encode("utf-8")).hexdigest()
+    summaries = {}
+    entries = {}
+    pending = []
     for pdf_file in pdf_files:
-        try:
-            # Use the legacy extraction method from the utility.
-            text = extract_pdf_text(pdf_file)
-        except Exception as e:
-            print(f"Error processing {pdf_file}: {e}")
-            continue
-
-        # Build the prompt: combine the main paper draft with the literature PDF content.
-        prompt = (
-            f"Given the following main paper draft and a literature PDF content, "
-            f"generate a condensed technical summary of the literature. Parts that are most relevant "
-            f"to the paper draft should be reproduced in greatest detail, while other parts should be summarized "
-            f"at a higher level. Additionally, list any cited literature that appears highly relevant.\n\n"
-            f"Main Paper Draft:\n{paper_draft_text}\n\n"
-            f"Literature PDF content from file '{os.path.basename(pdf_file)}':\n{text}"
-        )
-        
-        messages = [
-            {"role": "system", "content": "You are an expert academic research assistant."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        try:
+        entries[pdf_file] = {
+            "file": os.path.basename(pdf_file),
+            "pdf_sha256": file_digest(pdf_file),
+            "draft_sha256": draft_sha256,
+            "model": NOTE_MODEL,
+            "prompt_version": prompt_version,
+        }
+        summary = manifest.get(NoteManifest.key(entries[pdf_file]))
+        if summary is None:
+            pending.append(pdf_file)
+        else:
+            summaries[pdf_file] = summary
+    if summaries:
+        print(f"Resuming: {len(summaries)} of {len(pdf_files)} papers unchanged since the last run")
+
+    prepare = extract_pdf_text
+    # Papers reduced to retrieved passages -> (full text tokens, tokens sent)
+    excerpts = {}
+    if retrieve_top_k and pending:
+        from retrieval_index import RetrievalIndex, draft_sections
+
+        index = RetrievalIndex.load_or_build(pdf_files)
+        queries = index.queries(draft_sections(paper_draft_text))
+
+        def prepare(pdf_file):
+            excerpt = index.excerpt(pdf_file, queries, retrieve_top_k)
+            if excerpt is None:
+                return extract_pdf_text(pdf_file)
+            excerpts[pdf_file] = (index.file_tokens(pdf_file), count_text_tokens(excerpt))
+            return excerpt
+
+    # Set on Ctrl-C: workers already running must not start new (paid) requests.
+    interrupted = threading.Event()
+    limiter = RateLimiter(rpm, tpm, cancel=interrupted)
+    # Caps API calls in flight, whole papers and parts of long papers alike
+    in_flight = threading.BoundedSemaphore(max(concurrency, 1))
+    progress = ProgressLine(len(pending))
+    prompt_cache = PromptCacheStats()
+    # For models with cache_control, the first call goes out alone until its
+    # first token arrives: by then the provider has cached the shared draft
+    # prefix, which concurrent first calls would all miss. Other models are
+    # not held back.
+    first_call = threading.Lock()
+    prefix_cached = threading.Event()
+    if not NOTE_MODEL.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+        prefix_cached.set()
+
+    def summarize(pdf_file, text):
+        if first_call.acquire(blocking=False):
+            try:
+                return call_model(pdf_file, text)
+            finally:
+                prefix_cached.set()
+        prefix_cached.wait()
+        return call_model(pdf_file, text)
+
+    def complete(messages):
+        if not limiter.acquire(prompt_tokens(messages)):
+            raise NoteInterrupted()
+        with in_flight:
+            # Checked last thing before the request: the wait for a slot may have outlasted Ctrl-C.
+            if interrupted.is_set():
+                raise NoteInterrupted()
+            request_start = time.monotonic()
             # Call the OpenRouter API using streaming mode and aggregate the response.
-            response_stream = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=messages,
-                stream=True,
+            text = cached_completion(
+                client, NOTE_MODEL, messages, cache, refresh,
+                on_usage=lambda usage: prompt_cache.add(usage, time.monotonic() - request_start),
+                on_first_token=prefix_cached.set,
             )
-            summary = collect_full_response(response_stream)
-        except Exception as e:
-            print(f"Error during API call for {pdf_file}: {e}")
-            summary = f"Error: {e}"
+        limiter.charge(count_text_tokens(text))
+        return text
 
-        results[os.path.basename(pdf_file)] = summary
-        print(f"Processed {os.path.basename(pdf_file)}")
+    def call_model(pdf_file, text):
+        progress.started()
+        try:
+            build = note_excerpt_messages if pdf_file in excerpts else note_taking_messages
+            messages = build(paper_draft_text, pdf_file, text, NOTE_MODEL)
+            if prompt_tokens(messages) > budget:
+                summary = chunked_note(paper_draft_text, pdf_file, text, complete, part_pool, budget, NOTE_MODEL)
+            else:
+                summary = complete(messages)
+        except Exception as e:
+            progress.finished(failed=True)
+            return f"Error: {e}", f"Error during API call for {pdf_file}: {e}"
+        # Failed papers are not checkpointed, so the next run retries them.
+        manifest.append(dict(entries[pdf_file], summary=summary,
+                             completed=time.strftime("%Y-%m-%dT%H:%M:%S")))
+        progress.finished(count_text_tokens(summary))
+        return summary, None
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=NOTE_EXTRACT_WORKERS) as extract_pool, \
+            ThreadPoolExecutor(max_workers=max(concurrency, 1)) as call_pool, \
+            ThreadPoolExecutor(max_workers=max(concurrency, 1)) as part_pool:
+        try:
+            # Each paper's API call is queued as soon as its text is ready, so
+            # extraction of later papers overlaps with calls already in flight.
+            extractions = {extract_pool.submit(prepare, pdf_file): pdf_file for pdf_file in pending}
+            calls = {}
+            for future in as_completed(extractions):
+                pdf_file = extractions[future]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    errors.append(f"Error processing {pdf_file}: {e}")
+                    progress.finished(failed=True)
+                    continue
+                calls[call_pool.submit(summarize, pdf_file, text)] = pdf_file
+            for future in as_completed(calls):
+                summaries[calls[future]], error = future.result()
+                if error:
+                    errors.append(error)
+        except KeyboardInterrupt:
+            # Drop queued work and stop started workers before their next request;
+            # calls already sent finish (and are checkpointed) on the way out.
+            interrupted.set()
+            prefix_cached.set()
+            for pool in (extract_pool, call_pool, part_pool):
+                pool.shutdown(wait=False, cancel_futures=True)
+    progress.close()
+    if interrupted.is_set():
+        print(f"Interrupted; finished summaries are checkpointed in {manifest.path}. "
+              f"Run the same command again to resume.")
+        raise SystemExit(130)
+    for error in errors:
+        print(error)
+    manifest.compact()
+
+    # Keep the folder order in the output regardless of completion order.
+    results = {os.path.basename(pdf_file): summaries[pdf_file] for pdf_file in pdf_files if pdf_file in summaries}
 
     # Save the gathered summaries to a JSON file.
-    with open(output_json, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2)
+    write_atomic(output_json, json.dumps(results, indent=2))
+    print(f"Processed {len(pending)} of {len(pdf_files)} papers in {time.monotonic() - progress.start:.1f}s")
+    if pending:
+        print(f"Prompt cache: {prompt_cache.summary()}")
+    if excerpts:
+        full_tokens = sum(full for full, _ in excerpts.values())
+        sent_tokens = sum(sent for _, sent in excerpts.values())
+        print(f"Retrieval: sent {sent_tokens:,} of {full_tokens:,} paper tokens "
+              f"({sent_tokens / max(full_tokens, 1) * 100:.1f}%) for {len(excerpts)} papers")
     print(f"Stage 1 summary results saved to {output_json}")
 
 
-def stage_triangulation(draft_path, summaries_json, output_file):
+def stage_triangulation(draft_path, summaries_json, output_file, cache=None, refresh=False):
     """
     Stage 2: Triangulation.
     
@@ -127,12 +542,7 @@ def stage_triangulation(draft_path, summaries_json, output_file):
     ]
 
     try:
-        response_stream = client.chat.completions.create(
-            model="openai/o3-mini-high",
-            messages=messages,
-            stream=True,
-        )
-        triangulation_notes = collect_full_response(response_stream)
+        triangulation_notes = cached_completion(client, "openai/o3-mini-high", messages, cache, refresh)
     except Exception as e:
         print(f"Error during API call for triangulation: {e}")
         triangulation_notes = f"Error: {e}"
@@ -143,7 +553,7 @@ def stage_triangulation(draft_path, summaries_json, output_file):
     print(f"Stage 2 triangulation notes saved to {output_file}")
 
 
-def stage_writing(draft_path, summaries_json, triangulation_file, output_file):
+def stage_writing(draft_path, summaries_json, triangulation_file, output_file, cache=None, refresh=False):
     """
     Stage 3: Writing.
     
@@ -184,12 +594,7 @@ def stage_writing(draft_path, summaries_json, triangulation_file, output_file):
     ]
 
     try:
-        response_stream = client.chat.completions.create(
-            model="openai/o3-mini-high",
-            messages=messages,
-            stream=True,
-        )
-        final_review = collect_full_response(response_stream)
+        final_review = cached_completion(client, "openai/o3-mini-high", messages, cache, refresh)
     except Exception as e:
         print(f"Error during API call for writing: {e}")
         final_review = f"Error: {e}"
@@ -206,20 +611,33 @@ def main():
     )
     subparsers = parser.add_subparsers(dest="stage", help="Stage of literature review process")
 
+    # Response cache options shared by all stages
+    cache_options = argparse.ArgumentParser(add_help=False)
+    cache_options.add_argument("--cache", action="store_true", help="Reuse cached responses for identical prompts")
+    cache_options.add_argument("--refresh", action="store_true", help="With --cache: ignore cached responses but store fresh ones")
+    cache_options.add_argument("--cache-ttl", type=float, default=7, help="With --cache: days before a cached response expires")
+
     # Subparser for Stage 1 (Note Taking)
-    parser_note = subparsers.add_parser("note", help="Stage 1: Note Taking for PDFs")
+    parser_note = subparsers.add_parser("note", help="Stage 1: Note Taking for PDFs", parents=[cache_options])
     parser_note.add_argument("--draft", required=True, help="Path to main paper draft (PDF or text file)")
     parser_note.add_argument("--pdf_folder", required=True, help="Path to folder containing literature PDFs")
     parser_note.add_argument("--output", default="summaries.json", help="Output JSON file for summaries")
+    parser_note.add_argument("--concurrency", type=int, default=NOTE_CONCURRENCY, help="Papers summarized in parallel")
+    parser_note.add_argument("--rpm", type=float, default=0, help="Maximum API requests per minute (0 = unlimited)")
+    parser_note.add_argument("--tpm", type=float, default=0, help="Maximum prompt + output tokens per minute (0 = unlimited)")
+    parser_note.add_argument("--max-prompt-tokens", type=int, default=0, help="Split papers whose prompt exceeds this many tokens (default: the model's context)")
+    parser_note.add_argument("--retrieve", action="store_true", help="Send only the passages most relevant to the draft (needs numpy and scipy)")
+    parser_note.add_argument("--top-k", type=int, default=NOTE_RETRIEVAL_TOP_K, help="With --retrieve: passages sent per paper")
+    parser_note.add_argument("--restart", action="store_true", help="Ignore checkpointed summaries and process every paper again")
 
     # Subparser for Stage 2 (Triangulation)
-    parser_tri = subparsers.add_parser("triangulate", help="Stage 2: Triangulation to produce analytical notes")
+    parser_tri = subparsers.add_parser("triangulate", help="Stage 2: Triangulation to produce analytical notes", parents=[cache_options])
     parser_tri.add_argument("--draft", required=True, help="Path to main paper draft (PDF or text file)")
     parser_tri.add_argument("--summaries", required=True, help="JSON file containing summaries from Stage 1")
     parser_tri.add_argument("--output", default="triangulation_notes.txt", help="Output file for triangulation notes")
 
     # Subparser for Stage 3 (Writing)
-    parser_write = subparsers.add_parser("write", help="Stage 3: Writing final literature review")
+    parser_write = subparsers.add_parser("write", help="Stage 3: Writing final literature review", parents=[cache_options])
     parser_write.add_argument("--draft", required=True, help="Path to main paper draft (PDF or text file)")
     parser_write.add_argument("--summaries", required=True, help="JSON file containing summaries from Stage 1")
     parser_write.add_argument("--triangulation", required=True, help="File containing triangulation notes from Stage 2")
@@ -227,15 +645,25 @@ def main():
 
     args = parser.parse_args()
 
+    cache = None
+    if getattr(args, "cache", False):
+        cache = ResponseCache(ttl=args.cache_ttl * 24 * 3600)
+
     if args.stage == "note":
-        stage_note_taking(args.draft, args.pdf_folder, args.output)
+        stage_note_taking(args.draft, args.pdf_folder, args.output, cache, args.refresh,
+                          args.concurrency, args.rpm, args.tpm, resume=not args.restart,
+                          max_prompt_tokens=args.max_prompt_tokens,
+                          retrieve_top_k=args.top_k if args.retrieve else 0)
     elif args.stage == "triangulate":
-        stage_triangulation(args.draft, args.summaries, args.output)
+        stage_triangulation(args.draft, args.summaries, args.output, cache, args.refresh)
     elif args.stage == "write":
-        stage_writing(args.draft, args.summaries, args.triangulation, args.output)
+        stage_writing(args.draft, args.summaries, args.triangulation, args.output, cache, args.refresh)
     else:
         parser.print_help()
 
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
+
 
 if __name__ == "__main__":
     main() 
@@ -1,22 +1,28 @@
 import tkinter as tk
 from tkinter import scrolledtext, filedialog, ttk, font, messagebox
 import threading
-import openai
-import io
-import base64
-from PIL import Image, ImageTk
-import re
+import queue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import os
-from PyPDF2 import PdfReader
-import textwrap
-import markdown
 import tkhtmlview
-import tiktoken
-import mimetypes   # <-- Added for MIME type guessing
-import json
-from datetime import datetime
+import time
 
 import Open_router_basics
+from openrouter_utils import (
+    iter_stream_deltas, estimate_tokens, format_bytes, IMAGE_MAX_EDGE, warm_connection_async, warm_tokenizer_async,
+    IMAGE_POLICY_ALL, IMAGE_POLICY_CURRENT, IMAGE_POLICY_LAST_N,
+)
+from chat_render import ChatRenderer
+from chat_view import ChatView
+from chat_archive import ChatArchive, ArchiveNamer, provisional_name
+from chat_session import ChatSession, format_result
+from response_cache import ResponseCache
+from request_timing import SpanLog
+from context_window import (
+    fetch_context_lengths, CONTEXT_STRATEGY_FULL, CONTEXT_STRATEGY_SLIDING, CONTEXT_STRATEGY_PIN_FIRST,
+    CONTEXT_STRATEGY_SUMMARY,
+)
 
 # Initialize OpenRouter client
 client = Open_router_basics.client
@@ -27,12 +33,48 @@ MODEL_LIST = Open_router_basics.Model_list
 # Model pricing information ($/million tokens)
 MODEL_PRICING = Open_router_basics.Model_cost
 
+# Model context lengths (tokens); optional in Open_router_basics
+MODEL_CONTEXT = getattr(Open_router_basics, "Model_context", {})
+
+# Context strategies offered in the left panel
+CONTEXT_STRATEGY_OPTIONS = {
+    "Sliding window": CONTEXT_STRATEGY_SLIDING,
+    "Pin first turn": CONTEXT_STRATEGY_PIN_FIRST,
+    "Rolling summary": CONTEXT_STRATEGY_SUMMARY,
+    "Full history": CONTEXT_STRATEGY_FULL,
+}
+
+# Image history policies offered in the attachments panel
+IMAGE_POLICY_OPTIONS = {
+    "Current turn only": IMAGE_POLICY_CURRENT,
+    "Last N image turns": IMAGE_POLICY_LAST_N,
+    "All turns": IMAGE_POLICY_ALL,
+}
+
+# Upper bound on concurrent requests in the model comparison window
+COMPARE_MAX_WORKERS = 8
+
+# Environment variable holding the launch time when startup is being benchmarked
+STARTUP_PROBE_ENV = "OPENROUTER_GUI_STARTUP_PROBE"
+
+# Minimum delay between chat repaints while a response is streaming (~30 fps)
+STREAM_FRAME_INTERVAL_MS = 33
+
 class OpenRouterGUI:
     def __init__(self, root):
-        # Initialize token counters and session cost tracking before any UI setup calls
-        self.total_input_tokens = 0  # Initialize input tokens to 0
-        self.total_output_tokens = 0  # Initialize output tokens to 0
-        self.total_cost = 0.0         # Initialize session cost to 0.0
+        # The session (history, attachments, token and cost totals) exists before any UI setup calls
+        self.response_cache = ResponseCache()
+        # Per-request timing spans, appended to a rotating JSONL file
+        self.span_log = SpanLog()
+        self.render_seconds = 0.0
+        self.session_events = queue.Queue()
+        self.session = ChatSession(
+            client,
+            model_context=MODEL_CONTEXT,
+            model_pricing=MODEL_PRICING,
+            response_cache=self.response_cache,
+            events=self.session_events,
+        )
 
         self.root = root
         self.root.title("OpenRouter Chat Interface")
@@ -59,13 +101,49 @@ class OpenRouterGUI:
         self.setup_left_panel()
         self.setup_right_panel()
         
-        # Initialize state variables
-        self.attached_files = []
-        self.conversation_history = []
-        self.is_processing = False
+        # Memoized per-message HTML fragments, inserted incrementally into the chat display
+        self.renderer = ChatRenderer()
+        self.chat_view = ChatView(self.chat_display, self.renderer)
+        
+        # Archived chats (imports chat_archives.json on first run)
+        self.archive = ChatArchive()
+        self.archive_namer = ArchiveNamer(self.archive, client, on_named=self.on_archive_named)
         
         # Apply styling
         self.apply_styling()
+        
+        # Heavy work starts once the window is up
+        self.root.after_idle(self.warm_up)
+        # Session events are applied on the Tk thread, at most one repaint per frame
+        self.poll_session_events()
+    
+    @property
+    def conversation_history(self):
+        return self.session.history
+    
+    @property
+    def attached_files(self):
+        return self.session.attached_files
+    
+    def warm_up(self):
+        """Load the tokenizer and open the API connection (DNS + TLS) while the user is still typing."""
+        warm_tokenizer_async()
+        # Building the lazy client here also moves the openai import off the Tk thread
+        warm_connection_async(client, on_done=self.on_connection_warmed)
+        threading.Thread(target=self.load_context_lengths, daemon=True).start()
+
+    def load_context_lengths(self):
+        # Runs on a background thread; until it finishes, models missing from
+        # Model_context get the full history.
+        lengths = fetch_context_lengths(client)
+        if lengths:
+            # Configured lengths take precedence over OpenRouter's.
+            self.session.model_context = {**lengths, **MODEL_CONTEXT}
+    
+    def on_connection_warmed(self, seconds):
+        # Called from the warm-up thread
+        if seconds is not None and not self.session.is_processing:
+            self.root.after(0, lambda: self.update_status(f"Ready (API connection warmed in {seconds * 1000:.0f} ms)"))
     
     def apply_styling(self):
         # Configure tags for the chat display
@@ -79,7 +157,7 @@ class OpenRouterGUI:
         button_style = {"bg": "#4a86e8", "fg": "white", "padx": 10, "pady": 5, 
                         "font": ("Helvetica", 10), "relief": tk.RAISED}
         
-        for btn in [self.send_button, self.attach_image_btn, self.attach_pdf_btn, 
+        for btn in [self.send_button, self.stop_button, self.attach_image_btn, self.attach_pdf_btn, 
                     self.clear_button, self.remove_file_btn]:
             for key, value in button_style.items():
                 btn.config(**{key: value})
@@ -94,6 +172,10 @@ class OpenRouterGUI:
         model_dropdown.pack(fill=tk.X)
         model_dropdown.bind("<<ComboboxSelected>>", self.update_cost_display)
         
+        self.stream_var = tk.BooleanVar(value=True)
+        stream_check = tk.Checkbutton(model_frame, text="Stream responses", variable=self.stream_var, bg="#e0e0e0", anchor=tk.W)
+        stream_check.pack(fill=tk.X, pady=(5, 0))
+        
         # System prompt section
         system_frame = tk.LabelFrame(self.left_panel, text="System Prompt", bg="#e0e0e0", padx=10, pady=10)
         system_frame.pack(fill=tk.X, padx=10, pady=10, expand=False)
@@ -102,6 +184,30 @@ class OpenRouterGUI:
         self.system_prompt.pack(fill=tk.X)
         self.system_prompt.insert(tk.END, "You are a helpful assistant.")
         
+        # Context window section
+        context_frame = tk.LabelFrame(self.left_panel, text="Context Window", bg="#e0e0e0", padx=10, pady=10)
+        context_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.context_strategy_var = tk.StringVar(value="Sliding window")
+        ttk.Combobox(context_frame, textvariable=self.context_strategy_var, values=list(CONTEXT_STRATEGY_OPTIONS),
+                     state="readonly", width=25).pack(fill=tk.X)
+        
+        budget_frame = tk.Frame(context_frame, bg="#e0e0e0")
+        budget_frame.pack(fill=tk.X, pady=(5, 0))
+        tk.Label(budget_frame, text="Token budget (0 = model max):", bg="#e0e0e0", anchor=tk.W).pack(side=tk.LEFT)
+        self.context_budget_var = tk.IntVar(value=0)
+        tk.Spinbox(budget_frame, from_=0, to=2_000_000, increment=1000, textvariable=self.context_budget_var, width=9).pack(side=tk.RIGHT)
+        
+        self.context_report_label = tk.Label(context_frame, text="", bg="#e0e0e0", anchor=tk.W, justify=tk.LEFT)
+        self.context_report_label.pack(fill=tk.X, pady=(5, 0))
+        
+        # Where the last request's time went
+        timing_frame = tk.LabelFrame(self.left_panel, text="Last Request Timing", bg="#e0e0e0", padx=10, pady=10)
+        timing_frame.pack(fill=tk.X, padx=10, pady=10)
+        self.timing_label = tk.Label(timing_frame, text="-", bg="#e0e0e0", anchor=tk.W, justify=tk.LEFT,
+                                     font=("Courier", 9))
+        self.timing_label.pack(fill=tk.X)
+        
         # File attachments section
         attachments_frame = tk.LabelFrame(self.left_panel, text="Attachments", bg="#e0e0e0", padx=10, pady=10)
         attachments_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -121,6 +227,21 @@ class OpenRouterGUI:
         self.file_listbox = tk.Listbox(attachments_frame, selectmode=tk.SINGLE, height=5)
         self.file_listbox.pack(fill=tk.X)
         
+        edge_frame = tk.Frame(attachments_frame, bg="#e0e0e0")
+        edge_frame.pack(fill=tk.X, pady=(5, 0))
+        tk.Label(edge_frame, text="Max image edge (px):", bg="#e0e0e0", anchor=tk.W).pack(side=tk.LEFT)
+        self.image_max_edge_var = tk.IntVar(value=IMAGE_MAX_EDGE)
+        tk.Spinbox(edge_frame, from_=256, to=4096, increment=256, textvariable=self.image_max_edge_var, width=6).pack(side=tk.RIGHT)
+        
+        policy_frame = tk.Frame(attachments_frame, bg="#e0e0e0")
+        policy_frame.pack(fill=tk.X, pady=(5, 0))
+        tk.Label(policy_frame, text="Resend images:", bg="#e0e0e0", anchor=tk.W).pack(side=tk.LEFT)
+        self.image_keep_var = tk.IntVar(value=2)
+        tk.Spinbox(policy_frame, from_=1, to=20, textvariable=self.image_keep_var, width=3).pack(side=tk.RIGHT)
+        self.image_policy_var = tk.StringVar(value="Last N image turns")
+        ttk.Combobox(policy_frame, textvariable=self.image_policy_var, values=list(IMAGE_POLICY_OPTIONS),
+                     state="readonly", width=18).pack(side=tk.RIGHT, padx=(5, 5))
+        
         # Cost tracking section
         cost_frame = tk.LabelFrame(self.left_panel, text="Session Cost Tracker", bg="#e0e0e0", padx=10, pady=10)
         cost_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -159,6 +280,10 @@ class OpenRouterGUI:
         self.output_tokens_label = tk.Label(token_info_frame, text="0", bg="#e0e0e0", anchor=tk.W)
         self.output_tokens_label.grid(row=1, column=1, sticky=tk.W)
         
+        tk.Label(token_info_frame, text="Request:", bg="#e0e0e0", width=10, anchor=tk.W).grid(row=2, column=0, sticky=tk.W)
+        self.request_size_label = tk.Label(token_info_frame, text="-", bg="#e0e0e0", anchor=tk.W)
+        self.request_size_label.grid(row=2, column=1, sticky=tk.W)
+        
         # Total cost
         cost_total_frame = tk.Frame(cost_frame, bg="#e0e0e0")
         cost_total_frame.pack(fill=tk.X, pady=5)
@@ -167,6 +292,17 @@ class OpenRouterGUI:
         self.total_cost_label = tk.Label(cost_total_frame, text="$0.00", bg="#e0e0e0", font=("Helvetica", 10, "bold"), anchor=tk.W)
         self.total_cost_label.grid(row=0, column=1, sticky=tk.W)
         
+        # Response cache (opt-in)
+        cache_frame = tk.Frame(cost_frame, bg="#e0e0e0")
+        cache_frame.pack(fill=tk.X, pady=5)
+        
+        self.response_cache_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(cache_frame, text="Cache responses", variable=self.response_cache_var, bg="#e0e0e0", anchor=tk.W).pack(fill=tk.X)
+        self.cache_bypass_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(cache_frame, text="Bypass cache for next send", variable=self.cache_bypass_var, bg="#e0e0e0", anchor=tk.W).pack(fill=tk.X)
+        self.cache_stats_label = tk.Label(cache_frame, text="Cache: 0 hits / 0 misses", bg="#e0e0e0", anchor=tk.W)
+        self.cache_stats_label.pack(fill=tk.X)
+        
         # Session control
         control_frame = tk.Frame(self.left_panel, bg="#e0e0e0", padx=10, pady=10)
         control_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -181,6 +317,9 @@ class OpenRouterGUI:
         self.view_history_button = tk.Button(control_frame, text="View History", command=self.view_history)
         self.view_history_button.pack(fill=tk.X, pady=(5, 0))
         
+        self.compare_button = tk.Button(control_frame, text="Compare Models", command=self.open_compare_window)
+        self.compare_button.pack(fill=tk.X, pady=(5, 0))
+        
         # Status indicator
         self.status_label = tk.Label(self.left_panel, text="Ready", bg="#e0e0e0", anchor=tk.W)
         self.status_label.pack(fill=tk.X, padx=10, pady=(0, 10))
@@ -210,6 +349,9 @@ class OpenRouterGUI:
         
         self.send_button = tk.Button(input_frame, text="Send", command=self.send_message)
         self.send_button.pack(side=tk.RIGHT)
+        
+        self.stop_button = tk.Button(input_frame, text="Stop", command=self.stop_generation)
+        self.stop_button.pack(side=tk.RIGHT, padx=(0, 5))
     
     def attach_image(self):
         file_path = filedialog.askopenfilename(
@@ -217,8 +359,7 @@ class OpenRouterGUI:
             filetypes=[("Image Files", "*.png *.jpg *.jpeg *.gif *.bmp")]
         )
         if file_path:
-            self.attached_files.append({"type": "image", "path": file_path})
-            self.file_listbox.insert(tk.END, f"Image: {os.path.basename(file_path)}")
+            self.session.attach("image", file_path)
     
     def attach_pdf(self):
         file_path = filedialog.askopenfilename(
@@ -226,279 +367,146 @@ class OpenRouterGUI:
             filetypes=[("PDF Files", "*.pdf")]
         )
         if file_path:
-            self.attached_files.append({"type": "pdf", "path": file_path})
-            self.file_listbox.insert(tk.END, f"PDF: {os.path.basename(file_path)}")
+            self.session.attach("pdf", file_path)
     
     def remove_file(self):
         selection = self.file_listbox.curselection()
         if selection:
-            index = selection[0]
-            self.file_listbox.delete(index)
-            del self.attached_files[index]
+            self.session.remove_attachment(selection[0])
+    
+    def refresh_attachment_list(self):
+        self.file_listbox.delete(0, tk.END)
+        for file in self.session.attached_files:
+            label = "Image" if file["type"] == "image" else "PDF"
+            self.file_listbox.insert(tk.END, f"{label}: {os.path.basename(file['path'])}")
     
     def clear_session(self):
-        self.conversation_history = []
-        self.chat_display.set_html("<html><body></body></html>")
+        # Resets history, context summary and token/cost tracking
+        if not self.session.reset():
+            self.update_status("Wait for the current response (or Stop it) before starting a new session")
+            return
+        self.chat_view.clear()
         self.status_label.config(text="Session Cleared")
         self.progress['value'] = 0
-        
-        # Reset token and cost tracking
-        self.total_output_tokens = 0
-        self.total_cost = 0.0
         self.update_cost_display()
     
-    def extract_pdf_text(self, file_path):
-        try:
-            reader = PdfReader(file_path)
-            extracted_text = []
-            
-            for page in reader.pages:
-                extracted_text.append(page.extract_text())
-                
-            return " ".join(extracted_text)
-        except Exception as e:
-            return f"PDF Error: {str(e)}"
-    
-    def encode_image(self, image_path):
-        # Open and encode the image with a data URI prefix based on its MIME type.
-        mime_type, _ = mimetypes.guess_type(image_path)
-        if mime_type is None:
-            mime_type = "image/jpeg"  # default MIME type if unknown
-        with open(image_path, "rb") as image_file:
-            encoded = base64.b64encode(image_file.read()).decode('utf-8')
-        return f"data:{mime_type};base64,{encoded}"
-    
-    def prepare_messages(self, user_input):
-        messages = []
-
-        # Add system message if provided
-        system_content = self.system_prompt.get("1.0", tk.END).strip()
-        if system_content:
-            messages.append({"role": "system", "content": system_content})
-
-        # Add conversation history
-        for msg in self.conversation_history:
-            messages.append(msg)
-
-        # Build the user message as a single plain text string.
-        message_content = user_input
-
-        # Process file attachments:
-        for file in self.attached_files:
-            if file["type"] == "image":
-                try:
-                    # (Optionally, you could include image data here if supported.)
-                    # For now, simply add a marker to inform the user and model.
-                    message_content += f"\n[Image Attached: {os.path.basename(file['path'])}]"
-                except Exception as e:
-                    self.update_status(f"Error processing image: {str(e)}")
-            
-            elif file["type"] == "pdf":
-                try:
-                    # Instead of appending the full PDF text, add a marker.
-                    message_content += f"\n[PDF Attached: {os.path.basename(file['path'])}]"
-                except Exception as e:
-                    self.update_status(f"Error processing PDF: {str(e)}")
-
-        # Append the plain-text user message.
-        messages.append({"role": "user", "content": message_content})
-        return messages
-    
     def update_status(self, text):
         self.status_label.config(text=text)
         self.root.update_idletasks()
     
-    def get_rendered_chat_html(self):
-        # Generate HTML content based on conversation history
-        html_content = "<html><body style='font-family: Helvetica, Arial, sans-serif;'>"
-        for msg in self.conversation_history:
-            if msg["role"] == "user":
-                html_content += (
-                    "<div style='margin: 10px 0; padding: 10px; "
-                    "background-color: #e6f2ff; border-radius: 10px;'>"
-                )
-                html_content += "<strong>You:</strong><br/>"
-                content_to_display = msg.get("display", msg.get("content", ""))
-                text_with_br = content_to_display.replace('\n', '<br/>')
-                html_content += text_with_br
-                html_content += "</div>"
-            elif msg["role"] == "assistant":
-                html_content += (
-                    "<div style='margin: 10px 0; padding: 10px; "
-                    "background-color: #f0f0f0; border-radius: 10px;'>"
-                )
-                html_content += "<strong>Assistant:</strong><br/>"
-                md_content = msg["content"]
-                html_from_md = markdown.markdown(md_content, extensions=['fenced_code', 'tables'])
-                html_content += html_from_md
-                html_content += "</div>"
-            elif msg["role"] == "system":
-                html_content += (
-                    "<div style='margin: 10px 0; padding: 10px; "
-                    "color: #666; font-style: italic;'>"
-                )
-                content_with_br = msg['content'].replace('\n', '<br/>')
-                html_content += f"System: {content_with_br}"
-                html_content += "</div>"
-        html_content += "</body></html>"
-        return html_content
-
     def update_chat_display(self):
-        html_content = self.get_rendered_chat_html()
-        self.chat_display.set_html(html_content)
+        # Only new or changed messages are rendered (see chat_view.ChatView)
+        start = time.perf_counter()
+        self.chat_view.sync(self.conversation_history)
+        self.render_seconds += time.perf_counter() - start
+    
+    def record_timing(self, result):
+        """Show and log the spans of a finished request; render is all chat repaints since the send."""
+        timer = result["timer"]
+        timer.add("render", self.render_seconds)
+        self.render_seconds = 0.0
+        self.timing_label.config(text=timer.breakdown())
+        self.span_log.write(timer.as_record(
+            model=result["model"],
+            stream=result["stream"],
+            cached=result["cached"],
+            stopped=result["stopped"],
+            input_tokens=result["input_tokens"],
+            output_tokens=result["output_tokens"],
+            request_bytes=result["request_bytes"],
+            total_ms=round(result["total_time"] * 1000, 3),
+        ))
     
     def send_message_event(self, event):
         self.send_message()
     
+    def current_settings(self):
+        """Snapshot the request settings from the UI (Tk thread) for the session."""
+        return {
+            "model": self.model_var.get(),
+            "system_prompt": self.system_prompt.get("1.0", tk.END).strip(),
+            "stream": self.stream_var.get(),
+            "context_strategy": CONTEXT_STRATEGY_OPTIONS[self.context_strategy_var.get()],
+            "context_budget": self.context_budget_var.get(),
+            "image_policy": IMAGE_POLICY_OPTIONS[self.image_policy_var.get()],
+            "image_keep": self.image_keep_var.get(),
+            "image_max_edge": self.image_max_edge_var.get(),
+            "use_cache": self.response_cache_var.get(),
+            "bypass_cache": self.cache_bypass_var.get(),
+        }
+    
     def send_message(self):
-        if self.is_processing:
+        if self.session.is_processing:
             return
         
         user_input = self.user_input.get("1.0", tk.END).strip()
         if not user_input:
             return
         
+        if not self.session.send(user_input, self.current_settings()):
+            return
+        self.render_seconds = 0.0
         self.user_input.delete("1.0", tk.END)
-        self.is_processing = True
         self.update_status("Processing...")
         self.progress['value'] = 10
-        
-        # Build separate display and API versions of the user message.
-        display_message = user_input
-        api_message_parts = []
-        
-        # Add the text part if present.
-        if user_input:
-            api_message_parts.append({"type": "text", "text": user_input})
-        
-        # Process file attachments:
-        for file in self.attached_files:
-            if file["type"] == "image":
-                display_message += f"\n[Image Attached: {os.path.basename(file['path'])}]"
-                try:
-                    encoded_image = self.encode_image(file["path"])
-                    api_message_parts.append({
-                        "type": "image_url",
-                        "image_url": {"url": encoded_image}
-                    })
-                except Exception as e:
-                    self.update_status(f"Error processing image: {str(e)}")
-            elif file["type"] == "pdf":
-                display_message += f"\n[PDF Attached: {os.path.basename(file['path'])}]"
-                try:
-                    pdf_text = self.extract_pdf_text(file["path"])
-                    api_message_parts.append({
-                        "type": "text",
-                        "text": f"PDF CONTENT ({os.path.basename(file['path'])}):\n{pdf_text}"
-                    })
-                except Exception as e:
-                    self.update_status(f"Error processing PDF: {str(e)}")
-        
-        # Store the user message with separate display and API multi-part content.
-        user_message = {"role": "user", "display": display_message, "content": api_message_parts}
-        self.conversation_history.append(user_message)
-        self.update_chat_display()
-        
-        # Begin processing in a separate thread.
-        threading.Thread(target=self.process_message).start()
+        # The bypass box applies to one request only.
+        self.cache_bypass_var.set(False)
     
-    def process_message(self):
-        try:
-            # Build messages for the API call.
-            system_content = self.system_prompt.get("1.0", tk.END).strip()
-            messages = []
-            if system_content:
-                messages.append({"role": "system", "content": system_content})
-            for msg in self.conversation_history:
-                if msg["role"] == "user" and "api_content" in msg:
-                    messages.append({"role": "user", "content": msg["api_content"]})
-                else:
-                    messages.append({"role": msg["role"], "content": msg.get("content", "")})
-
-            selected_model = self.model_var.get()
-            
-            # Estimate input tokens
-            input_tokens = self.estimate_tokens(messages)
-            self.total_input_tokens += input_tokens
-            
-            self.progress['value'] = 30
-            self.update_status(f"Sending request to {selected_model}...")
-            
-            response = client.chat.completions.create(
-                model=selected_model,
-                messages=[{"role": m["role"], "content": m["content"]} for m in messages],
-            )
-            
-            self.progress['value'] = 90
-            
-            assistant_response = response.choices[0].message.content.strip()
-            
-            # Estimate output tokens
-            output_tokens = self.estimate_tokens([{"role": "assistant", "content": assistant_response}])
-            self.total_output_tokens += output_tokens
-            
-            # Calculate cost
-            self.calculate_session_cost()
-            
-            self.conversation_history.append({"role": "assistant", "content": assistant_response})
-            
-            self.root.after(0, self.update_chat_display)
-            self.root.after(0, self.update_cost_display)
-            self.root.after(0, lambda: self.update_status("Ready"))
-            self.root.after(0, lambda: setattr(self.progress, 'value', 100))
-            self.root.after(0, self.clear_attachments)
-            
-        except Exception as e:
-            error_message = f"Error: {str(e)}"
-            self.root.after(0, lambda: self.update_status(error_message))
-            print(error_message)
-        finally:
-            self.is_processing = False
+    def poll_session_events(self):
+        """Apply queued session events on the Tk thread, repainting the chat at most once per frame."""
+        repaint = False
+        while True:
+            try:
+                kind, value = self.session_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "history":
+                repaint = True
+            elif kind == "status":
+                self.status_label.config(text=value)
+            elif kind == "progress":
+                self.progress['value'] = value
+            elif kind == "context":
+                self.show_context_report(value)
+            elif kind == "request_size":
+                self.request_size_label.config(text=format_bytes(value))
+            elif kind == "attachments":
+                self.refresh_attachment_list()
+            elif kind == "done":
+                self.update_chat_display()
+                repaint = False
+                self.record_timing(value)
+                self.update_cost_display()
+                self.status_label.config(text=format_result(value))
+                self.progress['value'] = 100
+            elif kind == "error":
+                self.status_label.config(text=value)
+                self.render_seconds = 0.0
+        if repaint:
+            self.update_chat_display()
+        self.root.after(STREAM_FRAME_INTERVAL_MS, self.poll_session_events)
     
-    def estimate_tokens(self, messages):
-        """Estimate token count for a list of messages"""
-        try:
-            # Try to use tiktoken for OpenAI models
-            encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-            token_count = 0
-            
-            for message in messages:
-                # Add tokens for message role
-                token_count += 4  # Approximate tokens for role
-                
-                content = message.get("content", "")
-                if isinstance(content, list):
-                    # Process each part in multi-part messages
-                    for part in content:
-                        if part.get("type") == "text":
-                            text = part.get("text", "")
-                            token_count += len(encoding.encode(text))
-                        elif part.get("type") == "image_url":
-                            # Use a constant token count for image parts
-                            token_count += 3
-                else:
-                    # Fallback to string content estimation
-                    token_count += len(encoding.encode(content))
-            
-            # Add a few tokens for message formatting
-            token_count += 2
-            
-            return token_count
-        except:
-            # Fallback to character-based estimation (very rough)
-            total_chars = sum(len(msg.get("content", "")) for msg in messages)
-            # Rough estimate: 1 token ≈ 4 characters for English text
-            return total_chars // 4
+    def show_context_report(self, report):
+        if report["budget"] is None:
+            text = f"Sent {report['kept_tokens']:,} tokens (full history; context length not known yet)"
+        else:
+            text = f"Kept {report['kept_tokens']:,} / budget {report['budget']:,} tokens"
+        if report["dropped_messages"]:
+            text += f"\nDropped {report['dropped_tokens']:,} tokens ({report['dropped_messages']} msgs)"
+        if report["summary_tokens"]:
+            text += f"\nSummary: {report['summary_tokens']:,} tokens"
+        # Highlighted whenever turns were left out of the request
+        self.context_report_label.config(text=text, fg="#b00020" if report["dropped_messages"] else "black")
     
-    def calculate_session_cost(self):
-        """Calculate the total cost of the session based on token usage"""
-        selected_model = self.model_var.get()
-        
-        if selected_model in MODEL_PRICING:
-            pricing = MODEL_PRICING[selected_model]
-            input_cost = (self.total_input_tokens / 1_000_000) * pricing["input"]
-            output_cost = (self.total_output_tokens / 1_000_000) * pricing["output"]
-            self.total_cost = input_cost + output_cost
+    def stop_generation(self):
+        """Abort the in-flight request by closing its HTTP stream."""
+        if not self.session.is_processing:
+            return
+        # Decided by how the in-flight request was sent, not the current checkbox.
+        if self.session.stop():
+            self.update_status("Stopping...")
+        else:
+            self.update_status("Only streamed responses can be stopped")
     
     def update_cost_display(self, event=None):
         """Update the cost display UI elements"""
@@ -509,13 +517,13 @@ class OpenRouterGUI:
             self.input_price_label.config(text=f"${pricing['input']:.2f}")
             self.output_price_label.config(text=f"${pricing['output']:.2f}")
         
-        self.input_tokens_label.config(text=f"{self.total_input_tokens:,}")
-        self.output_tokens_label.config(text=f"{self.total_output_tokens:,}")
-        self.total_cost_label.config(text=f"${self.total_cost:.6f}")
+        self.input_tokens_label.config(text=f"{self.session.total_input_tokens:,}")
+        self.output_tokens_label.config(text=f"{self.session.total_output_tokens:,}")
+        self.total_cost_label.config(text=f"${self.session.total_cost:.6f}")
+        self.cache_stats_label.config(text=f"Cache: {self.response_cache.stats()}")
     
     def clear_attachments(self):
-        self.attached_files = []
-        self.file_listbox.delete(0, tk.END)
+        self.session.clear_attachments()
 
     def get_conversation_markdown(self):
         """Generate a markdown summary from the conversation history."""
@@ -535,63 +543,36 @@ class OpenRouterGUI:
         if not self.conversation_history:
             self.update_status("No chat to archive")
             return
-        try:
-            # Generate markdown context from the conversation history
-            conversation_md = self.get_conversation_markdown()
-            # Ping the naming model with markdown context for a short descriptive name
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": "Describe the conversation in maximum 5 words. Use the markdown below as context:"},
-                    {"role": "user", "content": conversation_md}
-                ],
-            )
-            chat_name = response.choices[0].message.content.strip()
-            chat_name = " ".join(chat_name.split()[:5])  # Only take the first 5 words
-        except Exception as e:
-            chat_name = "Archived Chat"
-            self.update_status(f"Archiving name error: {str(e)}")
-        
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        rendered_content = self.get_rendered_chat_html()
+        # Archive right away under a local name; the naming model runs in the background.
+        chat_name = provisional_name(self.conversation_history)
         attachments = self.attached_files.copy()  # capture current attachments list
-        
-        archive_entry = {
-            "name": chat_name,
-            "date": current_date,
-            "conversation_history": self.conversation_history,
-            "rendered_content": rendered_content,
-            "attachments": attachments,
-        }
-        
-        archive_file = "chat_archives.json"
-        archives = []
-        if os.path.exists(archive_file):
-            try:
-                with open(archive_file, "r", encoding="utf-8") as f:
-                    archives = json.load(f)
-            except:
-                archives = []
-        archives.append(archive_entry)
-        with open(archive_file, "w", encoding="utf-8") as f:
-            json.dump(archives, f, indent=4)
+        archive_id = self.archive.add(chat_name, self.conversation_history, attachments)
+        self.archive_namer.submit(archive_id, self.get_conversation_markdown())
         self.update_status(f"Chat archived as: {chat_name}")
 
+    def on_archive_named(self, archive_id, name):
+        # Called from the naming worker thread
+        self.root.after(0, lambda: self.update_status(f"Archived chat named: {name}"))
+
     def view_history(self):
-        archive_file = "chat_archives.json"
-        if not os.path.exists(archive_file):
+        entries = self.archive.list_entries()
+        if not entries:
             self.update_status("No archived chats found.")
             return
-        try:
-            with open(archive_file, "r", encoding="utf-8") as f:
-                archives = json.load(f)
-        except Exception as e:
-            self.update_status(f"Error loading archives: {str(e)}")
-            return
         
         history_win = tk.Toplevel(self.root)
         history_win.title("Archived Chats")
-        history_win.geometry("400x300")
+        history_win.geometry("600x400")
+        
+        # Search box backed by the archive's full-text index
+        search_frame = tk.Frame(history_win)
+        search_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        tk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
+        search_var = tk.StringVar()
+        search_entry = tk.Entry(search_frame, textvariable=search_var)
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(5, 0))
+        search_entry.focus_set()
+        
         # Reminder for deletion action
         info_label = tk.Label(history_win, text="(Hint: Ctrl+Left-click on an entry to delete it)", fg="red")
         info_label.pack(pady=(5, 0))
@@ -599,10 +580,35 @@ class OpenRouterGUI:
         listbox = tk.Listbox(history_win)
         listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        for idx, entry in enumerate(archives):
-            listbox.insert(tk.END, f"{entry['date']} - {entry['name']}")
+        def refresh_list():
+            query = search_var.get().strip()
+            if query:
+                hits, seconds = self.archive.search(query)
+                entries[:] = [(archive_id, date, name) for archive_id, date, name, _ in hits]
+                lines = [f"{date} - {name}: {snippet}".replace("\n", " ") for _, date, name, snippet in hits]
+                self.update_status(f"{len(hits)} archived chats match ({seconds * 1000:.1f} ms)")
+            else:
+                entries[:] = self.archive.list_entries()
+                lines = [f"{date} - {name}" for _, date, name in entries]
+            listbox.delete(0, tk.END)
+            for line in lines:
+                listbox.insert(tk.END, line)
+        
+        pending_search = []
+        
+        def on_search_change(*args):
+            # Debounce keystrokes so a query runs once typing pauses.
+            if pending_search:
+                history_win.after_cancel(pending_search.pop())
+            pending_search.append(history_win.after(150, refresh_list))
+        
+        search_var.trace_add("write", on_search_change)
+        refresh_list()
         
         def on_view():
+            if self.session.is_processing:
+                self.update_status("Wait for the current response (or Stop it) before opening another chat")
+                return
             # Archive the current chat if there's content
             if self.conversation_history:
                 self.archive_chat()
@@ -610,12 +616,18 @@ class OpenRouterGUI:
             if not selection:
                 return
             index = selection[0]
-            selected_archive = archives[index]
+            selected_archive = self.archive.load(entries[index][0])
+            if selected_archive is None:
+                self.update_status("Archived chat no longer exists.")
+                return
 
             # Load the selected archive as the current chat
-            self.conversation_history = selected_archive.get("conversation_history", [])
-            self.attached_files = selected_archive.get("attachments", [])
-            self.update_chat_display()
+            if not self.session.load(
+                selected_archive.get("conversation_history", []),
+                selected_archive.get("attachments", []),
+            ):
+                self.update_status("Wait for the current response (or Stop it) before opening another chat")
+                return
             self.update_status(f"Loaded archived chat: {selected_archive.get('name')}")
         
         view_btn = tk.Button(history_win, text="View Chat", command=on_view)
@@ -624,24 +636,227 @@ class OpenRouterGUI:
         def on_ctrl_click(event):
             # Determine which archive entry was clicked
             index = listbox.nearest(event.y)
-            if index < 0 or index >= len(archives):
+            if index < 0 or index >= len(entries):
                 return
             # Confirm deletion using a message box
             if messagebox.askyesno("Delete Chat", "Are you sure you want to delete this archived chat?"):
-                archives.pop(index)
-                with open(archive_file, "w", encoding="utf-8") as f:
-                    json.dump(archives, f, indent=4)
-                # Refresh the listbox with updated archives
-                listbox.delete(0, tk.END)
-                for idx, entry in enumerate(archives):
-                    listbox.insert(tk.END, f"{entry['date']} - {entry['name']}")
+                self.archive.delete(entries[index][0])
+                entries.pop(index)
+                listbox.delete(index)
                 self.update_status("Deleted archived chat.")
 
         listbox.bind("<Control-Button-1>", on_ctrl_click)
 
+    def open_compare_window(self):
+        ComparisonWindow(self)
+
+
+class StreamPane:
+    """Plain-text pane that appends streamed deltas, repainting at most once per frame."""
+
+    def __init__(self, parent, root, title):
+        self.root = root
+        self.frame = tk.LabelFrame(parent, text=title, padx=5, pady=5)
+        self.text = scrolledtext.ScrolledText(self.frame, wrap=tk.WORD, width=40)
+        self.text.pack(fill=tk.BOTH, expand=True)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flush_scheduled = False
+
+    def queue(self, delta):
+        # Called from worker threads
+        with self.lock:
+            self.pending.append(delta)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        self.root.after(STREAM_FRAME_INTERVAL_MS, self.flush)
+
+    def flush(self):
+        with self.lock:
+            text = "".join(self.pending)
+            self.pending = []
+            self.flush_scheduled = False
+        if text and self.text.winfo_exists():
+            self.text.insert(tk.END, text)
+            self.text.see(tk.END)
+
+
+class ComparisonWindow:
+    """
+    Sends the prompt in the input box to several models at once.
+
+    The message set (system prompt, fitted history, the new user message and
+    attachments) is prepared once, then each model streams into its own pane
+    from a bounded thread pool. Timing, tokens and cost per model are shown
+    side by side. Nothing is added to the conversation history: the prompt
+    is built on a detached copy of the session, and closing the window
+    cancels the streams still running.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.root = app.root
+        self.window = tk.Toplevel(app.root)
+        self.window.title("Compare Models")
+        self.window.geometry("1400x800")
+
+        top = tk.Frame(self.window)
+        top.pack(fill=tk.X, padx=10, pady=10)
+        tk.Label(top, text="Models (select several):").pack(side=tk.LEFT, anchor=tk.N)
+        self.model_listbox = tk.Listbox(top, selectmode=tk.MULTIPLE, height=6, exportselection=False, width=50)
+        self.model_listbox.pack(side=tk.LEFT, padx=(5, 10))
+        for model in MODEL_LIST:
+            self.model_listbox.insert(tk.END, model)
+        self.run_button = tk.Button(top, text="Run Comparison", command=self.run)
+        self.run_button.pack(side=tk.LEFT, anchor=tk.N)
+
+        columns = ("ttft", "total", "input", "output", "cost")
+        self.table = ttk.Treeview(self.window, columns=columns, height=6)
+        self.table.heading("#0", text="Model")
+        for column, title in zip(columns, ("TTFT (s)", "Total (s)", "Input tokens", "Output tokens", "Cost ($)")):
+            self.table.heading(column, text=title)
+            self.table.column(column, width=110, anchor=tk.E)
+        self.table.pack(fill=tk.X, padx=10)
+
+        self.panes_frame = tk.Frame(self.window)
+        self.panes_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        # Open response streams, closed when the window is
+        self.streams_lock = threading.Lock()
+        self.active_streams = set()
+        self.closed = threading.Event()
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        """Cancel the running comparison and close the window."""
+        self.closed.set()
+        with self.streams_lock:
+            streams = list(self.active_streams)
+        for response_stream in streams:
+            response_stream.close()
+        self.window.destroy()
+
+    def run(self):
+        models = [self.model_listbox.get(i) for i in self.model_listbox.curselection()]
+        user_input = self.app.user_input.get("1.0", tk.END).strip()
+        if not models or not user_input:
+            self.app.update_status("Select models and type a prompt to compare")
+            return
+        if self.app.session.is_processing:
+            self.app.update_status("Wait for the current response before comparing models")
+            return
+
+        for child in self.panes_frame.winfo_children():
+            child.destroy()
+        self.table.delete(*self.table.get_children())
+        panes = {}
+        for column, model in enumerate(models):
+            pane = StreamPane(self.panes_frame, self.root, model)
+            pane.frame.grid(row=0, column=column, sticky="nsew", padx=2)
+            self.panes_frame.columnconfigure(column, weight=1)
+            panes[model] = pane
+            self.table.insert("", tk.END, iid=model, text=model, values=("...", "...", "", "", ""))
+        self.panes_frame.rowconfigure(0, weight=1)
+
+        settings = self.app.current_settings()
+        attachments = list(self.app.attached_files)
+        session = self.app.session.detached()
+        self.run_button.config(state=tk.DISABLED)
+        threading.Thread(
+            target=self.fan_out, args=(session, models, user_input, attachments, settings, panes), daemon=True
+        ).start()
+
+    def fan_out(self, session, models, user_input, attachments, settings, panes):
+        try:
+            user_message = session.build_user_message(user_input, attachments)
+            messages, _ = session.assemble_messages(session.history + [user_message], models, settings)
+            api_messages = session.build_api_messages(messages, settings)
+            input_estimate = estimate_tokens(messages)
+            with ThreadPoolExecutor(max_workers=min(len(models), COMPARE_MAX_WORKERS)) as pool:
+                for model in models:
+                    pool.submit(self.run_model, model, api_messages, input_estimate, panes[model])
+        except Exception as e:
+            error_message = f"Comparison error: {str(e)}"
+            self.root.after(0, lambda: self.app.update_status(error_message))
+        finally:
+            self.root.after(0, lambda: self.run_button.winfo_exists() and self.run_button.config(state=tk.NORMAL))
+
+    def run_model(self, model, api_messages, input_estimate, pane):
+        start = time.perf_counter()
+        ttft = None
+        received = []
+        usage_report = []
+        response_stream = None
+        try:
+            if self.closed.is_set():
+                return
+            response_stream = client.chat.completions.create(
+                model=model,
+                messages=api_messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            with self.streams_lock:
+                self.active_streams.add(response_stream)
+            if self.closed.is_set():
+                # The window closed while the request was being sent.
+                response_stream.close()
+                return
+            for delta in iter_stream_deltas(response_stream, on_usage=usage_report.append):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    self.root.after(0, lambda t=ttft: self.set_cell(model, "ttft", f"{t:.2f}"))
+                received.append(delta)
+                pane.queue(delta)
+        except Exception as e:
+            if self.closed.is_set():
+                return
+            pane.queue(f"\n[Error: {str(e)}]")
+        finally:
+            with self.streams_lock:
+                self.active_streams.discard(response_stream)
+        if self.closed.is_set():
+            return
+        total = time.perf_counter() - start
+
+        input_tokens = input_estimate
+        output_tokens = estimate_tokens([{"role": "assistant", "content": "".join(received)}]) if received else 0
+        usage = usage_report[-1] if usage_report else None
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            input_tokens = usage.prompt_tokens
+            output_tokens = usage.completion_tokens or 0
+        pricing = MODEL_PRICING.get(model)
+        cost = ""
+        if pricing:
+            cost = f"{(input_tokens * pricing['input'] + output_tokens * pricing['output']) / 1_000_000:.6f}"
+        values = (f"{ttft:.2f}" if ttft is not None else "-", f"{total:.2f}", f"{input_tokens:,}", f"{output_tokens:,}", cost)
+        self.root.after(0, lambda: self.set_row(model, values))
+
+    def set_cell(self, model, column, value):
+        if self.table.winfo_exists() and self.table.exists(model):
+            self.table.set(model, column, value)
+
+    def set_row(self, model, values):
+        if self.table.winfo_exists() and self.table.exists(model):
+            self.table.item(model, values=values)
+
+
+def report_first_paint(root, started):
+    """Print the time from process launch to the first drawn window, then quit (startup benchmark)."""
+    root.update_idletasks()
+    print(f"first_paint_ms={(time.time() - started) * 1000:.1f}", flush=True)
+    root.destroy()
+
 def main():
+    # Required for the PDF extraction process pool in frozen Windows builds
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = OpenRouterGUI(root)
+    # Set by `benchmark.py startup` to the launch timestamp
+    probe = os.environ.get(STARTUP_PROBE_ENV)
+    if probe:
+        root.after_idle(report_first_paint, root, float(probe))
     root.mainloop()
 
 if __name__ == "__main__":
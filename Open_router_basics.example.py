@@ -1,6 +1,7 @@
-from openai import OpenAI
+from openrouter_utils import make_client
 
-client = OpenAI(
+# Shared client on a tuned keep-alive connection pool (see openrouter_utils.make_client)
+client = make_client(
   base_url="https://openrouter.ai/api/v1",
   api_key="",
 )
@@ -19,3 +20,10 @@ client = OpenAI(
 #      "output": 0,
 #    },
 # }
+
+# Model_context = {}
+# Optional: context length (tokens) per model, used by the context window
+# manager. Models not listed use the length reported by OpenRouter's /models.
+# Model_context = {
+#   'mistralai/devstral-small:free': 128000,
+# }
@@ -0,0 +1,611 @@
+"""
+Micro-benchmarks for the hot paths of the OpenRouter GUI.
+
+Usage:
+    python benchmark.py render [--lengths 10 50 100 200] [--repeat 5]
+    python benchmark.py pdf [--pages 10 100 500] [--repeat 3]
+    python benchmark.py http [--handshake-ms 150] [--repeat 5]
+    python benchmark.py startup [--repeat 5] [--top 10] [--max-first-paint-ms 1500]
+    python benchmark.py suite [--repeat 10] [--ttft-ms 50] [--tokens-per-sec 200] [--error-rate 0] [--output results.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+from chat_render import ChatRenderer, render_chat_html
+import openrouter_utils
+
+SAMPLE_ASSISTANT_REPLY = (
+    "Here is a summary of the approach:\n\n"
+    "1. **Parse** the input and validate it.\n"
+    "2. Build the index with `build_index()`.\n"
+    "3. Query it.\n\n"
+    "| Step | Cost |\n|------|------|\n| parse | O(n) |\n| query | O(log n) |\n\n"
+    "```python\ndef build_index(items):\n    return {item.key: item for item in items}\n```\n"
+)
+
+
+def make_history(turns):
+    """Build a synthetic conversation with the given number of user/assistant turns."""
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "display": f"Question {i}: how does step {i} work?", "content": []})
+        history.append({"role": "assistant", "content": f"Answer {i}.\n\n{SAMPLE_ASSISTANT_REPLY}"})
+    return history
+
+
+def time_call(func, repeat):
+    """Return the best wall time in milliseconds of func() over repeat runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_render(lengths, repeat):
+    """Compare the per-turn render cost of the uncached and cached renderers."""
+    print(f"{'turns':>8} {'uncached ms':>14} {'cached ms':>12} {'speedup':>9}")
+    for turns in lengths:
+        history = make_history(turns)
+        uncached = time_call(lambda: render_chat_html(history), repeat)
+
+        # The cached renderer has already seen all but the newest turn.
+        renderer = ChatRenderer()
+        renderer.render(history[:-2])
+
+        def render_new_turn():
+            history[-1]["content"] += " "
+            renderer.render(history)
+
+        cached = time_call(render_new_turn, repeat)
+        print(f"{turns:>8} {uncached:>14.2f} {cached:>12.2f} {uncached / cached:>8.1f}x")
+
+
+def write_sample_pdf(path, pages, lines_per_page=45):
+    """Write a simple text-only PDF with the given number of pages."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for page in range(pages):
+        lines = [f"BT /F1 10 Tf 40 {800 - 16 * i} Td (Page {page} line {i}: the quick brown fox jumps over the lazy dog) Tj ET"
+                 for i in range(lines_per_page)]
+        stream = "\n".join(lines).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        data += b"%010d 00000 n \n" % offset
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def bench_pdf(page_counts, repeat):
+    """Compare serial and process-pool PDF extraction (cache bypassed)."""
+    print(f"{'pages':>8} {'serial ms':>12} {'pool cold ms':>14} {'pool warm ms':>14} {'auto mode':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pages in page_counts:
+            path = os.path.join(tmp_dir, f"sample_{pages}.pdf")
+            write_sample_pdf(path, pages)
+
+            serial = time_call(lambda: openrouter_utils.extract_pdf_pages(path, use_cache=False, parallel=False), repeat)
+
+            # Cold: the first parallel call includes process pool startup.
+            if openrouter_utils._pdf_pool is not None:
+                openrouter_utils._pdf_pool.shutdown()
+                openrouter_utils._pdf_pool = None
+            cold = time_call(lambda: openrouter_utils.extract_pdf_pages(path, use_cache=False, parallel=True), 1)
+            warm = time_call(lambda: openrouter_utils.extract_pdf_pages(path, use_cache=False, parallel=True), repeat)
+
+            auto = "parallel" if openrouter_utils.use_parallel_extraction(pages) else "serial"
+            print(f"{pages:>8} {serial:>12.1f} {cold:>14.1f} {warm:>14.1f} {auto:>10}")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal OpenAI-compatible /chat/completions endpoint.
+
+    Non-streaming requests get one JSON reply after response_delay. Streaming
+    requests get server-sent events: the first token after response_delay
+    (the time to first token), then one token per chunk at token_rate tokens
+    per second. A fraction error_rate of requests fails with HTTP 500.
+    Prompts repeating a cache_control prefix report it as cached tokens.
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # Each new connection pays a fixed setup cost, standing in for DNS + TLS.
+        time.sleep(self.server.handshake_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            failed = server.random.random() < server.error_rate
+            if failed:
+                server.errors += 1
+        time.sleep(server.response_delay)
+        if failed:
+            self.send_json(500, {"error": {"message": "injected error", "code": 500}})
+            return
+
+        tokens = [f"tok{i} " for i in range(server.reply_tokens)]
+        usage = {"prompt_tokens": len(json.dumps(request.get("messages", []))) // 4,
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        usage["prompt_tokens_details"] = {"cached_tokens": self.cached_prefix_tokens(request.get("messages", []))}
+        if not request.get("stream"):
+            self.send_json(200, {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": request.get("model", "stub")}
+        for i, token in enumerate(tokens):
+            if i and server.token_rate:
+                time.sleep(1 / server.token_rate)
+            delta = {"content": token, "role": "assistant"} if i == 0 else {"content": token}
+            self.send_event(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        self.send_event(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self.send_event(dict(chunk, choices=[], usage=usage))
+        self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def cached_prefix_tokens(self, messages):
+        """Emulate provider prompt caching: tokens up to the last cache_control breakpoint seen before."""
+        prefix = []
+        cached = 0
+        for message in messages:
+            prefix.append(message.get("role"))
+            content = message.get("content")
+            parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+            for part in parts:
+                prefix.append(part)
+                if "cache_control" in part:
+                    key = json.dumps(prefix, sort_keys=True)
+                    with self.server.lock:
+                        if key in self.server.prompt_prefixes:
+                            cached = len(key) // 4
+                        self.server.prompt_prefixes.add(key)
+        return cached
+
+    def send_event(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        body = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n" % len(body) + body + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(handshake_delay=0.0, response_delay=0.0, token_rate=0.0, reply_tokens=6, error_rate=0.0, seed=0):
+    """Start the stub API on a free localhost port; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.handshake_delay = handshake_delay
+    server.response_delay = response_delay
+    server.token_rate = token_rate
+    server.reply_tokens = reply_tokens
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.errors = 0
+    server.prompt_prefixes = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def bench_http(handshake_ms, repeat):
+    """First-request latency: default client vs. tuned pool, cold vs. pre-warmed."""
+    server, base_url = start_stub_server(handshake_delay=handshake_ms / 1000)
+    messages = [{"role": "user", "content": "Hi"}]
+
+    def first_request(client, warm):
+        if warm:
+            openrouter_utils.warm_connection(client)
+        start = time.perf_counter()
+        client.chat.completions.create(model="stub", messages=messages)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        client.chat.completions.create(model="stub", messages=messages)
+        second = time.perf_counter() - start
+        client.close()
+        return first * 1000, second * 1000
+
+    cases = [
+        ("default OpenAI client", lambda: OpenAI(base_url=base_url, api_key="stub"), False),
+        ("tuned pool, cold", lambda: openrouter_utils.make_client("stub", base_url=base_url, http2=False), False),
+        ("tuned pool, warmed", lambda: openrouter_utils.make_client("stub", base_url=base_url, http2=False), True),
+    ]
+    print(f"stub handshake delay: {handshake_ms} ms")
+    print(f"{'client':<24} {'first req ms':>13} {'second req ms':>14}")
+    for label, factory, warm in cases:
+        runs = [first_request(factory(), warm) for _ in range(repeat)]
+        first = statistics.median(run[0] for run in runs)
+        second = statistics.median(run[1] for run in runs)
+        print(f"{label:<24} {first:>13.1f} {second:>14.1f}")
+    server.shutdown()
+
+
+# Config module used by the startup benchmark, so it runs without real API keys or network
+STUB_CONFIG = """\
+from openrouter_utils import make_client
+
+client = make_client(base_url="http://127.0.0.1:9/v1", api_key="stub")
+Model_list = ["stub/model"]
+Model_cost = {"stub/model": {"input": 0, "output": 0}}
+"""
+
+
+def parse_importtime(stderr):
+    """Return {module: cumulative_us} for modules at most one level deep in -X importtime output."""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        # Nested imports are indented two spaces per level below their importer.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            totals[name.strip()] = int(cumulative)
+    return totals
+
+
+def bench_startup(repeat, top, max_first_paint_ms=None):
+    """Import time of OpenRouterGUI and time from launch to the first painted window."""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "Open_router_basics.py"), "w", encoding="utf-8") as f:
+            f.write(STUB_CONFIG)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([tmp_dir, repo_dir])
+        env["OPENROUTER_GUI_CACHE_DIR"] = os.path.join(tmp_dir, "cache")
+
+        # The GUI creates its archive database in the working directory.
+        imports = []
+        for _ in range(repeat):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import OpenRouterGUI"],
+                cwd=tmp_dir, env=env, capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                print(result.stderr.strip().splitlines()[-1])
+                return 1
+            imports.append(parse_importtime(result.stderr))
+
+        total = statistics.median(run.get("OpenRouterGUI", 0) for run in imports) / 1000
+        print(f"import OpenRouterGUI: {total:.1f} ms (median of {repeat})")
+        modules = set().union(*imports) - {"OpenRouterGUI"}
+        slowest = sorted(
+            ((statistics.median(run.get(name, 0) for run in imports) / 1000, name) for name in modules),
+            reverse=True,
+        )[:top]
+        for ms, name in slowest:
+            print(f"  {name:<36} {ms:>8.1f} ms")
+
+        paints = []
+        for _ in range(repeat):
+            env["OPENROUTER_GUI_STARTUP_PROBE"] = repr(time.time())
+            result = subprocess.run(
+                [sys.executable, os.path.join(repo_dir, "OpenRouterGUI.py")],
+                cwd=tmp_dir, env=env, capture_output=True, text=True, timeout=60,
+            )
+            for line in result.stdout.splitlines():
+                if line.startswith("first_paint_ms="):
+                    paints.append(float(line.split("=", 1)[1]))
+                    break
+            else:
+                # Typically no display available (headless CI without Xvfb).
+                print(f"first paint: not measured ({(result.stderr.strip().splitlines() or ['no output'])[-1]})")
+                return 0
+
+        first_paint = statistics.median(paints)
+        print(f"launch to first paint: {first_paint:.1f} ms (median of {repeat})")
+        if max_first_paint_ms is not None and first_paint > max_first_paint_ms:
+            print(f"REGRESSION: first paint exceeds {max_first_paint_ms:.0f} ms")
+            return 1
+    return 0
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize_samples(samples_ms, errors=0):
+    """p50/p95/mean of a workload's timings in milliseconds."""
+    if not samples_ms:
+        return {"n": 0, "errors": errors}
+    return {
+        "n": len(samples_ms),
+        "errors": errors,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "mean_ms": round(statistics.fmean(samples_ms), 3),
+    }
+
+
+def measure(func, repeat):
+    """Run func() repeat times; returns (timings in ms, number of runs that raised)."""
+    samples = []
+    errors = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            errors += 1
+            continue
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, errors
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def import_literature_review(tmp_dir):
+    """Import Literature_Review, providing a stub Open_router_basics if none is configured."""
+    try:
+        import Open_router_basics  # noqa: F401
+    except ImportError:
+        with open(os.path.join(tmp_dir, "Open_router_basics.py"), "w", encoding="utf-8") as f:
+            f.write(STUB_CONFIG)
+        sys.path.insert(0, tmp_dir)
+    import Literature_Review
+    return Literature_Review
+
+
+def bench_suite(repeat, ttft_ms, tokens_per_sec, reply_tokens, error_rate, pdf_pages, history_turns):
+    """
+    Run every workload against the local stub and return the results as a dict.
+
+    Workloads: the chat path through ChatSession (streaming and not), PDF
+    extraction (uncached and cached), token estimation (cold and with the
+    per-message cache), chat HTML rendering and the three literature review
+    stages. Nothing is sent to the real API.
+    """
+    from chat_session import ChatSession
+
+    server, base_url = start_stub_server(
+        response_delay=ttft_ms / 1000, token_rate=tokens_per_sec, reply_tokens=reply_tokens, error_rate=error_rate,
+    )
+    client = openrouter_utils.make_client("stub", base_url=base_url)
+    openrouter_utils.warm_connection(client)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Keep the benchmark's PDFs out of the user's text cache.
+        saved_pdf_cache = openrouter_utils.pdf_text_cache
+        openrouter_utils.pdf_text_cache = openrouter_utils.DiskLRUCache(
+            os.path.join(tmp_dir, "pdf_text"), openrouter_utils.PDF_CACHE_MAX_BYTES
+        )
+        try:
+            # Chat path: one session per mode so the history grows as in real use.
+            for mode, stream in (("chat_nonstream", False), ("chat_stream", True)):
+                session = ChatSession(client)
+                settings = {"model": "stub/model", "stream": stream, "system_prompt": "You are a helpful assistant."}
+                ttfts = []
+
+                def send():
+                    result = session.run("Explain the benchmark results.", settings)
+                    if result["ttft"] is not None:
+                        ttfts.append(result["ttft"] * 1000)
+
+                samples, errors = measure(send, repeat)
+                results[mode] = summarize_samples(samples, errors)
+                if ttfts:
+                    results[mode + "_ttft"] = summarize_samples(ttfts)
+
+            pdf_path = os.path.join(tmp_dir, "sample.pdf")
+            write_sample_pdf(pdf_path, pdf_pages)
+            results["pdf_extract_uncached"] = summarize_samples(*measure(
+                lambda: openrouter_utils.extract_pdf_pages(pdf_path, use_cache=False), repeat))
+            openrouter_utils.extract_pdf_pages(pdf_path)
+            results["pdf_extract_cached"] = summarize_samples(*measure(
+                lambda: openrouter_utils.extract_pdf_pages(pdf_path), repeat))
+
+            # Fresh message dicts and an empty string cache: every message is encoded.
+            def estimate_cold():
+                openrouter_utils.clear_token_counts()
+                openrouter_utils.estimate_tokens(make_history(history_turns))
+
+            results["tokens_cold"] = summarize_samples(*measure(estimate_cold, repeat))
+            history = make_history(history_turns)
+            openrouter_utils.estimate_tokens(history)
+            results["tokens_cached"] = summarize_samples(*measure(
+                lambda: openrouter_utils.estimate_tokens(history), repeat))
+
+            results["render_full"] = summarize_samples(*measure(lambda: render_chat_html(history), repeat))
+            renderer = ChatRenderer()
+            renderer.render(history)
+
+            def render_new_turn():
+                history[-1]["content"] += " "
+                renderer.render(history)
+
+            results["render_incremental"] = summarize_samples(*measure(render_new_turn, repeat))
+
+            # Literature review stages on generated papers, pointed at the stub.
+            literature_review = import_literature_review(tmp_dir)
+            literature_review.client = client
+            pdf_folder = os.path.join(tmp_dir, "papers")
+            os.makedirs(pdf_folder)
+            for i in range(3):
+                write_sample_pdf(os.path.join(pdf_folder, f"paper_{i}.pdf"), max(pdf_pages // 4, 1))
+            draft = os.path.join(tmp_dir, "draft.txt")
+            with open(draft, "w", encoding="utf-8") as f:
+                f.write("Draft: " + SAMPLE_ASSISTANT_REPLY * 20)
+            summaries = os.path.join(tmp_dir, "summaries.json")
+            notes = os.path.join(tmp_dir, "notes.txt")
+            review = os.path.join(tmp_dir, "review.txt")
+            stages = (
+                # resume=False: every repeat sends all papers instead of reading the checkpoint.
+                ("lit_note", lambda: literature_review.stage_note_taking(draft, pdf_folder, summaries, resume=False)),
+                ("lit_triangulate", lambda: literature_review.stage_triangulation(draft, summaries, notes)),
+                ("lit_write", lambda: literature_review.stage_writing(draft, summaries, notes, review)),
+            )
+            for name, stage in stages:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[name] = summarize_samples(*measure(stage, repeat))
+        finally:
+            openrouter_utils.pdf_text_cache = saved_pdf_cache
+            client.close()
+            server.shutdown()
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "stub": {
+                "ttft_ms": ttft_ms,
+                "tokens_per_sec": tokens_per_sec,
+                "reply_tokens": reply_tokens,
+                "error_rate": error_rate,
+                "requests": server.requests,
+                "injected_errors": server.errors,
+            },
+            "pdf_pages": pdf_pages,
+            "history_turns": history_turns,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenRouter GUI micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="bench", help="Benchmark to run")
+
+    parser_render = subparsers.add_parser("render", help="Chat HTML rendering vs. history length")
+    parser_render.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 100, 200], help="History lengths in turns")
+    parser_render.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+
+    parser_pdf = subparsers.add_parser("pdf", help="Serial vs. process-pool PDF extraction")
+    parser_pdf.add_argument("--pages", type=int, nargs="+", default=[10, 100, 500], help="Page counts of the generated PDFs")
+    parser_pdf.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    parser_http = subparsers.add_parser("http", help="Cold vs. warm first request against a local stub server")
+    parser_http.add_argument("--handshake-ms", type=float, default=150, help="Simulated per-connection setup cost")
+    parser_http.add_argument("--repeat", type=int, default=5, help="Runs per client (median is reported)")
+
+    parser_startup = subparsers.add_parser("startup", help="GUI import time and launch-to-first-paint")
+    parser_startup.add_argument("--repeat", type=int, default=5, help="Launches per measurement (median is reported)")
+    parser_startup.add_argument("--top", type=int, default=10, help="Number of slowest top-level imports to list")
+    parser_startup.add_argument("--max-first-paint-ms", type=float, help="Exit with status 1 if first paint is slower")
+
+    parser_suite = subparsers.add_parser("suite", help="All workloads against a local stub API, reported as JSON")
+    parser_suite.add_argument("--repeat", type=int, default=10, help="Runs per workload")
+    parser_suite.add_argument("--ttft-ms", type=float, default=50, help="Stub delay before the first token / reply")
+    parser_suite.add_argument("--tokens-per-sec", type=float, default=200, help="Stub streaming rate (0 = unthrottled)")
+    parser_suite.add_argument("--reply-tokens", type=int, default=50, help="Tokens in each stub reply")
+    parser_suite.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests failing with HTTP 500")
+    parser_suite.add_argument("--pdf-pages", type=int, default=40, help="Pages of the generated PDF")
+    parser_suite.add_argument("--history-turns", type=int, default=100, help="Turns in the synthetic history")
+    parser_suite.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+
+    args = parser.parse_args()
+
+    if args.bench == "render":
+        bench_render(args.lengths, args.repeat)
+    elif args.bench == "pdf":
+        bench_pdf(args.pages, args.repeat)
+    elif args.bench == "http":
+        bench_http(args.handshake_ms, args.repeat)
+    elif args.bench == "startup":
+        sys.exit(bench_startup(args.repeat, args.top, args.max_first_paint_ms))
+    elif args.bench == "suite":
+        report = bench_suite(args.repeat, args.ttft_ms, args.tokens_per_sec, args.reply_tokens,
+                             args.error_rate, args.pdf_pages, args.history_turns)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {args.output}")
+        else:
+            print(json.dumps(report, indent=2))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+SQLite storage for archived chats.
+
+The listbox in the history window only needs names and dates, so those live
+in a small metadata table; the conversation itself is stored separately and
+only loaded when a chat is opened. An FTS5 index over chat names and message
+text is kept in step with inserts, renames and deletes for the search box.
+"""
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+ARCHIVE_DB = "chat_archives.db"
+# Pre-SQLite archive format, imported once and renamed to *.migrated
+LEGACY_ARCHIVE_FILE = "chat_archives.json"
+# Maximum number of hits returned by a search
+SEARCH_LIMIT = 200
+
+# Model and limits for naming archived chats in the background
+NAMING_MODEL = "google/gemini-2.0-flash-001"
+NAMING_TIMEOUT = 20  # seconds per naming request
+NAMING_BATCH_WINDOW = 0.5  # seconds to wait for more chats to name in the same request
+NAMING_MAX_BATCH = 8
+NAMING_CONTEXT_CHARS = 6000  # conversation markdown sent per chat
+NAME_MAX_WORDS = 5
+
+
+def conversation_text(conversation_history):
+    """Searchable text of a conversation: what the user typed and the assistant replied."""
+    texts = []
+    for msg in conversation_history:
+        if msg.get("role") == "user":
+            content = msg.get("display", msg.get("content", ""))
+        elif msg.get("role") == "assistant":
+            content = msg.get("content", "")
+        else:
+            continue
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        texts.append(content)
+    return "\n".join(texts)
+
+
+def provisional_name(conversation_history):
+    """Name a chat locally from the first words of its first user message."""
+    for msg in conversation_history:
+        if msg.get("role") != "user":
+            continue
+        text = msg.get("display", msg.get("content", ""))
+        if isinstance(text, list):
+            text = " ".join(part.get("text", "") for part in text if part.get("type") == "text")
+        words = text.split()
+        if words:
+            name = " ".join(words[:NAME_MAX_WORDS])
+            return name + "..." if len(words) > NAME_MAX_WORDS else name
+    return "Archived Chat"
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: all terms must match, the last one as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class ChatArchive:
+    """Indexed archive store; safe to use from the Tk thread and worker threads."""
+
+    def __init__(self, db_path=ARCHIVE_DB, legacy_path=LEGACY_ARCHIVE_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self._create_schema()
+        if legacy_path and os.path.exists(legacy_path):
+            self.migrate_json(legacy_path)
+
+    def _create_schema(self):
+        with self.lock, self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS archives (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    date TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS archive_data (
+                    archive_id INTEGER PRIMARY KEY REFERENCES archives(id) ON DELETE CASCADE,
+                    conversation TEXT NOT NULL,
+                    attachments TEXT NOT NULL
+                );
+                """
+            )
+            # Full-text index over names and message text; rowid is the archive id.
+            try:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(name, body)"
+                )
+                self.fts_enabled = True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5: search falls back to LIKE scans.
+                self.fts_enabled = False
+                return
+
+            # Index archives written before the search index existed.
+            missing = self.conn.execute(
+                "SELECT a.id, a.name, d.conversation FROM archives a "
+                "JOIN archive_data d ON d.archive_id = a.id "
+                "WHERE a.id NOT IN (SELECT rowid FROM archive_fts)"
+            ).fetchall()
+            for archive_id, name, conversation in missing:
+                self.conn.execute(
+                    "INSERT INTO archive_fts (rowid, name, body) VALUES (?, ?, ?)",
+                    (archive_id, name, conversation_text(json.loads(conversation))),
+                )
+
+    def _insert(self, name, date, conversation_history, attachments):
+        cursor = self.conn.execute("INSERT INTO archives (name, date) VALUES (?, ?)", (name, date))
+        archive_id = cursor.lastrowid
+        self.conn.execute(
+            "INSERT INTO archive_data (archive_id, conversation, attachments) VALUES (?, ?, ?)",
+            (archive_id, json.dumps(conversation_history), json.dumps(attachments)),
+        )
+        if self.fts_enabled:
+            self.conn.execute(
+                "INSERT INTO archive_fts (rowid, name, body) VALUES (?, ?, ?)",
+                (archive_id, name, conversation_text(conversation_history)),
+            )
+        return archive_id
+
+    def add(self, name, conversation_history, attachments, date=None):
+        """Store a chat and return its archive id."""
+        date = date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock, self.conn:
+            return self._insert(name, date, conversation_history, attachments)
+
+    def list_entries(self):
+        """Return (id, date, name) for every archived chat, oldest first."""
+        with self.lock:
+            return self.conn.execute("SELECT id, date, name FROM archives ORDER BY id").fetchall()
+
+    def load(self, archive_id):
+        """Load a full archived chat, or None if it no longer exists."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT a.name, a.date, d.conversation, d.attachments "
+                "FROM archives a JOIN archive_data d ON d.archive_id = a.id WHERE a.id = ?",
+                (archive_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        name, date, conversation, attachments = row
+        return {
+            "name": name,
+            "date": date,
+            "conversation_history": json.loads(conversation),
+            "attachments": json.loads(attachments),
+        }
+
+    def rename(self, archive_id, name):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE archives SET name = ? WHERE id = ?", (name, archive_id))
+            if self.fts_enabled:
+                self.conn.execute("UPDATE archive_fts SET name = ? WHERE rowid = ?", (name, archive_id))
+
+    def delete(self, archive_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM archives WHERE id = ?", (archive_id,))
+            if self.fts_enabled:
+                self.conn.execute("DELETE FROM archive_fts WHERE rowid = ?", (archive_id,))
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        """
+        Return (hits, seconds) for a free-text query over names and messages.
+
+        Each hit is (id, date, name, snippet), best matches first (BM25, with
+        name matches weighted above message text).
+        """
+        start = time.perf_counter()
+        query = fts_query(text)
+        if not query:
+            return [], 0.0
+        with self.lock:
+            if self.fts_enabled:
+                hits = self.conn.execute(
+                    "SELECT a.id, a.date, a.name, snippet(archive_fts, 1, '[', ']', '...', 10) "
+                    "FROM archive_fts JOIN archives a ON a.id = archive_fts.rowid "
+                    "WHERE archive_fts MATCH ? ORDER BY bm25(archive_fts, 5.0, 1.0) LIMIT ?",
+                    (query, limit),
+                ).fetchall()
+            else:
+                pattern = f"%{text.strip()}%"
+                hits = self.conn.execute(
+                    "SELECT a.id, a.date, a.name, '' FROM archives a "
+                    "JOIN archive_data d ON d.archive_id = a.id "
+                    "WHERE a.name LIKE ? OR d.conversation LIKE ? ORDER BY a.id DESC LIMIT ?",
+                    (pattern, pattern, limit),
+                ).fetchall()
+        return hits, time.perf_counter() - start
+
+    def migrate_json(self, legacy_path):
+        """
+        Import every entry of a legacy chat_archives.json in one transaction.
+
+        The pre-rendered HTML stored in old entries is dropped; it is rebuilt
+        from the conversation when a chat is opened. The JSON file is renamed
+        afterwards so the import only happens once.
+        """
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not migrate {legacy_path}: {e}")
+            return 0
+
+        with self.lock, self.conn:
+            for entry in entries:
+                self._insert(
+                    entry.get("name", "Archived Chat"),
+                    entry.get("date", ""),
+                    entry.get("conversation_history", []),
+                    entry.get("attachments", []),
+                )
+        os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"Migrated {len(entries)} archived chats from {legacy_path}")
+        return len(entries)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ArchiveNamer:
+    """
+    Names archived chats with a model on a background thread.
+
+    Chats are archived immediately under a provisional name; submit() queues
+    them here, and the worker renames the stored entry once the model
+    replies. Chats queued close together are named in a single request. On
+    timeouts or network errors the provisional names are kept.
+    """
+
+    def __init__(self, archive, client, on_named=None, model=NAMING_MODEL, timeout=NAMING_TIMEOUT):
+        self.archive = archive
+        self.client = client
+        self.on_named = on_named
+        self.model = model
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, archive_id, conversation_md):
+        """Queue an archived chat for naming."""
+        self.queue.put((archive_id, conversation_md[:NAMING_CONTEXT_CHARS]))
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + NAMING_BATCH_WINDOW
+        while len(batch) < NAMING_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                names = self.request_names([conversation_md for _, conversation_md in batch])
+            except Exception as e:
+                print(f"Archive naming failed, keeping provisional names: {e}")
+                continue
+            for (archive_id, _), name in zip(batch, names):
+                if not name:
+                    continue
+                self.archive.rename(archive_id, name)
+                if self.on_named:
+                    self.on_named(archive_id, name)
+
+    def request_names(self, conversations):
+        """Ask the naming model for one short name per conversation."""
+        client = self.client.with_options(timeout=self.timeout, max_retries=0)
+        if len(conversations) == 1:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "Describe the conversation in maximum 5 words. Use the markdown below as context:"},
+                    {"role": "user", "content": conversations[0]}
+                ],
+            )
+            return [self._clean_name(response.choices[0].message.content)]
+
+        numbered = "\n\n".join(f"### Conversation {i}\n{md}" for i, md in enumerate(conversations, start=1))
+        response = client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": (
+                    "Describe each numbered conversation below in maximum 5 words. "
+                    "Reply with exactly one line per conversation in the form '<number>: <description>'."
+                )},
+                {"role": "user", "content": numbered}
+            ],
+        )
+        names = [None] * len(conversations)
+        for line in (response.choices[0].message.content or "").splitlines():
+            match = re.match(r"\s*(\d+)\s*[:.)-]\s*(.+)", line)
+            if match and 1 <= int(match.group(1)) <= len(conversations):
+                names[int(match.group(1)) - 1] = self._clean_name(match.group(2))
+        return names
+
+    @staticmethod
+    def _clean_name(text):
+        # Only take the first 5 words
+        return " ".join((text or "").strip().strip("*\"'").split()[:NAME_MAX_WORDS])
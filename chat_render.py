@@ -0,0 +1,101 @@
+"""
+HTML rendering of the conversation history for the chat display.
+
+markdown is imported on the first assistant message, so importing this
+module (and the GUI) stays fast.
+"""
+from collections import OrderedDict
+
+# Maximum number of message fragments kept in the render cache
+RENDER_CACHE_SIZE = 1024
+
+CHAT_HTML_HEADER = "<html><body style='font-family: Helvetica, Arial, sans-serif;'>"
+CHAT_HTML_FOOTER = "</body></html>"
+
+
+def message_display_text(msg):
+    """Return the text shown in the chat view for a message."""
+    if msg["role"] == "user":
+        return msg.get("display", msg.get("content", ""))
+    return msg.get("content", "")
+
+
+def render_message_html(msg):
+    """Convert a single conversation message to its HTML fragment."""
+    text = message_display_text(msg)
+    if msg["role"] == "user":
+        return (
+            "<div style='margin: 10px 0; padding: 10px; "
+            "background-color: #e6f2ff; border-radius: 10px;'>"
+            "<strong>You:</strong><br/>"
+            + text.replace('\n', '<br/>')
+            + "</div>"
+        )
+    elif msg["role"] == "assistant":
+        import markdown
+
+        return (
+            "<div style='margin: 10px 0; padding: 10px; "
+            "background-color: #f0f0f0; border-radius: 10px;'>"
+            "<strong>Assistant:</strong><br/>"
+            + markdown.markdown(text, extensions=['fenced_code', 'tables'])
+            + ("<p><em>[Response stopped]</em></p>" if msg.get("truncated") else "")
+            + "</div>"
+        )
+    elif msg["role"] == "system":
+        return (
+            "<div style='margin: 10px 0; padding: 10px; "
+            "color: #666; font-style: italic;'>"
+            "System: "
+            + text.replace('\n', '<br/>')
+            + "</div>"
+        )
+    return ""
+
+
+def render_chat_html(history):
+    """Render the whole history without caching (reference implementation)."""
+    return CHAT_HTML_HEADER + "".join(render_message_html(msg) for msg in history) + CHAT_HTML_FOOTER
+
+
+class ChatRenderer:
+    """
+    Renders conversation history to HTML, converting each message only once.
+
+    Fragments are cached per message object and validated against the message
+    text, so a message whose content changes (e.g. while streaming) is simply
+    re-rendered in place. The least recently used fragments are evicted once
+    the cache holds more than max_entries messages.
+    """
+
+    def __init__(self, max_entries=RENDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render_message(self, msg):
+        """Return the HTML fragment for a message, rendering it on a cache miss."""
+        key = id(msg)
+        text = message_display_text(msg)
+        state = (msg["role"], msg.get("truncated", False))
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == state and entry[1] == text:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        fragment = render_message_html(msg)
+        self.cache[key] = (state, text, fragment)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return fragment
+
+    def render(self, history):
+        """Assemble the chat document from cached per-message fragments."""
+        return CHAT_HTML_HEADER + "".join(self.render_message(msg) for msg in history) + CHAT_HTML_FOOTER
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,469 @@
+"""
+Headless chat session: history, attachments, request assembly, API calls
+and token/cost accounting, independent of Tkinter.
+
+The GUI drives a ChatSession through send() and drains its event queue on
+the Tk thread; scripts and benchmarks can call run() directly. Settings are
+passed per request as a plain dict (see DEFAULT_SETTINGS) read on the
+caller's thread, so the worker never touches UI state. Events are
+(kind, value) tuples:
+
+    status        status line text
+    progress      progress percentage (0-100)
+    context       context window report (see ContextManager.build)
+    request_size  size of the JSON request body in bytes
+    history       history changed (new message or more streamed text)
+    attachments   the attachment list changed
+    done          request finished; value is the result dict from run()
+    error         request failed; value is the error text
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+from context_window import ContextManager, context_budget, make_summarizer, CONTEXT_STRATEGY_SLIDING
+from openrouter_utils import (
+    estimate_tokens, extract_pdf_text, format_bytes, iter_stream_deltas, make_image_ref,
+    materialize_content, prepare_image, select_image_turns, IMAGE_MAX_EDGE, IMAGE_POLICY_LAST_N,
+)
+from request_timing import RequestTimer
+from response_cache import request_key
+
+# Request settings used where the caller does not override them
+DEFAULT_SETTINGS = {
+    "model": None,
+    "system_prompt": "",
+    "stream": True,
+    "context_strategy": CONTEXT_STRATEGY_SLIDING,
+    "context_budget": 0,  # 0 = the model's context length
+    "image_policy": IMAGE_POLICY_LAST_N,
+    "image_keep": 2,
+    "image_max_edge": IMAGE_MAX_EDGE,
+    "use_cache": False,
+    "bypass_cache": False,
+}
+
+# Sent in place of a reply stopped before any text arrived (providers reject empty turns)
+STOPPED_REPLY_PLACEHOLDER = "[Response stopped before any text was received]"
+
+
+def format_result(result):
+    """One-line status summary of a run() result."""
+    if result["stopped"]:
+        # Only the prompt and the tokens received before Stop are billed.
+        text = f"Stopped ({result['output_tokens']:,} tokens received, partial answer kept"
+    elif result["cached"]:
+        text = f"Ready (cached response, total {result['total_time']:.2f}s"
+    elif result["ttft"] is not None:
+        text = f"Ready (TTFT {result['ttft']:.2f}s, total {result['total_time']:.2f}s"
+    else:
+        text = f"Ready (total {result['total_time']:.2f}s"
+    text += f", request {format_bytes(result['request_bytes'])}"
+    if result["image_bytes"]:
+        text += f", images {format_bytes(result['image_bytes'])}"
+    if result["dropped_messages"]:
+        text += f", {result['dropped_messages']} older messages not sent to fit the context"
+    return text + ")"
+
+
+class ChatSession:
+    """
+    One conversation with its attachments and running token/cost totals.
+
+    Only one request runs at a time. History entries are appended and
+    streamed into by the worker thread only; readers on other threads see
+    either the old or the new text of a message, never a partial update.
+    """
+
+    def __init__(self, client, model_context=None, model_pricing=None, response_cache=None, events=None, summarize=None):
+        self.client = client
+        self.model_context = model_context or {}
+        self.model_pricing = model_pricing or {}
+        self.response_cache = response_cache
+        self.events = events if events is not None else queue.Queue()
+        # Chooses which history fits each request; summaries use the same client
+        self.context_manager = ContextManager(summarize=summarize or make_summarizer(client))
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.active_stream = None
+        self.is_processing = False
+        # Stream mode of the in-flight request, fixed when it was sent
+        self.streaming = False
+        self.history = []
+        self.attached_files = []
+        self.total_input_tokens = 0
+        self.total_output_tokens = 0
+        self.total_cost = 0.0
+        self.image_upload_bytes = 0
+
+    def emit(self, kind, value=None):
+        self.events.put((kind, value))
+
+    def attach(self, kind, path):
+        """Attach a file ("image" or "pdf") to the next message."""
+        self.attached_files.append({"type": kind, "path": path})
+        self.emit("attachments")
+
+    def remove_attachment(self, index):
+        del self.attached_files[index]
+        self.emit("attachments")
+
+    def clear_attachments(self, sent=None):
+        """Remove the attachments, or only those in sent (the ones a request took)."""
+        if sent is None:
+            self.attached_files = []
+        else:
+            # Files attached while the request was running stay for the next message.
+            self.attached_files = [f for f in self.attached_files if not any(f is s for s in sent)]
+        self.emit("attachments")
+
+    def reset(self):
+        """
+        Start a new conversation with zeroed token and cost totals.
+
+        Returns False (and changes nothing) while a request is running: its
+        reply and token counts belong to the current conversation.
+        """
+        with self.lock:
+            if self.is_processing:
+                return False
+            self.history = []
+            self.context_manager.reset()
+            self.total_input_tokens = 0
+            self.total_output_tokens = 0
+            self.total_cost = 0.0
+        self.emit("history")
+        return True
+
+    def load(self, history, attachments=()):
+        """Replace the conversation, e.g. with an archived chat; False while a request is running."""
+        with self.lock:
+            if self.is_processing:
+                return False
+            self.history = history
+            self.context_manager.reset()
+            self.attached_files = list(attachments)
+        self.emit("history")
+        self.emit("attachments")
+        return True
+
+    def send(self, user_input, settings):
+        """Run a request on a worker thread; False if one is already running."""
+        with self.lock:
+            if self.is_processing:
+                return False
+            self.is_processing = True
+            self.streaming = settings.get("stream", DEFAULT_SETTINGS["stream"])
+        self.cancel_event.clear()
+        threading.Thread(target=self._worker, args=(user_input, dict(settings), list(self.attached_files))).start()
+        return True
+
+    def _worker(self, user_input, settings, attachments):
+        try:
+            self.emit("done", self.run(user_input, settings, attachments))
+        except Exception as e:
+            error_message = f"Error: {str(e)}"
+            self.emit("error", error_message)
+            print(error_message)
+        finally:
+            with self.lock:
+                self.is_processing = False
+
+    def stop(self):
+        """
+        Abort the in-flight streamed request by closing its HTTP stream.
+
+        Returns False if nothing is running or the request was sent without
+        streaming (it cannot be interrupted), whatever the current settings say.
+        """
+        with self.lock:
+            if not self.is_processing or not self.streaming:
+                return False
+        self.cancel_event.set()
+        with self.lock:
+            response_stream = self.active_stream
+        if response_stream is not None:
+            response_stream.close()
+        return True
+
+    def detached(self):
+        """
+        A snapshot of the session for side requests such as model comparison.
+
+        It shares the client and model tables but has its own copy of the
+        history, its own context manager (seeded with the current rolling
+        summary), counters and event queue, so using it from another thread
+        never changes this session, even while a request is running.
+        """
+        copy = ChatSession(
+            self.client, self.model_context, self.model_pricing, summarize=self.context_manager.summarize
+        )
+        copy.history = list(self.history)
+        copy.context_manager.summary = self.context_manager.summary
+        copy.context_manager.summarized = self.context_manager.summarized
+        return copy
+
+    def run(self, user_input, settings=None, attachments=None):
+        """
+        Send one user turn and wait for the reply.
+
+        Returns a dict with response, model, stream, ttft, total_time, input_tokens,
+        output_tokens, request_bytes, image_bytes, cached, stopped,
+        dropped_messages (history left out to fit the context) and timer (a
+        RequestTimer with the request's spans).
+        """
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        if attachments is None:
+            attachments = list(self.attached_files)
+        model = settings["model"]
+        timer = RequestTimer()
+        self.image_upload_bytes = 0
+        self.emit("progress", 10)
+
+        with timer.span("attachments"):
+            self.history.append(self.build_user_message(user_input, attachments))
+        self.emit("history")
+
+        # Fit the history into the model's context budget. History entries are
+        # used as-is so their cached token counts are reused across requests.
+        self.emit("status", "Assembling context...")
+        with timer.span("context"):
+            messages, context_report = self.assemble_messages(self.history, [model], settings)
+        self.emit("context", context_report)
+
+        # Estimate input tokens from the cached per-message counts
+        with timer.span("tokenization"):
+            input_tokens = estimate_tokens(messages)
+
+        self.emit("progress", 30)
+        self.emit("status", f"Sending request to {model}...")
+
+        with timer.span("request_build"):
+            api_messages = self.build_api_messages(messages, settings)
+            request_bytes = len(json.dumps(api_messages))
+        self.emit("request_size", request_bytes)
+        request_start = time.perf_counter()
+
+        # Opt-in response cache; bypass_cache skips the lookup but stores the answer.
+        cache_key = None
+        cached = None
+        sent = True
+        if settings["use_cache"] and self.response_cache is not None:
+            with timer.span("cache_lookup"):
+                cache_key = request_key(model, api_messages)
+                if not settings["bypass_cache"]:
+                    cached = self.response_cache.get(cache_key)
+
+        if cached is not None:
+            assistant_response = cached["content"]
+            ttft = None
+            usage = None
+            self.history.append({"role": "assistant", "content": assistant_response})
+        elif settings["stream"]:
+            assistant_response, ttft, usage, sent = self.stream_completion(model, api_messages, request_start)
+        else:
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=api_messages,
+            )
+            assistant_response = response.choices[0].message.content.strip()
+            ttft = None
+            usage = getattr(response, "usage", None)
+            self.history.append({"role": "assistant", "content": assistant_response})
+        self.emit("history")
+
+        total_time = time.perf_counter() - request_start
+        if cached is None and ttft is not None:
+            timer.add("ttft", ttft)
+            timer.add("transfer", total_time - ttft)
+        elif cached is None:
+            timer.add("network", total_time)
+        self.emit("progress", 90)
+
+        # Prefer the provider's usage report; fall back to local estimates.
+        output_tokens = 0
+        if assistant_response:
+            output_tokens = estimate_tokens([{"role": "assistant", "content": assistant_response}])
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            input_tokens = usage.prompt_tokens
+            output_tokens = usage.completion_tokens or 0
+        stopped = self.cancel_event.is_set()
+        if cached is not None or not sent:
+            # Served locally, or stopped before the request went out: nothing is billed.
+            input_tokens = output_tokens = 0
+        elif cache_key is not None and not stopped and assistant_response:
+            self.response_cache.put(cache_key, assistant_response, usage)
+
+        with self.lock:
+            self.total_input_tokens += input_tokens
+            self.total_output_tokens += output_tokens
+            self.total_cost = self.session_cost(model)
+        self.clear_attachments(sent=attachments)
+
+        return {
+            "response": assistant_response,
+            "model": model,
+            "stream": settings["stream"],
+            "ttft": ttft,
+            "total_time": total_time,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "request_bytes": request_bytes,
+            "image_bytes": self.image_upload_bytes,
+            "cached": cached is not None,
+            "stopped": stopped,
+            "dropped_messages": context_report["dropped_messages"],
+            "timer": timer,
+        }
+
+    def session_cost(self, model):
+        """Cost of the session's tokens at model's prices (unchanged if the model has no pricing)."""
+        pricing = self.model_pricing.get(model)
+        if pricing is None:
+            return self.total_cost
+        input_cost = (self.total_input_tokens / 1_000_000) * pricing["input"]
+        output_cost = (self.total_output_tokens / 1_000_000) * pricing["output"]
+        return input_cost + output_cost
+
+    def extract_pdf_text(self, file_path):
+        name = os.path.basename(file_path)
+
+        def report_progress(done, total):
+            # Extraction runs before the request is sent, so it fills the 10-30% band.
+            self.emit("progress", 10 + 20 * done / total)
+            self.emit("status", f"Extracting {name}: page {done}/{total}")
+
+        try:
+            # Shared content-addressed cache: repeat uses skip PyPDF2 entirely
+            return extract_pdf_text(file_path, report_progress)
+        except Exception as e:
+            return f"PDF Error: {str(e)}"
+
+    def build_user_message(self, user_input, attachments):
+        """User message with separate display text and multi-part API content."""
+        display_message = user_input
+        api_message_parts = []
+
+        # Add the text part if present.
+        if user_input:
+            api_message_parts.append({"type": "text", "text": user_input})
+
+        for file in attachments:
+            if file["type"] == "image":
+                display_message += f"\n[Image Attached: {os.path.basename(file['path'])}]"
+                # Only a reference is stored; the data URI is built per request
+                # according to the image history policy.
+                if os.path.isfile(file["path"]):
+                    api_message_parts.append(make_image_ref(file["path"]))
+                else:
+                    self.emit("status", f"Error processing image: {file['path']} not found")
+            elif file["type"] == "pdf":
+                display_message += f"\n[PDF Attached: {os.path.basename(file['path'])}]"
+                pdf_text = self.extract_pdf_text(file["path"])
+                api_message_parts.append({
+                    "type": "text",
+                    "text": f"PDF CONTENT ({os.path.basename(file['path'])}):\n{pdf_text}"
+                })
+
+        return {"role": "user", "display": display_message, "content": api_message_parts}
+
+    def assemble_messages(self, history, models, settings):
+        """System prompt plus the history that fits the smallest context among models."""
+        system_messages = []
+        if settings["system_prompt"]:
+            system_messages.append({"role": "system", "content": settings["system_prompt"]})
+        budgets = [context_budget(model, self.model_context, settings["context_budget"]) for model in models]
+        known = [budget for budget in budgets if budget is not None]
+        # Models of unknown context length do not limit the history.
+        budget = min(known) if known else None
+        return self.context_manager.build(system_messages, history, budget, settings["context_strategy"])
+
+    def build_api_messages(self, messages, settings):
+        """Materialize stored messages for the API, applying the image history policy."""
+        image_turns = select_image_turns(messages, settings["image_policy"], settings["image_keep"])
+
+        def encode_image(image_path):
+            # Downsample/re-encode the image and return it as a data URI.
+            data_uri, info = prepare_image(image_path, max_edge=settings["image_max_edge"])
+            self.image_upload_bytes += info["encoded_bytes"]
+            self.emit("status", (
+                f"Image {os.path.basename(image_path)}: {format_bytes(info['original_bytes'])} -> "
+                f"{format_bytes(info['encoded_bytes'])} in {info['seconds']:.2f}s"
+                + (" (cached)" if info["cached"] else "")
+            ))
+            return data_uri
+
+        api_messages = []
+        for i, m in enumerate(messages):
+            if m["role"] == "user" and "api_content" in m:
+                content = m["api_content"]
+            else:
+                content = m.get("content", "")
+            if m["role"] == "assistant" and m.get("truncated") and not content:
+                content = STOPPED_REPLY_PLACEHOLDER
+            api_messages.append({
+                "role": m["role"],
+                "content": materialize_content(content, i in image_turns, encode_image),
+            })
+        return api_messages
+
+    def stream_completion(self, model, messages, request_start):
+        """
+        Stream a completion into the history and return (full text, time to
+        first token, usage, sent); sent is False if Stop came before the
+        request went out, so nothing was billed.
+
+        A reply stopped before any text arrived stays in the history as an
+        empty, truncated message, so the user turn is shown as stopped rather
+        than unanswered.
+        """
+        if self.cancel_event.is_set():
+            # Stop was pressed while attachments or context were being prepared.
+            self.history.append({"role": "assistant", "content": "", "truncated": True})
+            return "", None, None, False
+        response_stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        usage_report = []
+        with self.lock:
+            self.active_stream = response_stream
+        if self.cancel_event.is_set():
+            # Stop was pressed while waiting for the response headers.
+            response_stream.close()
+
+        assistant_message = {"role": "assistant", "content": ""}
+        self.history.append(assistant_message)
+
+        received = []
+        ttft = None
+        try:
+            for delta in iter_stream_deltas(response_stream, on_usage=usage_report.append):
+                if ttft is None:
+                    ttft = time.perf_counter() - request_start
+                    self.emit("status", f"Receiving from {model} (TTFT {ttft:.2f}s)...")
+                received.append(delta)
+                assistant_message["content"] += delta
+                self.emit("history")
+                if self.cancel_event.is_set():
+                    break
+        except Exception:
+            # Closing the stream from stop() surfaces here as a read error.
+            if not self.cancel_event.is_set():
+                raise
+        finally:
+            with self.lock:
+                self.active_stream = None
+            response_stream.close()
+            if self.cancel_event.is_set():
+                assistant_message["truncated"] = True
+            assistant_message["content"] = "".join(received).strip()
+            if not assistant_message["content"] and not self.cancel_event.is_set():
+                self.history.remove(assistant_message)
+
+        usage = usage_report[-1] if usage_report else None
+        return assistant_message["content"], ttft, usage, True
@@ -0,0 +1,222 @@
+"""
+Incremental chat display on top of tkhtmlview's HTMLScrolledText.
+
+set_html() clears the widget and re-parses the whole document, so its cost
+grows with every turn. ChatView instead keeps one block of text per message,
+delimited by marks, and only renders blocks that are new or whose message
+changed (in practice the streaming tail). Messages far back in a long chat
+are collapsed into one-line placeholders that expand when clicked.
+"""
+import tkinter as tk
+
+from chat_render import CHAT_HTML_FOOTER, CHAT_HTML_HEADER, message_display_text
+
+# Newest messages kept fully rendered; older ones collapse into placeholders
+VIEW_EXPANDED_MESSAGES = 100
+# Characters of the message shown in a collapsed placeholder
+PLACEHOLDER_PREVIEW_CHARS = 80
+# Blank lines between messages, as the full-document render produced them
+BLOCK_SEPARATOR = "\n\n"
+
+
+class _BlockTarget:
+    """
+    Widget proxy handed to the tkhtmlview parser while rendering one block.
+
+    The parser names its tags after text indices and assumes it is appending
+    at the end of the widget. The proxy gives each block's tags a unique
+    prefix (so blocks never share tags) and maps "end" to the insert mark,
+    so a block can be rendered anywhere in the text.
+    """
+
+    def __init__(self, widget, prefix):
+        self._widget = widget
+        self._prefix = prefix
+        self.tags = set()
+
+    def _index(self, index):
+        # "end-1c" is where the parser's next character goes: the insert mark.
+        if isinstance(index, str) and index.startswith(tk.END):
+            rest = index[len(tk.END):]
+            return f"{tk.INSERT}+1c{rest}" if rest not in ("", "-1c") else tk.INSERT
+        return index
+
+    def _tag(self, name):
+        name = f"{self._prefix}{name}"
+        self.tags.add(name)
+        return name
+
+    def index(self, index):
+        return self._widget.index(self._index(index))
+
+    def get(self, start, end=None):
+        return self._widget.get(self._index(start), self._index(end))
+
+    def delete(self, start, end=None):
+        self._widget.delete(self._index(start), self._index(end))
+
+    def tag_add(self, name, start, end=None):
+        self._widget.tag_add(self._tag(name), self._index(start), self._index(end))
+
+    def tag_config(self, name, **kwargs):
+        self._widget.tag_config(self._tag(name), **kwargs)
+
+    def tag_bind(self, name, sequence, func):
+        return self._widget.tag_bind(self._tag(name), sequence, func)
+
+    def __getattr__(self, name):
+        return getattr(self._widget, name)
+
+
+class ChatView:
+    """
+    Keeps an HTMLScrolledText in step with the conversation history.
+
+    sync(history) finds the first message that is new or changed since the
+    last call and re-renders from there on, so appending a message or
+    updating the streaming reply costs the same however long the chat is.
+    The user's scroll position is kept unless they were at the bottom, in
+    which case the view follows new output.
+    """
+
+    def __init__(self, widget, renderer, expanded_messages=VIEW_EXPANDED_MESSAGES):
+        self.widget = widget
+        self.renderer = renderer
+        self.expanded_messages = expanded_messages
+        self.blocks = []
+        self.serial = 0
+        self.widget.tag_configure("placeholder", foreground="#0066cc", underline=True)
+        self.widget.tag_bind("placeholder", "<Enter>", lambda e: self.widget.config(cursor="hand2"))
+        self.widget.tag_bind("placeholder", "<Leave>", lambda e: self.widget.config(cursor=""))
+
+    @staticmethod
+    def snapshot(msg):
+        """What a block's rendering depends on; a change means re-render."""
+        return (msg["role"], msg.get("truncated", False), message_display_text(msg))
+
+    def clear(self):
+        """Remove every message from the display."""
+        self.widget.delete("1.0", tk.END)
+        for block in self.blocks:
+            self._forget(block)
+            self.widget.mark_unset(block["mark"])
+        self.blocks = []
+
+    def sync(self, history):
+        """Update the display to show history, rendering only what changed."""
+        keep = 0
+        for block, msg in zip(self.blocks, history):
+            if block["msg"] is not msg or block["snapshot"] != self.snapshot(msg):
+                break
+            keep += 1
+        if keep == len(self.blocks) == len(history):
+            return
+
+        prev_state = self.widget.cget("state")
+        self.widget.config(state=tk.NORMAL)
+        follow = self.widget.yview()[1] >= 1.0
+        self.widget.mark_set("view_top", "@0,0")
+        self.widget.mark_gravity("view_top", tk.LEFT)
+
+        if keep < len(self.blocks):
+            self.widget.delete(self.blocks[keep]["mark"], tk.END)
+            for block in self.blocks[keep:]:
+                self._forget(block)
+                self.widget.mark_unset(block["mark"])
+            del self.blocks[keep:]
+        # Messages that would be collapsed straight away are never rendered in full.
+        first_expanded = len(history) - self.expanded_messages
+        for position in range(keep, len(history)):
+            self._append(history[position], collapsed=position < first_expanded)
+        self._collapse_old()
+
+        if follow:
+            self.widget.see(tk.END)
+        else:
+            self.widget.yview("view_top")
+        self.widget.config(state=prev_state)
+
+    def _append(self, msg, collapsed=False):
+        self.serial += 1
+        block = {
+            "msg": msg,
+            "snapshot": self.snapshot(msg),
+            "mark": f"block{self.serial}",
+            "prefix": f"b{self.serial}:",
+            "tags": set(),
+            "images": [],
+            "collapsed": collapsed,
+            "pinned": False,
+        }
+        self.widget.mark_set(block["mark"], "end-1c")
+        self.widget.mark_gravity(block["mark"], tk.LEFT)
+        self.blocks.append(block)
+        self._render(block)
+
+    def _block_end(self, position):
+        if position + 1 < len(self.blocks):
+            return self.blocks[position + 1]["mark"]
+        return "end-1c"
+
+    def _render(self, block):
+        """Insert the block's content at its mark (its range must be empty)."""
+        self.widget.mark_set(tk.INSERT, block["mark"])
+        if block["collapsed"]:
+            msg = block["msg"]
+            preview = " ".join(message_display_text(msg).split())[:PLACEHOLDER_PREVIEW_CHARS]
+            speaker = "You" if msg["role"] == "user" else msg["role"].capitalize()
+            expand_tag = f"{block['prefix']}expand"
+            block["tags"].add(expand_tag)
+            self.widget.tag_bind(expand_tag, "<Button-1>", lambda e, b=block: self.expand(b))
+            self.widget.insert(tk.INSERT, f"[+] {speaker}: {preview}", ("placeholder", expand_tag))
+        else:
+            target = _BlockTarget(self.widget, block["prefix"])
+            parser = self.widget.html_parser
+            parser.w_set_html(
+                target, CHAT_HTML_HEADER + self.renderer.render_message(block["msg"]) + CHAT_HTML_FOOTER, strip=True
+            )
+            block["tags"] |= target.tags
+            # The parser only keeps images of its latest document alive.
+            block["images"] = list(parser.images)
+        self.widget.insert(tk.INSERT, BLOCK_SEPARATOR)
+
+    def _rerender(self, position):
+        """Replace a block's content in place, wherever it is in the chat."""
+        block = self.blocks[position]
+        self.widget.delete(block["mark"], self._block_end(position))
+        self._forget(block)
+        self._render(block)
+        # The next block's mark shared this block's start; move it past the new content.
+        if position + 1 < len(self.blocks):
+            self.widget.mark_set(self.blocks[position + 1]["mark"], tk.INSERT)
+
+    def _forget(self, block):
+        for tag in block["tags"]:
+            self.widget.tag_delete(tag)
+        block["tags"] = set()
+        block["images"] = []
+
+    def _collapse_old(self):
+        # Walk back from the newest block that fell out of the expanded window;
+        # everything before the first collapsed block was handled earlier.
+        for position in range(len(self.blocks) - self.expanded_messages - 1, -1, -1):
+            block = self.blocks[position]
+            if block["collapsed"]:
+                break
+            if not block["pinned"]:
+                block["collapsed"] = True
+                self._rerender(position)
+
+    def expand(self, block):
+        """Render a collapsed message in full (placeholder click)."""
+        position = next((i for i, b in enumerate(self.blocks) if b is block), None)
+        if position is None or not block["collapsed"]:
+            return
+        prev_state = self.widget.cget("state")
+        self.widget.config(state=tk.NORMAL)
+        self.widget.mark_set("view_top", "@0,0")
+        block["collapsed"] = False
+        block["pinned"] = True
+        self._rerender(position)
+        self.widget.yview("view_top")
+        self.widget.config(state=prev_state)
@@ -0,0 +1,213 @@
+"""
+Token-budgeted assembly of the messages sent with each request.
+
+The newest user turn is always sent. Older turns are added newest first for
+as long as they fit in the budget; what does not fit is dropped, optionally
+keeping the first turn pinned or replacing the dropped turns with a rolling
+summary.
+
+Context lengths come from Open_router_basics.Model_context or, for models not
+listed there, from OpenRouter's model list. While a model's length is
+unknown there is no budget and the full history is sent.
+"""
+import json
+import os
+import tempfile
+import time
+
+from chat_render import message_display_text
+from openrouter_utils import message_tokens, CACHE_DIR, REQUEST_OVERHEAD_TOKENS
+
+# OpenRouter's context lengths, cached on disk and refreshed after max age
+MODEL_CONTEXT_CACHE_PATH = os.path.join(CACHE_DIR, "model_context.json")
+MODEL_CONTEXT_MAX_AGE = 24 * 3600  # seconds
+# Kept free for the model's reply
+RESERVED_OUTPUT_TOKENS = 4_096
+
+CONTEXT_STRATEGY_FULL = "full"
+CONTEXT_STRATEGY_SLIDING = "sliding"
+CONTEXT_STRATEGY_PIN_FIRST = "pin_first"
+CONTEXT_STRATEGY_SUMMARY = "summary"
+
+SUMMARY_MODEL = "google/gemini-2.0-flash-001"
+SUMMARY_TIMEOUT = 30  # seconds
+# Budget set aside for the summary message when turns are dropped
+SUMMARY_MAX_TOKENS = 600
+# Characters of each evicted message passed to the summarizer
+SUMMARY_MESSAGE_CHARS = 4000
+
+
+def context_budget(model, model_context, user_budget=0):
+    """
+    Prompt token budget for a model: its context minus the reply reserve, capped by user_budget.
+
+    None if the model's context length is unknown and no user budget is set.
+    """
+    context_length = model_context.get(model)
+    if context_length is None:
+        return user_budget if user_budget and user_budget > 0 else None
+    budget = context_length - RESERVED_OUTPUT_TOKENS
+    if user_budget and user_budget > 0:
+        budget = min(budget, user_budget)
+    return max(budget, 0)
+
+
+def fetch_context_lengths(client, path=MODEL_CONTEXT_CACHE_PATH, max_age=MODEL_CONTEXT_MAX_AGE):
+    """
+    {model id: context length} from OpenRouter's /models, cached on disk for max_age seconds.
+
+    A stale cache is still returned if the model list cannot be fetched; {}
+    if there is neither.
+    """
+    cached = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - os.path.getmtime(path) < max_age:
+            return cached
+    except (OSError, ValueError):
+        pass
+    try:
+        models = client.models.list().data
+    except Exception as e:
+        print(f"Could not fetch model context lengths: {e}")
+        return cached
+    lengths = {}
+    for model in models:
+        context_length = getattr(model, "context_length", None)
+        if isinstance(context_length, int) and context_length > 0:
+            lengths[model.id] = context_length
+    if lengths:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(lengths, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not cache model context lengths: {e}")
+    return lengths or cached
+
+
+def split_turns(history):
+    """Group history into turns, each starting at a user message."""
+    turns = []
+    for msg in history:
+        if msg["role"] == "user" or not turns:
+            turns.append([msg])
+        else:
+            turns[-1].append(msg)
+    return turns
+
+
+def make_summarizer(client, model=SUMMARY_MODEL, timeout=SUMMARY_TIMEOUT):
+    """Return summarize(previous_summary, messages) backed by a chat model."""
+    def summarize(previous_summary, messages):
+        transcript = "\n\n".join(
+            f"{msg['role'].capitalize()}: {message_display_text(msg)[:SUMMARY_MESSAGE_CHARS]}"
+            for msg in messages
+            if msg["role"] in ("user", "assistant")
+        )
+        prompt = (
+            "Update the running summary of a conversation with the new messages below. "
+            "Keep facts, decisions, open questions and any details the user may refer back to. "
+            "Answer with the updated summary only, in at most 300 words.\n\n"
+            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        response = client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return response.choices[0].message.content.strip()
+    return summarize
+
+
+class ContextManager:
+    """
+    Chooses which history messages fit in a request's token budget.
+
+    Token counts come from the per-message cache, so selecting is cheap. For
+    the summary strategy the dropped turns are always a prefix of the history,
+    so the summary is rolled forward: only turns evicted since the last
+    request are sent to the summarizer.
+    """
+
+    def __init__(self, summarize=None):
+        self.summarize = summarize
+        self.reset()
+
+    def reset(self):
+        """Forget the rolling summary (new session or a different chat loaded)."""
+        self.summary = ""
+        self.summarized = 0  # leading history messages covered by the summary
+
+    def rolling_summary(self, evicted):
+        if len(evicted) < self.summarized:
+            self.reset()
+        if len(evicted) > self.summarized and self.summarize is not None:
+            try:
+                self.summary = self.summarize(self.summary, evicted[self.summarized:])
+                self.summarized = len(evicted)
+            except Exception as e:
+                print(f"Context summary failed, dropping old turns without it: {e}")
+        return self.summary
+
+    def build(self, system_messages, history, budget, strategy=CONTEXT_STRATEGY_SLIDING):
+        """
+        Return (messages, report) for a request.
+
+        report holds budget, kept_tokens, dropped_tokens, dropped_messages and
+        summary_tokens for display. A budget of None (context length unknown)
+        sends the full history.
+        """
+        fixed_tokens = sum(message_tokens(m) for m in system_messages) + REQUEST_OVERHEAD_TOKENS
+        turns = split_turns(history)
+        turn_tokens = [sum(message_tokens(m) for m in turn) for turn in turns]
+        history_tokens = sum(turn_tokens)
+        report = {
+            "budget": budget,
+            "kept_tokens": fixed_tokens + history_tokens,
+            "dropped_tokens": 0,
+            "dropped_messages": 0,
+            "summary_tokens": 0,
+        }
+        if (strategy == CONTEXT_STRATEGY_FULL or budget is None or not turns
+                or fixed_tokens + history_tokens <= budget):
+            return list(system_messages) + list(history), report
+
+        available = budget - fixed_tokens
+        if strategy == CONTEXT_STRATEGY_SUMMARY:
+            available -= SUMMARY_MAX_TOKENS
+
+        # The newest turn is always sent, even if it alone exceeds the budget.
+        keep = [False] * len(turns)
+        keep[-1] = True
+        used = turn_tokens[-1]
+        if strategy == CONTEXT_STRATEGY_PIN_FIRST and len(turns) > 1 and used + turn_tokens[0] <= available:
+            keep[0] = True
+            used += turn_tokens[0]
+        for i in range(len(turns) - 2, -1, -1):
+            if keep[i]:
+                continue
+            if used + turn_tokens[i] > available:
+                break
+            keep[i] = True
+            used += turn_tokens[i]
+
+        kept_messages = [msg for turn, kept in zip(turns, keep) if kept for msg in turn]
+        dropped = [msg for turn, kept in zip(turns, keep) if not kept for msg in turn]
+        messages = list(system_messages)
+
+        if strategy == CONTEXT_STRATEGY_SUMMARY and dropped:
+            summary = self.rolling_summary(dropped)
+            if summary:
+                summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+                messages.append(summary_message)
+                report["summary_tokens"] = message_tokens(summary_message)
+
+        messages.extend(kept_messages)
+        report["kept_tokens"] = fixed_tokens + used + report["summary_tokens"]
+        report["dropped_tokens"] = history_tokens - used
+        report["dropped_messages"] = len(dropped)
+        return messages, report
@@ -0,0 +1,755 @@
+"""
+Shared helpers for the OpenRouter GUI and the literature review scripts.
+
+openai, httpx, tiktoken, PIL and PyPDF2 are imported inside the functions
+that need them, so importing this module (and the GUI) stays fast.
+"""
+import base64
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Approximate per-message overhead for the role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+# Constant token estimate used for image parts
+IMAGE_PART_TOKENS = 3
+# Tokens added once per request for reply priming
+REQUEST_OVERHEAD_TOKENS = 2
+# Number of memoized string token counts
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# HTTP connection pool settings for the shared API client
+HTTP_CONNECT_TIMEOUT = 10  # seconds
+HTTP_READ_TIMEOUT = 300  # seconds; long answers from slow models stream for minutes
+HTTP_CONNECT_RETRIES = 2
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+HTTP_KEEPALIVE_EXPIRY = 120  # seconds an idle connection stays open
+
+# On-disk cache shared by the GUIs and the literature review scripts
+CACHE_DIR = os.environ.get(
+    "OPENROUTER_GUI_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "openrouter_gui"),
+)
+# Size limit of the extracted PDF text cache
+PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Bump when the extraction output changes so stale entries are ignored
+PDF_CACHE_VERSION = 1
+# Below this page count pool startup costs more than parallel extraction saves
+PARALLEL_PDF_MIN_PAGES = 40
+# Upper bound on pages handed to a worker process per task
+PDF_PAGES_PER_TASK = 8
+
+# Longest image edge (pixels) sent to the model; larger images are downsampled
+IMAGE_MAX_EDGE = 1568
+# Encoder quality for re-encoded images
+IMAGE_QUALITY = 85
+# Format for opaque images; images with transparency are encoded as WEBP
+IMAGE_FORMAT = "JPEG"
+# Number of encoded image payloads kept in memory
+IMAGE_CACHE_SIZE = 32
+
+# Which earlier turns get their images re-sent with each request
+IMAGE_POLICY_ALL = "all"
+IMAGE_POLICY_CURRENT = "current"
+IMAGE_POLICY_LAST_N = "last_n"
+
+# Models whose OpenRouter providers honour explicit cache_control breakpoints;
+# the others (OpenAI, DeepSeek, ...) cache identical prompt prefixes on their own
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/")
+
+
+def iter_stream_deltas(response_stream, on_usage=None):
+    """
+    Yield the text deltas of a streaming chat completion as they arrive.
+
+    If on_usage is given it is called with the usage block when the stream
+    reports one (usually in the final chunk).
+    """
+    for chunk in response_stream:
+        usage = getattr(chunk, "usage", None)
+        if usage is not None and on_usage is not None:
+            on_usage(usage)
+        # Usage-only chunks at the end of a stream carry no choices.
+        if not chunk.choices:
+            continue
+        content = getattr(chunk.choices[0].delta, "content", None)
+        if content:
+            yield content
+
+
+def collect_full_response(response_stream, on_usage=None):
+    """Aggregate a streaming chat completion into a single string."""
+    return "".join(iter_stream_deltas(response_stream, on_usage))
+
+
+def cached_prefix_content(prefix, rest, model):
+    """
+    User message content that puts the shared prefix first, as its own part.
+
+    For models that support it the prefix part carries a cache_control
+    breakpoint, so requests that repeat it are billed (and served) from the
+    provider's prompt cache. Other models get plain text in the same order.
+    """
+    if not model.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+        return prefix + rest
+    return [
+        {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": rest},
+    ]
+
+
+class PromptCacheStats:
+    """Totals of cached vs. uncached prompt tokens (and request times) from usage reports."""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        # [count, seconds] of requests with and without a cache hit
+        self.timings = {True: [0, 0.0], False: [0, 0.0]}
+        self.lock = threading.Lock()
+
+    def add(self, usage, seconds=None):
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += getattr(usage, "prompt_tokens", None) or 0
+            self.cached_tokens += cached
+            if seconds is not None:
+                timing = self.timings[cached > 0]
+                timing[0] += 1
+                timing[1] += seconds
+
+    def summary(self):
+        with self.lock:
+            if not self.requests:
+                return "no usage reported"
+            share = self.cached_tokens / self.prompt_tokens * 100 if self.prompt_tokens else 0
+            text = (
+                f"{self.cached_tokens:,} cached / {self.prompt_tokens - self.cached_tokens:,} uncached "
+                f"input tokens ({share:.1f}% cached) over {self.requests} requests"
+            )
+            (hits, hit_seconds), (misses, miss_seconds) = self.timings[True], self.timings[False]
+            if hits and misses:
+                text += f"; {hit_seconds / hits:.1f}s per request with a cache hit vs. {miss_seconds / misses:.1f}s without"
+            return text
+
+
+def http2_available():
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def make_http_client(http2=None):
+    """httpx client with explicit keep-alive limits, timeouts and connect retries."""
+    import httpx
+
+    if http2 is None:
+        http2 = http2_available()
+    transport = httpx.HTTPTransport(
+        http2=http2,
+        retries=HTTP_CONNECT_RETRIES,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+class LazyClient:
+    """
+    Stand-in for an OpenAI client that is only built on first use.
+
+    Importing openai and setting up TLS take most of the GUI's startup time;
+    deferring them lets the window appear first while the connection
+    warm-up thread builds the real client in the background.
+    """
+
+    def __init__(self, factory):
+        self._lazy_factory = factory
+        self._lazy_client = None
+        self._lazy_lock = threading.Lock()
+
+    def resolve(self):
+        """Return the real client, building it if needed."""
+        if self._lazy_client is None:
+            with self._lazy_lock:
+                if self._lazy_client is None:
+                    self._lazy_client = self._lazy_factory()
+        return self._lazy_client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def make_client(api_key, base_url=OPENROUTER_BASE_URL, http2=None):
+    """OpenAI-compatible client for OpenRouter on a tuned connection pool, built lazily."""
+    def build():
+        from openai import OpenAI
+
+        return OpenAI(base_url=base_url, api_key=api_key, http_client=make_http_client(http2))
+    return LazyClient(build)
+
+
+def warm_connection(client):
+    """
+    Open a pooled connection (DNS, TCP, TLS) to the API host ahead of the first request.
+
+    Returns the time taken in seconds, or None if the host was unreachable.
+    The response status does not matter; only the kept-alive connection does.
+    """
+    import httpx
+
+    http_client = getattr(client, "_client", None)
+    if not isinstance(http_client, httpx.Client):
+        return None
+    start = time.perf_counter()
+    try:
+        http_client.head(str(client.base_url), timeout=HTTP_CONNECT_TIMEOUT)
+    except httpx.HTTPError as e:
+        print(f"Connection warm-up failed: {e}")
+        return None
+    return time.perf_counter() - start
+
+
+def warm_connection_async(client, on_done=None):
+    """Run warm_connection on a daemon thread, then call on_done(seconds or None)."""
+    def run():
+        seconds = warm_connection(client)
+        if on_done is not None:
+            on_done(seconds)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute.
+
+    The bucket holds at most capacity (by default one minute's worth), so
+    after an idle period a burst of that size goes through at once.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1, cancel=None):
+        """
+        Block until amount is available and take it; amounts above capacity wait for a full bucket.
+
+        Returns False without taking anything if the cancel event is set while waiting.
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return True
+                wait = (amount - self.level) / self.rate
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                return False
+
+    def charge(self, amount):
+        """Deduct usage only known afterwards; the level may go negative and delay later callers."""
+        with self.lock:
+            self._refill()
+            self.level -= amount
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for API calls; 0 disables a limit."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, cancel=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.cancel = cancel
+
+    def acquire(self, tokens=0):
+        """Wait for a request slot and the estimated prompt tokens; False if cancelled while waiting."""
+        if self.requests is not None and not self.requests.acquire(1, self.cancel):
+            return False
+        if self.tokens is not None and tokens and not self.tokens.acquire(tokens, self.cancel):
+            return False
+        return True
+
+    def charge(self, tokens):
+        """Account for tokens used beyond the estimate (e.g. the completion)."""
+        if self.tokens is not None and tokens:
+            self.tokens.charge(tokens)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding():
+    """Load the tiktoken encoding once per process; None if it is unavailable."""
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model("gpt-3.5-turbo")
+    except Exception:
+        return None
+
+
+def warm_tokenizer_async():
+    """Load the tiktoken encoding on a daemon thread so the first count does not wait for it."""
+    thread = threading.Thread(target=get_encoding, daemon=True)
+    thread.start()
+    return thread
+
+
+# Digest of a string -> its token count. Keyed by digest so that counting a
+# whole PDF or prompt does not keep the text itself alive.
+_token_counts = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def count_text_tokens(text):
+    """Count the tokens in a string, falling back to ~4 characters per token."""
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    encoding = get_encoding()
+    if encoding is None:
+        count = len(text) // 4
+    else:
+        count = len(encoding.encode(text, disallowed_special=()))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return count
+
+
+def clear_token_counts():
+    """Forget memoized token counts (used by benchmarks to measure cold counting)."""
+    with _token_counts_lock:
+        _token_counts.clear()
+
+
+def split_token_chunks(text, max_tokens, overlap_tokens=0):
+    """
+    Split text into chunks of at most max_tokens tokens.
+
+    Each chunk after the first repeats the last overlap_tokens tokens of the
+    one before it, so sentences cut at a boundary appear whole in one chunk.
+    """
+    step = max(max_tokens - overlap_tokens, 1)
+    encoding = get_encoding()
+    if encoding is None:
+        # Same ~4 characters per token estimate as count_text_tokens
+        size, step, overlap = max_tokens * 4, step * 4, overlap_tokens * 4
+        return [text[start:start + size] for start in range(0, max(len(text) - overlap, 1), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        encoding.decode(tokens[start:start + max_tokens])
+        for start in range(0, max(len(tokens) - overlap_tokens, 1), step)
+    ]
+
+
+def count_content_tokens(content):
+    """Count the tokens of a message content (plain string or multi-part list)."""
+    if isinstance(content, list):
+        token_count = 0
+        for part in content:
+            if part.get("type") == "text":
+                token_count += count_text_tokens(part.get("text", ""))
+            elif part.get("type") in ("image_url", "image_ref"):
+                token_count += IMAGE_PART_TOKENS
+        return token_count
+    return count_text_tokens(content or "")
+
+
+def message_tokens(message):
+    """
+    Return the token count of a message, computing it only once.
+
+    The count is stored on the message under "tokens" so that later requests
+    replaying the same history only sum cached values.
+    """
+    if "tokens" not in message:
+        message["tokens"] = MESSAGE_OVERHEAD_TOKENS + count_content_tokens(message.get("content", ""))
+    return message["tokens"]
+
+
+def estimate_tokens(messages):
+    """Estimate the prompt tokens of a request from per-message cached counts."""
+    return sum(message_tokens(message) for message in messages) + REQUEST_OVERHEAD_TOKENS
+
+
+class DiskLRUCache:
+    """
+    JSON values stored one file per key in a directory.
+
+    Reads refresh the file's modification time, and writes evict the least
+    recently used files once the directory grows beyond max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or unreadable entry."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        """Store value under key (atomically) and evict old entries if needed."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # A unique temp file per write: threads of one process may store the same key.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{key}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self.evict()
+        except OSError as e:
+            print(f"Cache write failed for {key}: {e}")
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+pdf_text_cache = DiskLRUCache(os.path.join(CACHE_DIR, "pdf_text"), PDF_CACHE_MAX_BYTES)
+
+# (path, size, mtime) -> content digest, so a file is hashed once per process
+_file_digests = {}
+
+
+def file_digest(file_path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_digests.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        _file_digests[memo_key] = digest
+    return digest
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    """Return the process pool used for PDF extraction, starting it on first use."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # The GUI and the scripts run several threads; forking a threaded
+            # process can deadlock the child, so workers are spawned instead.
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+
+# (path, size, mtime) and parsed reader of the PDF a worker process last opened
+_worker_reader = None
+
+
+def _extract_page_range(file_path, start, stop):
+    """Extract the text of pages [start, stop) of a PDF (runs in a worker process)."""
+    global _worker_reader
+    stat = os.stat(file_path)
+    reader_key = (file_path, stat.st_size, stat.st_mtime_ns)
+    # Reuse the parsed document across tasks instead of re-reading the xref each time.
+    if _worker_reader is None or _worker_reader[0] != reader_key:
+        from PyPDF2 import PdfReader
+
+        _worker_reader = (reader_key, PdfReader(file_path))
+    reader = _worker_reader[1]
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _extract_pages_serial(reader, progress_callback=None):
+    total_pages = len(reader.pages)
+    pages = []
+    for i, page in enumerate(reader.pages):
+        pages.append(page.extract_text() or "")
+        if progress_callback:
+            progress_callback(i + 1, total_pages)
+    return pages
+
+
+def _extract_pages_parallel(file_path, total_pages, progress_callback=None):
+    """
+    Split the pages of a PDF across the process pool.
+
+    Task results are consumed in page order, so pages stream back in order and
+    progress always reflects a contiguous prefix of the document.
+    """
+    global _pdf_pool
+    pool = _get_pdf_pool()
+    workers = os.cpu_count() or 1
+    per_task = max(1, min(PDF_PAGES_PER_TASK, -(-total_pages // (workers * 4))))
+    try:
+        futures = [
+            pool.submit(_extract_page_range, file_path, start, min(start + per_task, total_pages))
+            for start in range(0, total_pages, per_task)
+        ]
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+            if progress_callback:
+                progress_callback(len(pages), total_pages)
+        return pages
+    except BrokenProcessPool:
+        # A crashed worker poisons the pool; drop it so the next call starts fresh.
+        with _pdf_pool_lock:
+            if _pdf_pool is pool:
+                _pdf_pool = None
+        raise
+
+
+def use_parallel_extraction(total_pages):
+    """Whether a document is large enough to be worth the process pool."""
+    return total_pages >= PARALLEL_PDF_MIN_PAGES and (os.cpu_count() or 1) > 1
+
+
+def extract_pdf_pages(file_path, progress_callback=None, use_cache=True, parallel=None):
+    """
+    Extract the text of every page of a PDF, using the shared on-disk cache.
+
+    The cache is keyed by the file's content hash, so a document is only
+    parsed the first time it is seen by any of the tools. Large documents are
+    split across a process pool; parallel=None picks serial mode below
+    PARALLEL_PDF_MIN_PAGES, where pool startup would dominate.
+    progress_callback, if given, is called as progress_callback(pages_done,
+    total_pages). Errors from PyPDF2 are propagated to the caller.
+    """
+    key = f"v{PDF_CACHE_VERSION}-{file_digest(file_path)}"
+    if use_cache:
+        cached = pdf_text_cache.get(key)
+        if cached is not None:
+            pages = cached["pages"]
+            if progress_callback and pages:
+                progress_callback(len(pages), len(pages))
+            return pages
+
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    if parallel is None:
+        parallel = use_parallel_extraction(total_pages)
+
+    if parallel:
+        try:
+            pages = _extract_pages_parallel(file_path, total_pages, progress_callback)
+        except BrokenProcessPool:
+            pages = _extract_pages_serial(reader, progress_callback)
+    else:
+        pages = _extract_pages_serial(reader, progress_callback)
+
+    if use_cache:
+        pdf_text_cache.put(key, {"source": os.path.basename(file_path), "pages": pages})
+    return pages
+
+
+def extract_pdf_text(file_path, progress_callback=None):
+    """Extract the full text of a PDF (cached), with pages joined by spaces."""
+    return " ".join(extract_pdf_pages(file_path, progress_callback))
+
+
+def format_bytes(num_bytes):
+    """Human readable size, e.g. 1.2 MB."""
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+
+# (content digest, max edge, quality, format) -> (data URI, info)
+_image_cache = OrderedDict()
+
+
+def prepare_image(image_path, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_QUALITY, image_format=IMAGE_FORMAT):
+    """
+    Downsample and re-encode an image, returning (data_uri, info).
+
+    The image is rotated according to its EXIF orientation, scaled so its
+    longest edge is at most max_edge, and re-encoded without metadata. The
+    re-encoded bytes are always sent, even when they are larger than the
+    original, so EXIF data such as GPS position never leaves the machine.
+    Payloads are cached in memory by content hash, so
+    re-sending the same image costs nothing. info holds original_bytes,
+    encoded_bytes, seconds and cached.
+    """
+    start = time.perf_counter()
+    cache_key = (file_digest(image_path), max_edge, quality, image_format)
+    cached = _image_cache.get(cache_key)
+    if cached is not None:
+        _image_cache.move_to_end(cache_key)
+        data_uri, info = cached
+        return data_uri, dict(info, seconds=time.perf_counter() - start, cached=True)
+
+    from PIL import Image, ImageOps
+
+    with open(image_path, "rb") as f:
+        original = f.read()
+
+    with Image.open(io.BytesIO(original)) as img:
+        # Animated formats are reduced to their first frame.
+        img.seek(0)
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        out_format = "WEBP" if has_alpha else image_format
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format=out_format, quality=quality, optimize=True)
+        encoded = buffer.getvalue()
+        mime_type = f"image/{out_format.lower()}"
+
+    data_uri = f"data:{mime_type};base64,{base64.b64encode(encoded).decode('utf-8')}"
+    info = {
+        "original_bytes": len(original),
+        "encoded_bytes": len(encoded),
+        "seconds": time.perf_counter() - start,
+        "cached": False,
+    }
+    _image_cache[cache_key] = (data_uri, info)
+    while len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+    return data_uri, info
+
+
+def make_image_ref(image_path):
+    """Reference to an attached image, stored in history instead of its data URI."""
+    return {"type": "image_ref", "path": image_path, "name": os.path.basename(image_path)}
+
+
+def has_images(message):
+    content = message.get("content")
+    return isinstance(content, list) and any(
+        part.get("type") in ("image_ref", "image_url") for part in content
+    )
+
+
+def select_image_turns(history, policy, keep_last=1):
+    """
+    Return the indexes of history messages whose images should be sent.
+
+    IMAGE_POLICY_CURRENT only sends images attached to the newest user turn,
+    IMAGE_POLICY_LAST_N sends the keep_last most recent turns with images and
+    IMAGE_POLICY_ALL sends every image again.
+    """
+    image_turns = [i for i, msg in enumerate(history) if msg["role"] == "user" and has_images(msg)]
+    if policy == IMAGE_POLICY_ALL:
+        return set(image_turns)
+    if policy == IMAGE_POLICY_CURRENT:
+        user_turns = [i for i, msg in enumerate(history) if msg["role"] == "user"]
+        return {user_turns[-1]} & set(image_turns) if user_turns else set()
+    return set(image_turns[-keep_last:]) if keep_last > 0 else set()
+
+
+def materialize_content(content, include_images, encode_image):
+    """
+    Turn stored message content into API content.
+
+    Image references become data URIs via encode_image(path) when
+    include_images is true; otherwise (or if the file is gone) they are
+    replaced by a short text placeholder. Inline data URIs from older
+    history entries are subject to the same rule.
+    """
+    if not isinstance(content, list):
+        return content
+    parts = []
+    for part in content:
+        part_type = part.get("type")
+        if part_type == "image_ref":
+            if include_images:
+                try:
+                    parts.append({"type": "image_url", "image_url": {"url": encode_image(part["path"])}})
+                    continue
+                except Exception as e:
+                    print(f"Could not load image {part['path']}: {e}")
+                    parts.append({"type": "text", "text": f"[Image unavailable: {part['name']}]"})
+                    continue
+            parts.append({"type": "text", "text": f"[Image previously attached: {part['name']}]"})
+        elif part_type == "image_url" and not include_images:
+            parts.append({"type": "text", "text": "[Image previously attached]"})
+        else:
+            parts.append(part)
+    return parts
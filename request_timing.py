@@ -0,0 +1,74 @@
+"""
+Named timing spans for chat requests and a rotating JSONL log of them.
+
+Each request records where its time went (attachment preparation, context
+assembly, tokenization, request build, time to first token, transfer,
+rendering). The GUI shows the last breakdown and appends every request to
+request_spans.jsonl in the cache directory for offline analysis.
+"""
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import time
+
+from openrouter_utils import CACHE_DIR
+
+SPAN_LOG_FILE = os.path.join(CACHE_DIR, "request_spans.jsonl")
+# Size at which the span log is rotated, and how many old files are kept
+SPAN_LOG_MAX_BYTES = 5 * 1024 * 1024
+SPAN_LOG_BACKUPS = 3
+
+
+class RequestTimer:
+    """Timing spans of one request in the order they were first recorded (seconds)."""
+
+    def __init__(self):
+        self.spans = {}
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Add seconds to a span; repeated spans (e.g. render) accumulate."""
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def breakdown(self):
+        """Multi-line "name  123.4 ms" text for display."""
+        return "\n".join(f"{name:<12} {seconds * 1000:>8.1f} ms" for name, seconds in self.spans.items())
+
+    def as_record(self, **fields):
+        """JSON-ready record of the spans (in ms) plus extra fields."""
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        record.update(fields)
+        record["spans_ms"] = {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()}
+        return record
+
+
+class SpanLog:
+    """Appends span records as JSON lines, rotating the file once it grows too large."""
+
+    def __init__(self, path=SPAN_LOG_FILE, max_bytes=SPAN_LOG_MAX_BYTES, backups=SPAN_LOG_BACKUPS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.logger = logging.getLogger(f"openrouter_gui.spans.{path}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    def write(self, record):
+        try:
+            self.logger.info(json.dumps(record))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write span record: {e}")
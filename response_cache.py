@@ -0,0 +1,105 @@
+"""
+Opt-in on-disk cache of chat completions for repeated identical requests.
+
+A request is identified by a hash of its canonical JSON form: model, the
+full message list (including attachment data) and sampling parameters.
+Entries expire after a TTL and the least recently used ones are evicted
+once the cache outgrows its size limit.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from openrouter_utils import CACHE_DIR, DiskLRUCache, iter_stream_deltas
+
+# Cached completions live next to the PDF text cache
+RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, "responses")
+RESPONSE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# Entries older than this are treated as misses and removed
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+
+def request_key(model, messages, **params):
+    """Canonical hash of a chat completion request."""
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Completion cache with TTL, LRU size bound and hit/miss counters."""
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.store = DiskLRUCache(directory, max_bytes)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached entry ({"content", "usage", "created"}) or None."""
+        entry = self.store.get(key)
+        if entry is not None and time.time() - entry.get("created", 0) > self.ttl:
+            self.store.delete(key)
+            entry = None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key, content, usage=None):
+        entry = {"created": time.time(), "content": content}
+        if usage is not None:
+            entry["usage"] = {
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+            }
+        self.store.put(key, entry)
+
+    def stats(self):
+        with self.lock:
+            return f"{self.hits} hits / {self.misses} misses"
+
+
+def cached_completion(client, model, messages, cache=None, bypass=False, on_usage=None, on_first_token=None):
+    """
+    Stream a completion and return its full text, consulting cache first.
+
+    With bypass the cached answer is ignored but the fresh one is stored.
+    Errors are not cached. on_usage is called with the provider's usage
+    report of a fresh completion and on_first_token when its first text
+    arrives (neither is called for cache hits).
+    """
+    key = request_key(model, messages) if cache is not None else None
+    if cache is not None and not bypass:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["content"]
+
+    response_stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    usage_report = []
+    parts = []
+    for delta in iter_stream_deltas(response_stream, usage_report.append):
+        if not parts and on_first_token is not None:
+            on_first_token()
+        parts.append(delta)
+    content = "".join(parts)
+    usage = usage_report[-1] if usage_report else None
+    if usage is not None and on_usage is not None:
+        on_usage(usage)
+    if cache is not None:
+        cache.put(key, content, usage)
+    return content
@@ -0,0 +1,288 @@
+"""
+Local BM25 index over the literature PDFs, used to send only draft-relevant passages.
+
+Every PDF is split into small overlapping passages. Their BM25 term weights are
+kept in one sparse matrix (passages x vocabulary), so scoring all passages of a
+paper against every section of the draft is a single sparse product. The index
+is stored under the cache directory, keyed by the content hashes of the PDFs,
+and is only rebuilt when the set of papers changes.
+
+Needs numpy and scipy; Literature_Review.py imports this module only when
+retrieval is requested.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from openrouter_utils import CACHE_DIR, count_text_tokens, extract_pdf_text, file_digest, split_token_chunks
+
+RETRIEVAL_INDEX_DIR = os.path.join(CACHE_DIR, "retrieval")
+# Bump when chunking, tokenization or the stored format changes
+RETRIEVAL_INDEX_VERSION = 1
+# Number of corpus indexes kept on disk; older ones are deleted
+RETRIEVAL_INDEX_KEEP = 4
+# Passage size and the tokens each passage repeats from the one before
+RETRIEVAL_CHUNK_TOKENS = 250
+RETRIEVAL_CHUNK_OVERLAP = 50
+# Draft paragraphs are grouped into query sections of about this many tokens
+RETRIEVAL_SECTION_TOKENS = 400
+# Budget for the one-line-per-passage digest of everything not sent
+RETRIEVAL_DIGEST_TOKENS = 600
+# Characters of a passage kept in its digest line
+RETRIEVAL_DIGEST_CHARS = 160
+# Threads extracting PDFs while the index is built
+RETRIEVAL_EXTRACT_WORKERS = 4
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Temporary directories left by interrupted saves are removed after this long
+RETRIEVAL_TMP_MAX_AGE = 3600  # seconds
+
+# What loading a missing, stale or partially written index can raise
+INDEX_LOAD_ERRORS = (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile)
+
+_TERM_PATTERN = re.compile(r"[a-z0-9]+")
+_HEADING_PATTERN = re.compile(r"#+\s|\d+(\.\d+)*\.?\s+[A-Z]")
+STOPWORDS = frozenset(
+    "an and are as at be been but by can for from has have in into is it its may more not of on or our "
+    "such than that the their there these this those to was we were which while will with".split()
+)
+
+
+def terms(text):
+    """Lowercase word terms of text, without stopwords and single characters."""
+    return [term for term in _TERM_PATTERN.findall(text.lower()) if len(term) > 1 and term not in STOPWORDS]
+
+
+def draft_sections(text, section_tokens=RETRIEVAL_SECTION_TOKENS):
+    """Split the draft into query sections: headings start a new one, paragraphs are grouped up to section_tokens."""
+    sections = []
+    current = []
+    size = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_text_tokens(paragraph)
+        if current and (size + tokens > section_tokens or _HEADING_PATTERN.match(paragraph)):
+            sections.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += tokens
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+
+def corpus_key(digests):
+    """Name of the index for a set of PDFs (by content) under the current settings."""
+    settings = [RETRIEVAL_INDEX_VERSION, RETRIEVAL_CHUNK_TOKENS, RETRIEVAL_CHUNK_OVERLAP, BM25_K1, BM25_B]
+    canonical = json.dumps([settings, sorted(set(digests))])
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RetrievalIndex:
+    """
+    BM25 passage index of a corpus of PDFs.
+
+    weights is a CSR matrix with one row per passage; the passages of a PDF
+    are the contiguous rows start..end-1, where files[digest] = [start, end,
+    tokens of the full text].
+    """
+
+    def __init__(self, vocab, passages, files, weights):
+        self.vocab = vocab
+        self.passages = passages
+        self.files = files
+        self.weights = weights
+
+    @classmethod
+    def build(cls, texts):
+        """Index {pdf digest: extracted text}."""
+        vocab = {}
+        passages = []
+        files = {}
+        rows, cols, counts = [], [], []
+        for digest, text in texts.items():
+            start = len(passages)
+            for passage in split_token_chunks(text, RETRIEVAL_CHUNK_TOKENS, RETRIEVAL_CHUNK_OVERLAP):
+                for term, count in collections.Counter(terms(passage)).items():
+                    rows.append(len(passages))
+                    cols.append(vocab.setdefault(term, len(vocab)))
+                    counts.append(count)
+                passages.append(passage)
+            files[digest] = [start, len(passages), count_text_tokens(text)]
+
+        tf = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.float32), (rows, cols)), shape=(len(passages), len(vocab))
+        )
+        lengths = np.asarray(tf.sum(axis=1)).ravel()
+        average_length = lengths.mean() if len(passages) and lengths.mean() > 0 else 1.0
+        document_frequency = np.bincount(tf.indices, minlength=len(vocab))
+        idf = np.log1p((len(passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+        # BM25 weight of every stored (passage, term) pair, computed on the sparse data directly.
+        row_lengths = np.repeat(lengths, np.diff(tf.indptr))
+        weights = tf.copy()
+        weights.data = (
+            idf[tf.indices] * tf.data * (BM25_K1 + 1)
+            / (tf.data + BM25_K1 * (1 - BM25_B + BM25_B * row_lengths / average_length))
+        ).astype(np.float32)
+        return cls(vocab, passages, files, weights)
+
+    @classmethod
+    def load_or_build(cls, pdf_files, directory=RETRIEVAL_INDEX_DIR):
+        """Load the index of these PDFs from disk, building and storing it if needed."""
+        start = time.monotonic()
+        digests = {pdf_file: file_digest(pdf_file) for pdf_file in pdf_files}
+        path = os.path.join(directory, corpus_key(digests.values()))
+        try:
+            index = cls.load(path)
+            print(f"Retrieval index: loaded {len(index.passages)} passages in {time.monotonic() - start:.1f}s")
+            return index
+        except FileNotFoundError:
+            pass
+        except INDEX_LOAD_ERRORS as e:
+            print(f"Retrieval index at {path} is unreadable ({e!r}); rebuilding it")
+
+        def extract(pdf_file):
+            # Unreadable PDFs get no passages; the caller then sends (or reports) them as usual.
+            try:
+                return extract_pdf_text(pdf_file)
+            except Exception:
+                return ""
+
+        with ThreadPoolExecutor(max_workers=RETRIEVAL_EXTRACT_WORKERS) as pool:
+            texts = dict(zip(digests.values(), pool.map(extract, digests)))
+        index = cls.build(texts)
+        try:
+            index.save(path)
+            prune_indexes(directory)
+        except OSError as e:
+            print(f"Could not store retrieval index: {e}")
+        print(f"Retrieval index: built {len(index.passages)} passages, {len(index.vocab)} terms "
+              f"in {time.monotonic() - start:.1f}s")
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["version"] != RETRIEVAL_INDEX_VERSION:
+            raise ValueError("retrieval index version mismatch")
+        vocab = {term: column for column, term in enumerate(meta["terms"])}
+        weights = sparse.load_npz(os.path.join(path, "weights.npz")).tocsr()
+        # Refresh the directory's mtime so pruning keeps recently used indexes.
+        os.utime(path)
+        return cls(vocab, meta["passages"], meta["files"], weights)
+
+    def save(self, path):
+        """
+        Write the index to a temporary directory and rename it into place.
+
+        An existing directory at path is kept only if it holds a loadable
+        index (another process stored the same corpus first); a stale or
+        partial one is removed and replaced.
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            terms_by_column = sorted(self.vocab, key=self.vocab.get)
+            with open(os.path.join(tmp_path, "index.json"), "w", encoding="utf-8") as f:
+                json.dump({"version": RETRIEVAL_INDEX_VERSION, "terms": terms_by_column,
+                           "passages": self.passages, "files": self.files}, f)
+            sparse.save_npz(os.path.join(tmp_path, "weights.npz"), self.weights)
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                try:
+                    self.load(path)
+                    return
+                except INDEX_LOAD_ERRORS:
+                    shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def file_tokens(self, pdf_file):
+        """Tokens of the PDF's full extracted text (0 if it is not indexed)."""
+        return self.files.get(file_digest(pdf_file), (0, 0, 0))[2]
+
+    def queries(self, sections):
+        """Binary query matrix (sections x vocabulary) of the draft's sections."""
+        rows, cols = [], []
+        for row, section in enumerate(sections):
+            for column in {self.vocab[term] for term in terms(section) if term in self.vocab}:
+                rows.append(row)
+                cols.append(column)
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(sections), len(self.vocab))
+        )
+
+    def excerpt(self, pdf_file, queries, top_k, digest_tokens=RETRIEVAL_DIGEST_TOKENS):
+        """
+        The top_k passages of a PDF most relevant to any draft section, in
+        document order, followed by a short digest of the other passages.
+
+        Each section's scores are scaled to its best passage, so a long
+        section does not crowd out the others. Returns None if the PDF is
+        not indexed or has no more than top_k passages (send it whole).
+        """
+        start, end, _ = self.files.get(file_digest(pdf_file), (0, 0, 0))
+        count = end - start
+        if count <= top_k:
+            return None
+        scores = (self.weights[start:end] @ queries.T).toarray()
+        best = scores.max(axis=0)
+        best[best == 0] = 1
+        relevance = (scores / best).max(axis=1) if scores.shape[1] else np.zeros(count)
+        selected = set(np.argsort(-relevance, kind="stable")[:top_k].tolist())
+
+        lines = [f"Passages most relevant to the draft ({top_k} of {count} parts):"]
+        for number in sorted(selected):
+            lines.append(f"\n[Part {number + 1} of {count}]\n{self.passages[start + number]}")
+        others = [number for number in range(count) if number not in selected]
+        digest = [
+            f"- Part {number + 1}: {' '.join(self.passages[start + number].split())[:RETRIEVAL_DIGEST_CHARS]}"
+            for number in others
+        ]
+        # Thin the digest evenly until it fits its budget. Lines differ in
+        # length, so the stride that fits on average is only a starting point.
+        counts = [count_text_tokens(line) for line in digest]
+        stride = max(-(-sum(counts) // max(digest_tokens, 1)), 1)
+        while stride <= len(counts) and sum(counts[::stride]) > digest_tokens:
+            stride += 1
+        digest = digest[::stride] if stride <= len(counts) else []
+        if digest:
+            lines.append("\nDigest of the remaining parts (opening words of each):")
+            lines.extend(digest)
+        return "\n".join(lines)
+
+
+def prune_indexes(directory=RETRIEVAL_INDEX_DIR, keep=RETRIEVAL_INDEX_KEEP):
+    """Delete all but the most recently used corpus indexes."""
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if not name.endswith(".tmp"):
+            entries.append((mtime, path))
+        elif time.time() - mtime > RETRIEVAL_TMP_MAX_AGE:
+            shutil.rmtree(path, ignore_errors=True)
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,51 @@
+"""
+Shared test setup.
+
+The repository is a set of flat top-level modules, so its root goes on
+sys.path. Caches are redirected to a temporary directory, and when no
+Open_router_basics.py is configured the benchmark's stub config (no key, no
+network) stands in for it so Literature_Review.py can be imported.
+"""
+import os
+import re
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must be set before openrouter_utils is imported, which reads it once.
+os.environ["OPENROUTER_GUI_CACHE_DIR"] = tempfile.mkdtemp(prefix="openrouter_gui_tests.")
+
+try:
+    import Open_router_basics  # noqa: F401
+except ImportError:
+    from benchmark import STUB_CONFIG
+
+    config_dir = tempfile.mkdtemp(prefix="openrouter_gui_config.")
+    with open(os.path.join(config_dir, "Open_router_basics.py"), "w", encoding="utf-8") as f:
+        f.write(STUB_CONFIG)
+    sys.path.append(config_dir)
+
+import openrouter_utils
+
+
+class WordEncoding:
+    """Tokenizer with one token per word (plus its trailing whitespace), so counts are exact."""
+
+    def encode(self, text, disallowed_special=()):
+        return re.findall(r"^\s+|\S+\s*", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Count and split tokens by words instead of tiktoken (which may be unavailable offline)."""
+    monkeypatch.setattr(openrouter_utils, "get_encoding", WordEncoding)
+    openrouter_utils.clear_token_counts()
+    yield
+    openrouter_utils.clear_token_counts()
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+
+import pytest
+
+from chat_archive import ChatArchive, fts_query
+
+
+def chat(question, answer):
+    return [
+        {"role": "user", "display": question, "content": [{"type": "text", "text": question}]},
+        {"role": "assistant", "content": answer},
+    ]
+
+
+def names(hits):
+    return [hit[2] for hit in hits]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = ChatArchive(str(tmp_path / "archive.db"), legacy_path=None)
+    if not archive.fts_enabled:
+        pytest.skip("SQLite was built without FTS5")
+    yield archive
+    archive.close()
+
+
+def test_search_matches_names_and_messages(archive):
+    archive.add("Sourdough starter", chat("How do I feed a starter?", "Twice a day with flour and water."), [])
+    archive.add("Tax questions", chat("Can I deduct my sourdough hobby?", "Probably not."), [])
+    archive.add("Unrelated", chat("What is BM25?", "A ranking function."), [])
+
+    hits, _ = archive.search("sourdough")
+    # Name matches rank above message text matches.
+    assert names(hits) == ["Sourdough starter", "Tax questions"]
+    # The last term matches as a prefix, so results update while typing.
+    assert names(archive.search("rank")[0]) == ["Unrelated"]
+    assert "[flour]" in archive.search("flour")[0][0][3]
+
+
+def test_search_treats_operators_and_quotes_as_text(archive):
+    archive.add("Quotes", chat('He said "hello" AND left', "ok"), [])
+    assert names(archive.search('"hello" AND')[0]) == ["Quotes"]
+    assert archive.search("NEAR( OR")[0] == []
+    assert archive.search("   ") == ([], 0.0)
+    assert fts_query('say "hi"') == '"say" """hi"""*'
+
+
+def test_rename_and_delete_keep_the_index_in_step(archive):
+    archive_id = archive.add("Old name", chat("question", "answer"), [])
+    archive.rename(archive_id, "Gardening plans")
+    assert names(archive.search("gardening")[0]) == ["Gardening plans"]
+    assert archive.search("old")[0] == []
+
+    archive.delete(archive_id)
+    assert archive.search("gardening")[0] == []
+    assert archive.search("question")[0] == []
+
+
+def test_legacy_json_is_imported_once_and_indexed(tmp_path):
+    legacy = tmp_path / "chat_archives.json"
+    legacy.write_text(json.dumps([
+        {"name": "Imported chat", "date": "2024-01-02 03:04:05", "html": "<p>old</p>",
+         "conversation_history": chat("Where is the telescope?", "In the attic."), "attachments": []},
+        {"conversation_history": chat("Second one", "Reply")},
+    ]), encoding="utf-8")
+    db_path = str(tmp_path / "archive.db")
+
+    archive = ChatArchive(db_path, legacy_path=str(legacy))
+    assert [entry[2] for entry in archive.list_entries()] == ["Imported chat", "Archived Chat"]
+    assert not legacy.exists() and (tmp_path / "chat_archives.json.migrated").exists()
+    if archive.fts_enabled:
+        assert names(archive.search("telescope")[0]) == ["Imported chat"]
+    archive.close()
+
+    reopened = ChatArchive(db_path, legacy_path=str(legacy))
+    assert len(reopened.list_entries()) == 2
+    reopened.close()
+
+
+def test_archives_stored_before_the_index_existed_are_indexed(tmp_path):
+    db_path = str(tmp_path / "archive.db")
+    # An archive database as written before full-text search was added
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        """
+        CREATE TABLE archives (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, date TEXT NOT NULL);
+        CREATE TABLE archive_data (
+            archive_id INTEGER PRIMARY KEY REFERENCES archives(id) ON DELETE CASCADE,
+            conversation TEXT NOT NULL,
+            attachments TEXT NOT NULL
+        );
+        """
+    )
+    for number, (name, question) in enumerate([("Comets", "Where do comets come from?"),
+                                               ("Knitting", "Which yarn for socks?")], 1):
+        conn.execute("INSERT INTO archives (id, name, date) VALUES (?, ?, '2024-01-01')", (number, name))
+        conn.execute("INSERT INTO archive_data VALUES (?, ?, '[]')", (number, json.dumps(chat(question, "..."))))
+    conn.commit()
+    conn.close()
+
+    archive = ChatArchive(db_path, legacy_path=None)
+    if not archive.fts_enabled:
+        pytest.skip("SQLite was built without FTS5")
+    assert names(archive.search("yarn")[0]) == ["Knitting"]
+    archive.close()
+
+    # Opening again does not index the same archives twice.
+    archive = ChatArchive(db_path, legacy_path=None)
+    assert archive.conn.execute("SELECT count(*) FROM archive_fts").fetchone()[0] == 2
+    assert names(archive.search("comets")[0]) == ["Comets"]
+    archive.close()
+
+
+def test_search_without_fts_falls_back_to_substring_matching(archive):
+    archive.add("Comets", chat("Where do comets come from?", "The Oort cloud."), [])
+    archive.add("Knitting", chat("Which yarn for socks?", "Wool."), [])
+    archive.fts_enabled = False
+    assert names(archive.search("oort")[0]) == ["Comets"]
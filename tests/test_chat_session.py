@@ -0,0 +1,85 @@
+from chat_session import ChatSession, DEFAULT_SETTINGS, format_result
+from context_window import RESERVED_OUTPUT_TOKENS
+
+
+def make_session(model_context):
+    session = ChatSession(client=None, model_context=model_context, summarize=lambda previous, messages: "")
+    for turn in range(10):
+        session.history.append({"role": "user", "content": f"question {turn}", "tokens": 1_000})
+        session.history.append({"role": "assistant", "content": f"answer {turn}", "tokens": 1_000})
+    return session
+
+
+def test_unknown_context_length_sends_the_full_history():
+    session = make_session({})
+    messages, report = session.assemble_messages(session.history, ["unknown/model"], DEFAULT_SETTINGS)
+    assert len(messages) == 20
+    assert report["budget"] is None
+    assert report["dropped_messages"] == 0
+
+
+def test_known_context_length_limits_the_history():
+    session = make_session({"small/model": RESERVED_OUTPUT_TOKENS + 5_000})
+    # Models of unknown length do not lift the known model's limit.
+    messages, report = session.assemble_messages(
+        session.history, ["small/model", "unknown/model"], DEFAULT_SETTINGS
+    )
+    assert report["budget"] == 5_000
+    assert [m["content"] for m in messages] == ["question 8", "answer 8", "question 9", "answer 9"]
+    assert report["dropped_messages"] == 16
+
+
+def test_status_line_reports_dropped_messages():
+    result = {"stopped": False, "cached": False, "ttft": 0.5, "total_time": 1.0, "request_bytes": 2048,
+              "image_bytes": 0, "output_tokens": 10, "dropped_messages": 0}
+    assert "not sent" not in format_result(result)
+    result["dropped_messages"] = 16
+    assert "16 older messages not sent" in format_result(result)
+
+
+class RefusingClient:
+    """Client whose requests fail the test: nothing may be sent."""
+
+    class chat:
+        class completions:
+            @staticmethod
+            def create(**kwargs):
+                raise AssertionError("request sent after Stop")
+
+
+def test_stop_before_the_request_is_sent_bills_nothing():
+    session = ChatSession(RefusingClient, model_pricing={"m": {"input": 1, "output": 1}},
+                          summarize=lambda previous, messages: "")
+    # Stop pressed while the attachments and context were being prepared
+    session.cancel_event.set()
+    result = session.run("Hello there", {"model": "m", "stream": True})
+
+    assert result["stopped"]
+    # Logged as a streamed request even though no first token arrived
+    assert result["stream"] and result["ttft"] is None
+    assert result["input_tokens"] == result["output_tokens"] == 0
+    assert session.total_input_tokens == session.total_output_tokens == 0
+    assert session.total_cost == 0
+    assert session.history[-1] == {"role": "assistant", "content": "", "truncated": True}
+
+
+def test_reset_and_load_refuse_while_a_request_is_running():
+    session = make_session({})
+    session.is_processing = True
+    assert not session.reset()
+    assert not session.load([], [{"type": "pdf", "path": "a.pdf"}])
+    assert len(session.history) == 20 and session.attached_files == []
+
+    session.is_processing = False
+    assert session.load([], [{"type": "pdf", "path": "a.pdf"}])
+    assert session.history == [] and session.attached_files == [{"type": "pdf", "path": "a.pdf"}]
+    assert session.reset()
+
+
+def test_files_attached_during_a_request_are_kept():
+    session = ChatSession(RefusingClient, summarize=lambda previous, messages: "")
+    sent, late = {"type": "image", "path": "sent.png"}, {"type": "image", "path": "late.png"}
+    session.attached_files = [sent, late]
+    session.cancel_event.set()
+    session.run("Hello there", {"model": "m"}, attachments=[sent])
+    assert session.attached_files == [late]
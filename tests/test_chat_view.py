@@ -0,0 +1,271 @@
+import re
+import tkinter as tk
+
+import pytest
+
+try:
+    import tkhtmlview
+except ImportError:
+    tkhtmlview = None
+
+from chat_render import ChatRenderer, message_display_text, render_chat_html
+from chat_view import BLOCK_SEPARATOR, ChatView, _BlockTarget
+
+
+@pytest.fixture
+def root():
+    if tkhtmlview is None:
+        pytest.skip("tkhtmlview is not installed")
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        pytest.skip(f"no display for Tk: {e}")
+    root.withdraw()
+    yield root
+    root.destroy()
+
+
+def widget_text(widget):
+    # A block always ends with its separator; a full render strips trailing newlines.
+    return widget.get("1.0", "end-1c").rstrip("\n")
+
+
+def full_render_text(root, history):
+    reference = tkhtmlview.HTMLScrolledText(root)
+    reference.set_html(render_chat_html(history))
+    return widget_text(reference)
+
+
+def conversation(turns):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "display": f"Question {turn}\nwith a second line"})
+        history.append({"role": "assistant", "content": (
+            f"Answer **{turn}** with a list:\n\n- one\n- two\n\n```\ncode {turn}\n```\n\nAnd a closing line."
+        )})
+    return history
+
+
+def test_incremental_view_matches_a_full_render(root):
+    widget = tkhtmlview.HTMLScrolledText(root)
+    view = ChatView(widget, ChatRenderer(), expanded_messages=4)
+    history = conversation(3)
+    view.sync(history)
+
+    # Only the newest four messages are rendered; the first two are placeholders.
+    assert widget_text(widget).startswith("[+] You: Question 0 with a second line")
+    assert [block["collapsed"] for block in view.blocks] == [True, True, False, False, False, False]
+
+    # Stream a reply into the tail, as the session does.
+    history.append({"role": "user", "display": "Last question"})
+    reply = {"role": "assistant", "content": ""}
+    history.append(reply)
+    for text in ("Partial", "Partial answer", "Partial answer with `code`", "Partial answer with `code` done."):
+        reply["content"] = text
+        view.sync(history)
+    stopped = {"role": "assistant", "content": "", "truncated": True}
+    history += [{"role": "user", "display": "Stop this one"}, stopped]
+    view.sync(history)
+    assert sum(block["collapsed"] for block in view.blocks) == len(history) - 4
+
+    # Expanding every placeholder gives the same text as rendering the whole document.
+    for block in list(view.blocks):
+        view.expand(block)
+    assert not any(block["collapsed"] for block in view.blocks)
+    assert widget_text(widget) == full_render_text(root, history)
+    assert "[Response stopped]" in widget_text(widget)
+
+
+def test_changed_message_is_rerendered_in_place(root):
+    widget = tkhtmlview.HTMLScrolledText(root)
+    view = ChatView(widget, ChatRenderer())
+    history = conversation(2)
+    view.sync(history)
+
+    history[1] = {"role": "assistant", "content": "A *rewritten* answer."}
+    view.sync(history)
+    assert widget_text(widget) == full_render_text(root, history)
+
+    del history[2:]
+    view.sync(history)
+    assert widget_text(widget) == full_render_text(root, history)
+
+    view.clear()
+    assert widget_text(widget) == ""
+    view.sync(history)
+    assert widget_text(widget) == full_render_text(root, history)
+
+
+def deleted_offset(position, start, end):
+    """Where an offset ends up once the text between start and end is deleted."""
+    if position <= start:
+        return position
+    return start if position <= end else position - (end - start)
+
+
+class FakeText:
+    """
+    Display-free stand-in for a Text widget: one line of text, marks with
+    gravity and tag ranges, following Tk's rules for the indices the chat
+    view and its parser use ("1.0", "end", marks, "@0,0", "+Nc"/"-Nc").
+    """
+
+    def __init__(self):
+        # Like Tk, the text always ends with a newline that cannot be deleted.
+        self.text = "\n"
+        self.marks = {tk.INSERT: [0, tk.RIGHT]}
+        self.tags = {}
+        self.html_parser = FakeParser()
+
+    def offset(self, index):
+        base, *moves = re.findall(r"[+-]\d+c|[^+-]+", index)
+        if base == "1.0" or base.startswith("@"):
+            position = 0
+        elif base == tk.END:
+            position = len(self.text)
+        else:
+            position = self.marks[base][0]
+        position += sum(int(move[:-1]) for move in moves)
+        return max(0, min(position, len(self.text)))
+
+    def insert(self, index, chars, tags=()):
+        position = min(self.offset(index), len(self.text) - 1)
+        self.text = self.text[:position] + chars + self.text[position:]
+        for mark in self.marks.values():
+            if mark[0] > position or (mark[0] == position and mark[1] == tk.RIGHT):
+                mark[0] += len(chars)
+        for ranges in self.tags.values():
+            for span in ranges:
+                span[0] += len(chars) if span[0] >= position else 0
+                span[1] += len(chars) if span[1] > position else 0
+        for tag in (tags,) if isinstance(tags, str) else tags:
+            self.tags.setdefault(tag, []).append([position, position + len(chars)])
+
+    def delete(self, start, end=None):
+        start = self.offset(start)
+        end = min(self.offset(end) if end else start + 1, len(self.text) - 1)
+        if end <= start:
+            return
+        self.text = self.text[:start] + self.text[end:]
+        for mark in self.marks.values():
+            mark[0] = deleted_offset(mark[0], start, end)
+        for ranges in self.tags.values():
+            for span in ranges:
+                span[:] = [deleted_offset(p, start, end) for p in span]
+
+    def get(self, start, end=None):
+        start = self.offset(start)
+        return self.text[start:self.offset(end) if end else start + 1]
+
+    def index(self, index):
+        return f"1.{self.offset(index)}"
+
+    def mark_set(self, name, index):
+        gravity = self.marks.get(name, [0, tk.RIGHT])[1]
+        self.marks[name] = [self.offset(index), gravity]
+
+    def mark_gravity(self, name, direction):
+        self.marks[name][1] = direction
+
+    def mark_unset(self, name):
+        del self.marks[name]
+
+    def tag_add(self, name, start, end=None):
+        start = self.offset(start)
+        self.tags.setdefault(name, []).append([start, self.offset(end) if end else start + 1])
+
+    def tag_delete(self, name):
+        self.tags.pop(name, None)
+
+    def tag_text(self, name):
+        return "".join(self.text[start:end] for start, end in self.tags[name])
+
+    def tag_configure(self, name, **kwargs):
+        self.tags.setdefault(name, [])
+
+    tag_config = tag_configure
+
+    def tag_bind(self, name, sequence, func):
+        self.tags.setdefault(name, [])
+
+    def cget(self, option):
+        return tk.DISABLED
+
+    def config(self, **kwargs):
+        pass
+
+    def yview(self, *args):
+        return (0.0, 1.0)
+
+    def see(self, index):
+        pass
+
+
+class FakeParser:
+    """Appends a document's text at the insert mark and tags it, as the tkhtmlview parser does."""
+
+    def __init__(self):
+        self.images = []
+
+    def w_set_html(self, w, html, strip):
+        text = re.sub(r"<[^>]*>", "", html)
+        w.insert(tk.INSERT, text)
+        if w.get("end-2c", "end-1c") == " ":
+            w.delete("end-2c", "end-1c")
+            text = text[:-1]
+        w.tag_add("body", f"end-{len(text) + 1}c", "end-1c")
+
+
+class PlainRenderer:
+    def render_message(self, msg):
+        return message_display_text(msg)
+
+
+def test_block_target_maps_end_to_the_insert_mark():
+    target = _BlockTarget(FakeText(), "b7:")
+    assert target._index("end") == "insert"
+    assert target._index("end-1c") == "insert"
+    assert target._index("end-3c") == "insert+1c-3c"
+    assert [target._index(index) for index in ("1.0", "insert", "block3", None)] == ["1.0", "insert", "block3", None]
+
+    target.tag_config("bold")
+    target.tag_add("link", "1.0", "end-1c")
+    assert target.tags == {"b7:bold", "b7:link"}
+    assert "bold" not in target._widget.tags
+
+
+def block_text(widget, view, position):
+    end = view.blocks[position + 1]["mark"] if position + 1 < len(view.blocks) else "end-1c"
+    return widget.get(view.blocks[position]["mark"], end)
+
+
+def test_blocks_keep_their_marks_and_tags_in_step_with_the_text():
+    widget = FakeText()
+    view = ChatView(widget, PlainRenderer(), expanded_messages=2)
+    history = [{"role": "user", "display": f"Question {turn}"} for turn in range(4)]
+    view.sync(history)
+    assert [block["collapsed"] for block in view.blocks] == [True, True, False, False]
+    assert block_text(widget, view, 0) == "[+] You: Question 0" + BLOCK_SEPARATOR
+    assert block_text(widget, view, 3) == "Question 3" + BLOCK_SEPARATOR
+
+    # Expanding a block in the middle re-renders it in place, tagged by its prefix only.
+    view.expand(view.blocks[1])
+    second = view.blocks[1]
+    assert block_text(widget, view, 1) == "Question 1" + BLOCK_SEPARATOR
+    assert block_text(widget, view, 2) == "Question 2" + BLOCK_SEPARATOR
+    assert widget.tag_text(second["prefix"] + "body") == "Question 1"
+    assert second["prefix"] + "expand" not in widget.tags
+
+    # A changed message drops the later blocks with their marks and tags.
+    history[2] = {"role": "user", "display": "Rewritten"}
+    dropped = view.blocks[3]
+    view.sync(history)
+    assert dropped["mark"] not in widget.marks
+    assert not any(tag.startswith(dropped["prefix"]) for tag in widget.tags)
+    assert widget.text == "".join(
+        text + BLOCK_SEPARATOR for text in ("[+] You: Question 0", "Question 1", "Rewritten", "Question 3")
+    ) + "\n"
+
+    view.clear()
+    assert widget.text == "\n"
+    assert not any(mark.startswith("block") for mark in widget.marks)
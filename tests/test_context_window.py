@@ -0,0 +1,147 @@
+import json
+import types
+
+import pytest
+
+from context_window import (
+    ContextManager, context_budget, fetch_context_lengths, RESERVED_OUTPUT_TOKENS, SUMMARY_MAX_TOKENS,
+    CONTEXT_STRATEGY_FULL, CONTEXT_STRATEGY_PIN_FIRST, CONTEXT_STRATEGY_SLIDING, CONTEXT_STRATEGY_SUMMARY,
+)
+from openrouter_utils import REQUEST_OVERHEAD_TOKENS
+
+SYSTEM = [{"role": "system", "content": "system", "tokens": 10}]
+# Everything in a request besides the history
+FIXED = 10 + REQUEST_OVERHEAD_TOKENS
+
+
+def make_history(turns, tokens=100):
+    """turns user/assistant pairs whose messages carry precomputed token counts."""
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"question {turn}", "tokens": tokens})
+        history.append({"role": "assistant", "content": f"answer {turn}", "tokens": tokens})
+    return history
+
+
+def contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_everything_is_sent_when_it_fits():
+    history = make_history(3)
+    messages, report = ContextManager().build(SYSTEM, history, FIXED + 600)
+    assert messages == SYSTEM + history
+    assert report["dropped_messages"] == 0
+    assert report["kept_tokens"] == FIXED + 600
+
+
+def test_sliding_window_keeps_the_newest_whole_turns():
+    history = make_history(5)
+    # Room for two turns and a half: only whole turns are kept.
+    messages, report = ContextManager().build(SYSTEM, history, FIXED + 500, CONTEXT_STRATEGY_SLIDING)
+    assert contents(messages) == ["system", "question 3", "answer 3", "question 4", "answer 4"]
+    assert report["dropped_messages"] == 6
+    assert report["dropped_tokens"] == 600
+    assert report["kept_tokens"] == FIXED + 400 <= report["budget"]
+
+
+def test_newest_turn_is_sent_even_if_it_alone_exceeds_the_budget():
+    history = make_history(2, tokens=1_000)
+    messages, report = ContextManager().build(SYSTEM, history, FIXED + 500)
+    assert contents(messages) == ["system", "question 1", "answer 1"]
+    assert report["dropped_messages"] == 2
+
+
+def test_pin_first_keeps_the_first_turn_and_fills_from_the_newest():
+    history = make_history(5)
+    messages, report = ContextManager().build(SYSTEM, history, FIXED + 600, CONTEXT_STRATEGY_PIN_FIRST)
+    assert contents(messages) == ["system", "question 0", "answer 0", "question 3", "answer 3",
+                                  "question 4", "answer 4"]
+    assert report["dropped_messages"] == 4
+
+
+def test_pin_first_drops_the_first_turn_when_it_does_not_fit_next_to_the_newest():
+    history = make_history(3)
+    history[0]["tokens"] = 1_000
+    messages, _ = ContextManager().build(SYSTEM, history, FIXED + 400, CONTEXT_STRATEGY_PIN_FIRST)
+    assert contents(messages) == ["system", "question 1", "answer 1", "question 2", "answer 2"]
+
+
+def test_full_strategy_and_unknown_budget_send_everything():
+    history = make_history(5)
+    for strategy, budget in ((CONTEXT_STRATEGY_FULL, FIXED + 200), (CONTEXT_STRATEGY_SLIDING, None)):
+        messages, report = ContextManager().build(SYSTEM, history, budget, strategy)
+        assert messages == SYSTEM + history
+        assert report["dropped_messages"] == 0
+
+
+def test_summary_rolls_forward_over_newly_dropped_turns():
+    calls = []
+
+    def summarize(previous, messages):
+        calls.append(contents(messages))
+        return previous + f"[{len(messages)} msgs]"
+
+    manager = ContextManager(summarize=summarize)
+    history = make_history(6)
+    # Room for two turns next to the summary
+    budget = FIXED + SUMMARY_MAX_TOKENS + 400
+    messages, report = manager.build(SYSTEM, history, budget, CONTEXT_STRATEGY_SUMMARY)
+    assert messages[1]["content"].endswith("[8 msgs]")
+    assert contents(messages[2:]) == ["question 4", "answer 4", "question 5", "answer 5"]
+    assert report["summary_tokens"] > 0
+
+    # One more turn evicts one more: only that turn goes to the summarizer.
+    history += make_history(7)[-2:]
+    manager.build(SYSTEM, history, budget, CONTEXT_STRATEGY_SUMMARY)
+    assert calls[0] == ["question 0", "answer 0", "question 1", "answer 1", "question 2", "answer 2",
+                        "question 3", "answer 3"]
+    assert calls[1:] == [["question 4", "answer 4"]]
+
+
+def test_context_budget():
+    lengths = {"known/model": 100_000}
+    assert context_budget("known/model", lengths) == 100_000 - RESERVED_OUTPUT_TOKENS
+    assert context_budget("known/model", lengths, 20_000) == 20_000
+    # Unknown models have no budget unless the user set one.
+    assert context_budget("unknown/model", lengths) is None
+    assert context_budget("unknown/model", lengths, 20_000) == 20_000
+
+
+class FakeModels:
+    def __init__(self, models=None, error=None):
+        self.models = models or []
+        self.error = error
+        self.calls = 0
+
+    def list(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return types.SimpleNamespace(data=self.models)
+
+
+def test_fetch_context_lengths_caches_on_disk(tmp_path):
+    path = str(tmp_path / "model_context.json")
+    models = FakeModels([
+        types.SimpleNamespace(id="google/gemini-2.5-pro", context_length=1_048_576),
+        types.SimpleNamespace(id="no/length", context_length=None),
+    ])
+    client = types.SimpleNamespace(models=models)
+
+    assert fetch_context_lengths(client, path=path) == {"google/gemini-2.5-pro": 1_048_576}
+    assert fetch_context_lengths(client, path=path) == {"google/gemini-2.5-pro": 1_048_576}
+    assert models.calls == 1
+    # Expired: fetched again.
+    fetch_context_lengths(client, path=path, max_age=0)
+    assert models.calls == 2
+
+
+@pytest.mark.parametrize("cached, expected", [(None, {}), ({"a/model": 8_000}, {"a/model": 8_000})])
+def test_fetch_context_lengths_falls_back_to_the_stale_cache(tmp_path, cached, expected):
+    path = str(tmp_path / "model_context.json")
+    if cached is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cached, f)
+    client = types.SimpleNamespace(models=FakeModels(error=OSError("offline")))
+    assert fetch_context_lengths(client, path=path, max_age=0) == expected
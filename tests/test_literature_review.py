@@ -0,0 +1,134 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import Literature_Review
+from Literature_Review import (
+    NoteManifest, chunked_note, note_merge_messages, note_part_messages, note_prompt_version, prompt_tokens,
+)
+
+DRAFT = "Draft about sparse retrieval for literature reviews. " * 20
+
+
+def numbered_words(count):
+    return " ".join(f"w{i}" for i in range(count))
+
+
+class FakeModel:
+    """complete(messages) stand-in that records every prompt and answers with a fixed-size summary."""
+
+    def __init__(self, summary_words):
+        self.summary_words = summary_words
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def __call__(self, messages):
+        with self.lock:
+            self.prompts.append(messages)
+            number = len(self.prompts)
+        return " ".join(f"s{number}_{i}" for i in range(self.summary_words))
+
+
+@pytest.fixture
+def small_parts(monkeypatch):
+    monkeypatch.setattr(Literature_Review, "NOTE_CHUNK_TOKENS", 2_000)
+    monkeypatch.setattr(Literature_Review, "NOTE_CHUNK_OVERLAP_TOKENS", 50)
+    monkeypatch.setattr(Literature_Review, "NOTE_MIN_CHUNK_TOKENS", 100)
+
+
+def test_chunked_note_prompts_stay_within_budget(word_tokens, small_parts):
+    budget = 3_000
+    # Three summaries only just fit in a merge prompt, so their labels must be counted too.
+    merge_room = budget - prompt_tokens(note_merge_messages(DRAFT, "paper.pdf", []))
+    model = FakeModel(summary_words=merge_room // 3 - 1)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        note = chunked_note(DRAFT, "paper.pdf", numbered_words(30_000), model, pool, budget)
+
+    part_prompts = [m for m in model.prompts if "Below is part" in m[1]["content"][-1]["text"]]
+    merge_prompts = [m for m in model.prompts if "Merge the part summaries" in m[1]["content"][-1]["text"]]
+    assert len(part_prompts) >= 10
+    # The part summaries do not fit in one merge prompt, so there is more than one round.
+    assert len(merge_prompts) > 1
+    for messages in model.prompts:
+        assert prompt_tokens(messages) <= budget
+    # The note is the output of the last merge.
+    assert note.startswith(f"s{len(model.prompts)}_")
+
+
+def test_chunked_note_parts_cover_the_paper(word_tokens, small_parts):
+    model = FakeModel(summary_words=10)
+    text = numbered_words(5_000)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        chunked_note(DRAFT, "paper.pdf", text, model, pool, 3_000)
+
+    parts = [m[1]["content"][-1]["text"].split("):\n", 1)[1] for m in model.prompts if "Below is part" in
+             m[1]["content"][-1]["text"]]
+    sent = set(word for part in parts for word in part.split())
+    assert sent == set(text.split())
+
+
+def test_chunked_note_rejects_a_draft_that_leaves_no_room(word_tokens, small_parts):
+    # Room for 50 tokens of paper text, below NOTE_MIN_CHUNK_TOKENS
+    budget = prompt_tokens(note_part_messages(DRAFT, "paper.pdf", "", 1, 1)) + 50
+    with ThreadPoolExecutor(max_workers=1) as pool, pytest.raises(ValueError):
+        chunked_note(DRAFT, "paper.pdf", numbered_words(5_000), FakeModel(10), pool, budget)
+
+
+def manifest_entry(file="a.pdf", pdf="pdf1", draft="draft1", model="m", version="v1", summary="note"):
+    return {"file": file, "pdf_sha256": pdf, "draft_sha256": draft, "model": model,
+            "prompt_version": version, "summary": summary}
+
+
+def test_manifest_resumes_checkpointed_summaries(tmp_path):
+    output = str(tmp_path / "notes.json")
+    manifest = NoteManifest(output)
+    manifest.append(manifest_entry(file="a.pdf", summary="note a"))
+    manifest.append(manifest_entry(file="b.pdf", pdf="pdf2", summary="note b"))
+
+    resumed = NoteManifest(output).load()
+    assert resumed.get(NoteManifest.key(manifest_entry(file="a.pdf"))) == "note a"
+    assert resumed.get(NoteManifest.key(manifest_entry(file="b.pdf", pdf="pdf2"))) == "note b"
+
+
+@pytest.mark.parametrize("changed", [
+    {"pdf": "pdf2"}, {"draft": "draft2"}, {"model": "other"}, {"version": "v2"},
+])
+def test_manifest_misses_when_anything_changed(tmp_path, changed):
+    output = str(tmp_path / "notes.json")
+    NoteManifest(output).append(manifest_entry())
+    assert NoteManifest(output).load().get(NoteManifest.key(manifest_entry(**changed))) is None
+
+
+def test_manifest_ignores_torn_lines_and_keeps_the_newest(tmp_path):
+    output = str(tmp_path / "notes.json")
+    manifest = NoteManifest(output)
+    manifest.append(manifest_entry(summary="old"))
+    manifest.append(manifest_entry(summary="new"))
+    with open(manifest.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(manifest_entry(file="c.pdf"))[:30])
+
+    resumed = NoteManifest(output).load()
+    assert resumed.get(NoteManifest.key(manifest_entry())) == "new"
+    assert len(resumed.entries) == 1
+
+
+def test_manifest_compact_keeps_one_entry_per_file(tmp_path):
+    output = str(tmp_path / "notes.json")
+    manifest = NoteManifest(output)
+    manifest.append(manifest_entry(pdf="pdf1", summary="first"))
+    manifest.append(manifest_entry(pdf="pdf2", summary="second"))
+    manifest.compact()
+
+    with open(manifest.path, "r", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [entry["summary"] for entry in lines] == ["second"]
+
+
+def test_prompt_version_changes_with_budget_parts_and_retrieval(monkeypatch):
+    base = note_prompt_version(100_000)
+    assert note_prompt_version(50_000) != base
+    assert note_prompt_version(100_000, retrieve_top_k=12) != base
+    monkeypatch.setattr(Literature_Review, "NOTE_CHUNK_TOKENS", 32_000)
+    assert note_prompt_version(100_000) != base
@@ -0,0 +1,47 @@
+import openrouter_utils
+from openrouter_utils import count_text_tokens, split_token_chunks
+
+
+def numbered_words(count):
+    return " ".join(f"w{i}" for i in range(count))
+
+
+def test_split_token_chunks_overlap_and_boundaries(word_tokens):
+    text = numbered_words(1000)
+    chunks = split_token_chunks(text, 100, 20)
+
+    assert chunks[0].startswith("w0 ")
+    assert chunks[-1].endswith("w999")
+    for chunk in chunks:
+        assert count_text_tokens(chunk) <= 100
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Each chunk starts with the last 20 tokens of the one before it.
+        assert previous.split()[-20:] == chunk.split()[:20]
+    # Dropping the overlaps gives back the text, with no word lost or repeated.
+    words = chunks[0].split() + [word for chunk in chunks[1:] for word in chunk.split()[20:]]
+    assert words == text.split()
+
+
+def test_split_token_chunks_short_text_is_one_chunk(word_tokens):
+    assert split_token_chunks("just a few words", 100, 20) == ["just a few words"]
+
+
+def test_split_token_chunks_last_chunk_is_not_only_overlap(word_tokens):
+    # 180 tokens in parts of 100 with an overlap of 20: a third part would
+    # only repeat the end of the second.
+    chunks = split_token_chunks(numbered_words(180), 100, 20)
+    assert len(chunks) == 2
+    assert chunks[1].split()[-1] == "w179"
+
+
+def test_split_token_chunks_without_tokenizer(monkeypatch):
+    # Without tiktoken, chunks fall back to ~4 characters per token.
+    monkeypatch.setattr(openrouter_utils, "get_encoding", lambda: None)
+    text = "abcdefghij" * 100
+    chunks = split_token_chunks(text, 50, 10)
+
+    for chunk in chunks:
+        assert len(chunk) <= 200
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous[-40:] == chunk[:40]
+    assert chunks[0] + "".join(chunk[40:] for chunk in chunks[1:]) == text
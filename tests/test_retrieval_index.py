@@ -0,0 +1,128 @@
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip("scipy")
+
+from scipy import sparse
+
+import retrieval_index
+from openrouter_utils import count_text_tokens, file_digest
+from retrieval_index import RetrievalIndex, prune_indexes, RETRIEVAL_TMP_MAX_AGE
+
+DIGEST_HEADER = "\nDigest of the remaining parts (opening words of each):\n"
+
+
+def topic_paper(sections=10):
+    """sections blocks of 200 words; block i mentions topic<i> only in its middle."""
+    blocks = []
+    for i in range(sections):
+        words = [f"filler{i}x{j}" for j in range(200)]
+        words[60:140] = [f"topic{i}"] * 80
+        blocks.append(" ".join(words))
+    return " ".join(blocks)
+
+
+def write_pdf(tmp_path, name, text):
+    # Only the file's content digest is used by the index, not its format.
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def digest_lines(excerpt):
+    if DIGEST_HEADER not in excerpt:
+        return []
+    return excerpt.split(DIGEST_HEADER, 1)[1].split("\n")
+
+
+def test_excerpt_sends_the_relevant_passages_in_document_order(tmp_path, word_tokens):
+    text = topic_paper()
+    pdf = write_pdf(tmp_path, "paper.pdf", text)
+    index = RetrievalIndex.build({file_digest(pdf): text})
+    # 250-token passages every 200 tokens: passage i holds block i.
+    assert len(index.passages) == 10
+
+    excerpt = index.excerpt(pdf, index.queries(["topic7", "topic3"]), top_k=2)
+    assert excerpt.startswith("Passages most relevant to the draft (2 of 10 parts):")
+    assert excerpt.index("[Part 4 of 10]") < excerpt.index("[Part 8 of 10]")
+    assert "[Part 1 of 10]" not in excerpt
+    assert len(digest_lines(excerpt)) == 8
+
+
+def test_excerpt_is_none_for_short_or_unindexed_papers(tmp_path, word_tokens):
+    text = topic_paper(sections=3)
+    pdf = write_pdf(tmp_path, "paper.pdf", text)
+    index = RetrievalIndex.build({file_digest(pdf): text})
+    queries = index.queries(["topic1"])
+    assert index.excerpt(pdf, queries, top_k=len(index.passages)) is None
+    assert index.excerpt(write_pdf(tmp_path, "other.pdf", "other"), queries, top_k=1) is None
+
+
+def test_excerpt_digest_stays_within_budget(tmp_path, word_tokens):
+    # Digest lines alternate between ~80 tokens and 1 token, so thinning with
+    # the stride that fits on average would keep only the long ones.
+    passages = ["first"] + ["a " * 100 if number % 2 else "x" * 200 for number in range(1, 41)]
+    pdf = write_pdf(tmp_path, "paper.pdf", "uneven")
+    index = RetrievalIndex(
+        {"first": 0}, passages, {file_digest(pdf): [0, len(passages), 0]},
+        sparse.csr_matrix((len(passages), 1), dtype="float32"),
+    )
+    queries = index.queries(["first"])
+    for budget in (1, 50, 250, 1_000, 10_000):
+        lines = digest_lines(index.excerpt(pdf, queries, top_k=1, digest_tokens=budget))
+        assert sum(count_text_tokens(line) for line in lines if line) <= budget
+    # A budget that holds everything keeps every line.
+    assert len(digest_lines(index.excerpt(pdf, queries, top_k=1, digest_tokens=10_000))) == 40
+
+
+def test_save_replaces_a_stale_index(tmp_path, word_tokens):
+    text = topic_paper(sections=3)
+    index = RetrievalIndex.build({"digest": text})
+    path = str(tmp_path / "corpus")
+    os.makedirs(path)
+    with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": -1}, f)
+
+    index.save(path)
+    loaded = RetrievalIndex.load(path)
+    assert loaded.passages == index.passages
+    assert (loaded.weights != index.weights).nnz == 0
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_save_keeps_an_index_stored_first(tmp_path, word_tokens):
+    path = str(tmp_path / "corpus")
+    RetrievalIndex.build({"digest": topic_paper(sections=3)}).save(path)
+    RetrievalIndex.build({"digest": topic_paper(sections=4)}).save(path)
+    assert len(RetrievalIndex.load(path).passages) == 3
+
+
+def test_load_or_build_rebuilds_an_unreadable_index(tmp_path, monkeypatch, word_tokens):
+    monkeypatch.setattr(retrieval_index, "extract_pdf_text", lambda pdf_file: topic_paper(sections=3))
+    pdf = write_pdf(tmp_path, "paper.pdf", "paper")
+    directory = str(tmp_path / "indexes")
+    first = RetrievalIndex.load_or_build([pdf], directory=directory)
+    (stored,) = os.listdir(directory)
+    with open(os.path.join(directory, stored, "weights.npz"), "wb") as f:
+        f.write(b"torn")
+
+    rebuilt = RetrievalIndex.load_or_build([pdf], directory=directory)
+    assert rebuilt.passages == first.passages
+    assert len(RetrievalIndex.load(os.path.join(directory, stored)).passages) == len(first.passages)
+
+
+def test_prune_keeps_recent_indexes_and_removes_abandoned_temp_dirs(tmp_path):
+    now = time.time()
+    for age, name in enumerate(["newest", "newer", "older", "oldest"]):
+        os.makedirs(tmp_path / name)
+        os.utime(tmp_path / name, (now - age, now - age))
+    os.makedirs(tmp_path / "saving.tmp")
+    os.makedirs(tmp_path / "abandoned.tmp")
+    stale = now - RETRIEVAL_TMP_MAX_AGE - 1
+    os.utime(tmp_path / "abandoned.tmp", (stale, stale))
+
+    prune_indexes(str(tmp_path), keep=2)
+    assert sorted(os.listdir(tmp_path)) == ["newer", "newest", "saving.tmp"]